@@ -6,6 +6,21 @@
 # https://rasa.com/docs/rasa/custom-actions
 # https://rasa.com/docs/action-server/
 # https://rasa.com/docs/rasa/forms
+# https://rasa.com/docs/action-server/sdk-actions#methods  <-- run() can be a coroutine
+# Every action is decorated with @instrument (see instrumentation.py), which records its duration and
+# database queries. Set GALLERY_METRICS_PORT to serve these metrics to Prometheus.
+# Set GALLERY_PREWARM_CATALOG=1 to load the most popular artworks in the catalog cache at startup
+# (in a background thread, so the action server does not wait for it to start).
+# The messages of the info card, minimum bid and bid list actions are cached until the data they show
+# changes (see response_cache.py).
+# Set GALLERY_BID_JOURNAL to the path of a journal file to acknowledge the bids once they are saved in
+# the journal, and write them to the database in batches (see bid_journal.py).
+# Set GALLERY_CATALOG_SNAPSHOT to the path of a snapshot exported by export_catalog.py to read the catalog
+# (artwork information and search) from it instead of the database (see catalog_snapshot.py).
+# The logged-in user of a conversation is found by get_user(), and their bids are kept in memory for the
+# following turns (see portfolio_cache.py).
+# When an artwork ID code is not valid or does not exist, the closest existing codes are suggested as buttons
+# (see artwork_suggestions.py).
 #####################################################
 from typing import Any, Text, Dict, List
 
@@ -13,9 +28,25 @@ from rasa_sdk import Action, Tracker, FormValidationAction
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import SlotSet, AllSlotsReset
 from rasa_sdk.types import DomainDict
+import atexit
 import datetime
-from . import db_handler
-import re  # for regex pattern-matching
+import os
+import threading
+from . import async_db_handler, db_handler
+from .artwork_suggestions import ARTWORK_ID_PATTERN
+from .bid_journal import BidJournal
+from .instrumentation import instrument, start_metrics_server
+from .response_cache import cached_response
+
+if os.environ.get('GALLERY_METRICS_PORT'):  # e.g. 9100, then scrape http://localhost:9100/metrics
+    start_metrics_server(int(os.environ['GALLERY_METRICS_PORT']), os.environ.get('GALLERY_METRICS_HOST', '127.0.0.1'))
+if os.environ.get('GALLERY_PREWARM_CATALOG', '0') != '0':
+    threading.Thread(target=db_handler.prewarm_catalog_cache, name='catalog-prewarm', daemon=True).start()
+bid_journal = None
+if os.environ.get('GALLERY_BID_JOURNAL'):  # e.g. bids.journal, see bid_journal.py
+    bid_journal = BidJournal(os.environ['GALLERY_BID_JOURNAL'])
+    bid_journal.open()  # replays the bids that were not written to the database before a crash
+    atexit.register(bid_journal.close)
 
 
 def is_valid_artwork_id(id_code: str):
@@ -24,21 +55,63 @@ def is_valid_artwork_id(id_code: str):
     :param id_code: string
     :return: true if the input is in the format ABC123 (3 capital letters followed by 3 digits)
     """
-    if id_code is not None and re.match(r"^[A-Z]{3}\d{3}$", id_code):
+    if id_code is not None and ARTWORK_ID_PATTERN.match(id_code):
         return True
     else:
         return False
 
 
+async def utter_artwork_suggestions(dispatcher: CollectingDispatcher, text: Text, artwork_id: Text, intent: Text,
+                                    retry_text: Text = "Please try again."):
+    """
+    Utters text (which tells that artwork_id is not valid or does not exist), followed by the existing artwork
+    ID codes closest to artwork_id as buttons that send intent with the code, or by retry_text if there are none.
+    :param dispatcher: dispatcher of the action
+    :param text: message to the user
+    :param artwork_id: artwork ID code given by the user (string or None)
+    :param intent: intent of the buttons (e.g. ask_minimum_bid)
+    :param retry_text: text added to the message when no artwork ID code is close to artwork_id
+    """
+    suggestions = await async_db_handler.suggest_artwork_ids(artwork_id) if isinstance(artwork_id, str) else []
+    if suggestions:
+        buttons = [{'payload': f'/{intent}{{"artwork_id": "{suggestion}"}}', 'title': suggestion}
+                   for suggestion in suggestions]
+        dispatcher.utter_message(text=f"{text} Did you mean one of these artworks?", buttons=buttons)
+    else:
+        dispatcher.utter_message(text=f"{text} {retry_text}".rstrip())
+
+
+# Logged-in user when a conversation does not tell who the user is (e.g. in Rasa X, where the sender id is random)
+DEFAULT_USER_NAME = os.environ.get('GALLERY_DEFAULT_USER', 'Foo')
+
+
+async def get_user(tracker: Tracker):
+    """
+    Finds the logged-in user of a conversation: the user_name given in the metadata of the message (e.g. by
+    the web application), or else the sender id of the conversation if it is the name of a user, or else
+    DEFAULT_USER_NAME. The bids of the user are loaded in memory the first time (see portfolio_cache.py).
+    :param tracker: tracker of the conversation
+    :return: Portfolio of the user (its user_name attribute is the name of the user)
+    """
+    metadata = tracker.latest_message.get('metadata') or {}
+    for user_name in (metadata.get('user_name'), tracker.sender_id):
+        if user_name:
+            portfolio = await async_db_handler.get_portfolio(user_name)
+            if portfolio.exists:
+                return portfolio
+    return await async_db_handler.get_portfolio(DEFAULT_USER_NAME)
+
+
+@instrument
 class ActionAuctionSchedule(Action):
     """Class that corresponds to the action that gets the auction schedule."""
 
     def name(self) -> Text:
         return "action_auction_schedule"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         today = datetime.date.today()
         delta = datetime.timedelta(days=+3)
         next_auction_date = today + delta
@@ -49,55 +122,81 @@ class ActionAuctionSchedule(Action):
         return []
 
 
+@instrument
 class ActionUserBidList(Action):
     """This action gets the list of bids (and the values) for the logged-in user
-    (which is Foo by default). The returned message contains a button for each bid
+    (see get_user()). The returned message contains a button for each bid
     where the artwork id and bid value are displayed. By clicking on the button, the
-    user gets more info about the artwork (full info card)."""
+    user gets more info about the artwork (full info card). The bids are shown one page
+    at a time, with a "next page" button that gives the bids after the last one shown."""
+
+    bids_per_page = 10
 
     def name(self) -> Text:
         return "action_user_bid_list"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        bid_list = db_handler.get_bids_for_user('Foo')
+    async def render(self, user_name: Text, after_artwork_id: Text) -> Dict[Text, Any]:
+        """Builds the message for the page of bids after after_artwork_id (None for the first page)."""
+        # fetch one extra bid to know if there is a next page
+        bid_list = await async_db_handler.get_bids_for_user(user_name, after_artwork_id, self.bids_per_page + 1)
+        has_next_page = len(bid_list) > self.bids_per_page
+        bid_list = bid_list[:self.bids_per_page]
         if len(bid_list) < 1:
-            dispatcher.utter_message(text="You have not submitted any bids yet for the current auction.")
-        else:
-            if len(bid_list) == 1:
-                text = "You have submitted a single bid for the current auction. Click on the artwork ID code " \
-                       "below for more information."
+            if after_artwork_id is None:
+                return {'text': "You have not submitted any bids yet for the current auction."}
             else:
-                text = f"You have submitted bids for {len(bid_list)} artworks. Click on one of the artwork ID codes " \
-                       f"below for more information."
-            buttons = []
-            for pair in bid_list:
-                buttons.append({'payload': f'/ask_artwork_info_card{{"artwork_id": "{pair[0]}"}}',
-                                'title': f'{pair[0]} (${pair[1]})'})
-            dispatcher.utter_message(text=text, buttons=buttons)
-
-        return [SlotSet('artwork_id', None)]  # just in case
-
-
+                return {'text': "There are no more bids to show."}
+        if after_artwork_id is None and not has_next_page:  # all the bids are on this page
+            num_bids = len(bid_list)
+        else:
+            num_bids = await async_db_handler.count_bids_for_user(user_name)
+        if num_bids == 1:
+            text = "You have submitted a single bid for the current auction. Click on the artwork ID code " \
+                   "below for more information."
+        else:
+            text = f"You have submitted bids for {num_bids} artworks. Click on one of the artwork ID codes " \
+                   f"below for more information."
+        buttons = []
+        for pair in bid_list:
+            buttons.append({'payload': f'/ask_artwork_info_card{{"artwork_id": "{pair[0]}"}}',
+                            'title': f'{pair[0]} (${pair[1]})'})
+        if has_next_page:
+            buttons.append({'payload': f'/get_bid_list{{"bid_list_after": "{bid_list[-1][0]}"}}',
+                            'title': 'next page'})
+        return {'text': text, 'buttons': buttons}
+
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        after_artwork_id = tracker.get_slot('bid_list_after')  # set by the "next page" button
+        user_name = (await get_user(tracker)).user_name
+        # the message only changes when the user writes a bid
+        key = (self.name(), after_artwork_id, user_name, db_handler.data_versions.user(user_name))
+        response = await cached_response(key, lambda: self.render(user_name, after_artwork_id))
+        dispatcher.utter_message(**response)
+
+        return [SlotSet('artwork_id', None), SlotSet('bid_list_after', None)]  # just in case
+
+
+@instrument
 class ActionNumberBidsOnArtwork(Action):
     """This action checks how many people have bid on a given artwork."""
 
     def name(self) -> Text:
         return "action_num_bids_on_artwork"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         artwork_id = tracker.get_slot('artwork_id')
         if is_valid_artwork_id(artwork_id):
-            artwork = db_handler.get_artwork_info(artwork_id)
+            artwork = await async_db_handler.get_artwork_info(artwork_id)
             if artwork is None:
-                dispatcher.utter_message(
-                    text=f"Sorry, there is no artwork with ID code {artwork_id}. Please try again.")
+                await utter_artwork_suggestions(dispatcher, f"Sorry, there is no artwork with ID code {artwork_id}.",
+                                                artwork_id, 'ask_num_bids_on_artwork')
                 return [SlotSet('artwork_id', None)]  # empty the artwork_id slot
             else:
-                num_bids = len(artwork.bidders)
+                num_bids = artwork.bid_count
                 if num_bids == 0:
                     text = f"No bids have been submitted for artwork {artwork_id} (\"{artwork.title}\" by " \
                            f"{artwork.artist_name})."
@@ -107,86 +206,163 @@ class ActionNumberBidsOnArtwork(Action):
                 dispatcher.utter_message(text=text)
                 return [SlotSet('artwork_id', None)]
         else:
-            dispatcher.utter_message(text=f"Sorry, {artwork_id} is not a valid artwork ID code. Make sure you use "
-                                          f"capital letters (e.g. ABC123 or WEB563).")
+            await utter_artwork_suggestions(dispatcher, f"Sorry, {artwork_id} is not a valid artwork ID code.",
+                                            artwork_id, 'ask_num_bids_on_artwork',
+                                            "Make sure you use capital letters (e.g. ABC123 or WEB563).")
             return [SlotSet('artwork_id', None)]  # empty the artwork_id slot
 
 
+@instrument
 class ActionArtworkInfoCard(Action):
     """This action displays the artwork info card (all available information about the artwork)."""
 
     def name(self) -> Text:
         return "action_artwork_info_card"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def render(self, artwork_id: Text, user_name: Text) -> Dict[Text, Any]:
+        """Builds the info card message, or returns None if the artwork does not exist."""
+        artwork = await async_db_handler.get_artwork_info(artwork_id)
+        if artwork is None:
+            return None
+        text = f"Title: {artwork.title}\nArtist: {artwork.artist_name}\nID code: {artwork_id}\nCategory: " \
+               f"{artwork.category}\nMedium: {artwork.medium}\nMinimum bid: ${artwork.min_bid}\n" \
+               f"Current number of bids: {artwork.bid_count}"
+        # check if the user has bid on the artwork
+        bid = await async_db_handler.get_bid_info(user_name, artwork_id)
+        if bid is None:
+            text += "\nYou have not submitted a bid for this artwork."
+        else:
+            text += f"\nYour bid: ${bid.value}"
+        return {'text': text}
+
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         artwork_id = tracker.get_slot('artwork_id')
         if is_valid_artwork_id(artwork_id):
-            artwork = db_handler.get_artwork_info(artwork_id)
-            if artwork is None:
-                dispatcher.utter_message(
-                    text=f"Sorry, there is no artwork with ID code {artwork_id}. Please try again.")
+            user_name = (await get_user(tracker)).user_name
+            # the card changes with every bid on the artwork (number of bids, bid of the logged-in user)
+            key = (self.name(), artwork_id, user_name, db_handler.data_versions.artwork(artwork_id))
+            response = await cached_response(key, lambda: self.render(artwork_id, user_name))
+            if response is None:
+                await utter_artwork_suggestions(dispatcher, f"Sorry, there is no artwork with ID code {artwork_id}.",
+                                                artwork_id, 'ask_artwork_info_card')
                 return [SlotSet('artwork_id', None)]  # empty the artwork_id slot
             else:
-                text = f"Title: {artwork.title}\nArtist: {artwork.artist_name}\nID code: {artwork_id}\nCategory: " \
-                       f"{artwork.category}\nMedium: {artwork.medium}\nMinimum bid: ${artwork.min_bid}\n" \
-                       f"Current number of bids: {len(artwork.bidders)}"
-                # check if logged-in user (Foo by default) has bid on the artwork
-                bid = db_handler.get_bid_info('Foo', artwork_id)
-                if bid is None:
-                    text += "\nYou have not submitted a bid for this artwork."
-                else:
-                    text += f"\nYour bid: ${bid.value}"
-                dispatcher.utter_message(text=text)
+                dispatcher.utter_message(**response)
                 return []
         else:  # not a valid artwork id code
-            dispatcher.utter_message(text=f"Sorry, {artwork_id} is not a valid artwork ID code. Make sure you use "
-                                          f"capital letters (e.g. ABC123 or WEB563).")
+            await utter_artwork_suggestions(dispatcher, f"Sorry, {artwork_id} is not a valid artwork ID code.",
+                                            artwork_id, 'ask_artwork_info_card',
+                                            "Make sure you use capital letters (e.g. ABC123 or WEB563).")
             return [SlotSet('artwork_id', None)]  # empty the artwork_id slot
 
 
+@instrument
 class ActionMinimumBid(Action):
     """This action gets the minimum bid value for an artwork. It also tells the title and artist name."""
 
     def name(self) -> Text:
         return "action_minimum_bid"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def render(self, artwork_id: Text) -> Dict[Text, Any]:
+        """Builds the message, or returns None if the artwork does not exist."""
+        artwork = await async_db_handler.get_catalog_entry(artwork_id)
+        if artwork is None:
+            return None
+        return {'text': f"{artwork_id} is the ID code for the artwork \"{artwork.title}\" by {artwork.artist_name}. "
+                        f"The minimum bid is ${artwork.min_bid}."}
+
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         artwork_id = tracker.get_slot('artwork_id')
         if is_valid_artwork_id(artwork_id):
-            artwork = db_handler.get_artwork_info(artwork_id)
-            if artwork is None:
-                dispatcher.utter_message(
-                    text=f"Sorry, there is no artwork with ID code {artwork_id}. Please try again.")
+            # The message only shows the catalog, so the bids on the artwork do not make it stale
+            key = (self.name(), artwork_id, None, db_handler.data_versions.catalog())
+            response = await cached_response(key, lambda: self.render(artwork_id))
+            if response is None:
+                await utter_artwork_suggestions(dispatcher, f"Sorry, there is no artwork with ID code {artwork_id}.",
+                                                artwork_id, 'ask_minimum_bid')
                 return [SlotSet('artwork_id', None)]  # empty the artwork_id slot
             else:
-                text = f"{artwork_id} is the ID code for the artwork \"{artwork.title}\" by {artwork.artist_name}. " \
-                       f"The minimum bid is ${artwork.min_bid}."
-                dispatcher.utter_message(text=text)
+                dispatcher.utter_message(**response)
         else:  # not a valid artwork id code
-            dispatcher.utter_message(text=f"Sorry, {artwork_id} is not a valid artwork ID code. Make sure you use "
-                                          f"capital letters (e.g. ABC123 or WEB563).")
+            await utter_artwork_suggestions(dispatcher, f"Sorry, {artwork_id} is not a valid artwork ID code.",
+                                            artwork_id, 'ask_minimum_bid',
+                                            "Make sure you use capital letters (e.g. ABC123 or WEB563).")
             return [SlotSet('artwork_id', None)]  # empty the artwork_id slot
 
         return [SlotSet('artwork_id', None)]
 
 
+@instrument
+class ActionSearchArtwork(Action):
+    """This action searches the catalog for the artworks matching the user's message (e.g. "show me
+    Eve Evans sculptures") using the full-text index. Each artwork found is shown as a button that
+    displays its info card, and a last button gives the next page of results if there are more."""
+
+    results_per_page = 5
+
+    def name(self) -> Text:
+        return "action_search_artwork"
+
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        message = tracker.latest_message.get('text') or ''
+        if message.startswith('/'):  # "more results" button: search again with the previous query
+            query = tracker.get_slot('search_query') or ''
+        else:
+            query = message
+        try:
+            page = max(int(tracker.get_slot('search_page') or 1), 1)
+        except (TypeError, ValueError):  # e.g. a payload typed by the user with search_page "two"
+            page = 1
+        search_page = await async_db_handler.search_artworks(query, page, self.results_per_page)
+        if search_page.total == 0:
+            dispatcher.utter_message(text="Sorry, I could not find any artwork matching your request. You can search "
+                                          "by title, artist name, medium or category (e.g. Eve Evans sculptures).")
+        else:
+            first = (page - 1) * self.results_per_page + 1
+            last = first + len(search_page.results) - 1
+            if search_page.total == 1:
+                text = "I found one artwork matching your request. Click on it for more information."
+            else:
+                text = f"I found {search_page.total} artworks matching your request (showing {first} to {last}). " \
+                       f"Click on one of them for more information."
+            buttons = []
+            for result in search_page.results:
+                buttons.append({'payload': f'/ask_artwork_info_card{{"artwork_id": "{result.artwork_id}"}}',
+                                'title': f'{result.artwork_id}: "{result.title}" by {result.artist_name}'})
+            if last < search_page.total:
+                buttons.append({'payload': f'/search_artwork{{"search_page": "{page + 1}"}}',
+                                'title': 'more results'})
+            dispatcher.utter_message(text=text, buttons=buttons)
+
+        return [SlotSet('search_query', query), SlotSet('search_page', None)]
+
+
+@instrument
 class ActionAskModifyBidFormArtworkId(Action):
     """This action asks the user to provide the ID code of the artwork for which they want to modify the
     bid. To help the user, the list of the artwork IDs for which the user has submitted a bid are provided
-    as buttons.
-    By default, the user is Foo."""
+    as buttons (one page at a time, like in ActionUserBidList)."""
+
+    bids_per_page = 10
 
     def name(self) -> Text:
         return "action_ask_modify_bid_form_artwork_id"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        bid_list = db_handler.get_bids_for_user('Foo')
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        after_artwork_id = tracker.get_slot('bid_list_after')  # set by the "next page" button
+        # fetch one extra bid to know if there is a next page
+        user_name = (await get_user(tracker)).user_name
+        bid_list = await async_db_handler.get_bids_for_user(user_name, after_artwork_id, self.bids_per_page + 1)
+        has_next_page = len(bid_list) > self.bids_per_page
+        bid_list = bid_list[:self.bids_per_page]
         text = "For which artwork do you want to modify the bid value? Please provide the artwork ID code " \
                "(e.g. ABC123 or GAP009)."
         if len(bid_list) < 1:
@@ -196,34 +372,38 @@ class ActionAskModifyBidFormArtworkId(Action):
             for pair in bid_list:
                 buttons.append({'payload': f'/inform{{"artwork_id": "{pair[0]}"}}',
                                 'title': f'{pair[0]}'})
+            if has_next_page:
+                buttons.append({'payload': f'/inform{{"bid_list_after": "{bid_list[-1][0]}"}}',
+                                'title': 'next page'})
             dispatcher.utter_message(text=text, buttons=buttons)
 
-        return []
+        return [SlotSet('bid_list_after', None)]
 
 
+@instrument
 class ActionAskModifyBidFormBidValue(Action):
     """This action asks the user to provide the new value for the bid. If we are here, we should have
     already asked the user for the artwork ID, so we can tell them what the minimum bid and the user's current
-    bid value is (by default, user is Foo)."""
+    bid value is."""
 
     def name(self) -> Text:
         return "action_ask_modify_bid_form_bid_value"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         artwork_id = tracker.get_slot('artwork_id')
         if artwork_id is None:
             text = "Error: action_ask_modify_bid_form_bid_value triggered, but value of slot artwork_id is None."
             dispatcher.utter_message(text=text)
         else:
-            artwork = db_handler.get_artwork_info(artwork_id)
+            artwork = await async_db_handler.get_catalog_entry(artwork_id)
             if artwork is None:
                 text = f"Sorry, no artwork with ID code {artwork_id} exists. Please try again."
                 dispatcher.utter_message(text=text)
                 return [SlotSet('artwork_id', None)]  # empty the artwork_id slot
             else:
-                user_bid = db_handler.get_bid_info('Foo', artwork_id)
+                user_bid = await async_db_handler.get_bid_info((await get_user(tracker)).user_name, artwork_id)
                 if user_bid is None:  # User has not bid on this artwork yet
                     text = f"How many Canadian dollars do you want to bid on artwork {artwork_id}? The minimum bid " \
                            f"is ${artwork.min_bid}. Please use an integer value (e.g. 1000 or 550)."
@@ -236,15 +416,16 @@ class ActionAskModifyBidFormBidValue(Action):
         return []
 
 
+@instrument
 class ActionAskModifyBidFormConfirmForm(Action):
     """This action asks the user to confirm whether they want to do the bid modification or not."""
 
     def name(self) -> Text:
         return "action_ask_modify_bid_form_confirm_form"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         artwork_id = tracker.get_slot('artwork_id')
         bid_value = tracker.get_slot('bid_value')
 
@@ -256,37 +437,40 @@ class ActionAskModifyBidFormConfirmForm(Action):
         return []
 
 
+@instrument
 class ValidateModifyBidForm(FormValidationAction):
     """This action validates all of the slots in modify_bid_form."""
 
     def name(self) -> Text:
         return "validate_modify_bid_form"
 
-    def validate_artwork_id(self, slot_value: Any,
-                            dispatcher: CollectingDispatcher,
-                            tracker: Tracker,
-                            domain: DomainDict) -> Dict[Text, Any]:
+    async def validate_artwork_id(self, slot_value: Any,
+                                  dispatcher: CollectingDispatcher,
+                                  tracker: Tracker,
+                                  domain: DomainDict) -> Dict[Text, Any]:
         """Validate artwork_id slot value."""
         id_code = slot_value.upper()  # ensure letters are in upper_case
         if is_valid_artwork_id(id_code):
             # check that an artwork with this ID number actually exists
-            if db_handler.get_artwork_info(id_code) is not None:  # the artwork exists
+            if await async_db_handler.get_catalog_entry(id_code) is not None:  # the artwork exists
                 return {'artwork_id': id_code}
             else:  # the artwork does not exist
-                dispatcher.utter_message(text=f"Sorry, no artwork with ID code {id_code} exists.")
+                await utter_artwork_suggestions(dispatcher, f"Sorry, no artwork with ID code {id_code} exists.",
+                                                id_code, 'inform', "")
                 return {'artwork_id': None}
         else:
-            dispatcher.utter_message(text=f"Sorry, {slot_value} is not a valid artwork ID code.")
+            await utter_artwork_suggestions(dispatcher, f"Sorry, {slot_value} is not a valid artwork ID code.",
+                                            slot_value, 'inform', "")
             return {'artwork_id': None}
 
-    def validate_bid_value(self, slot_value: Any,
-                           dispatcher: CollectingDispatcher,
-                           tracker: Tracker,
-                           domain: DomainDict) -> Dict[Text, Any]:
+    async def validate_bid_value(self, slot_value: Any,
+                                 dispatcher: CollectingDispatcher,
+                                 tracker: Tracker,
+                                 domain: DomainDict) -> Dict[Text, Any]:
         """Validate the bid_value slot value."""
         try:
             value = int(slot_value)
-            min_bid = db_handler.get_min_bid_amount(tracker.get_slot('artwork_id'))
+            min_bid = await async_db_handler.get_min_bid_amount(tracker.get_slot('artwork_id'))
             if min_bid is not None:
                 if value >= min_bid:
                     return {'bid_value': value}
@@ -300,10 +484,19 @@ class ValidateModifyBidForm(FormValidationAction):
             dispatcher.utter_message(text=f"Sorry, {slot_value} is not a valid bid amount.")
             return {'bid_value': None}
 
-    def validate_confirm_form(self, slot_value: Any,
-                              dispatcher: CollectingDispatcher,
-                              tracker: Tracker,
-                              domain: DomainDict) -> Dict[Text, Any]:
+    async def validate_bid_list_after(self, slot_value: Any,
+                                      dispatcher: CollectingDispatcher,
+                                      tracker: Tracker,
+                                      domain: DomainDict) -> Dict[Text, Any]:
+        """Keep the position of the "next page" button of action_ask_modify_bid_form_artwork_id.
+        Validating this slot also prevents the form from rejecting the button click (which does
+        not fill the requested slot), so that the form asks for the artwork ID again."""
+        return {'bid_list_after': slot_value}
+
+    async def validate_confirm_form(self, slot_value: Any,
+                                    dispatcher: CollectingDispatcher,
+                                    tracker: Tracker,
+                                    domain: DomainDict) -> Dict[Text, Any]:
         """Validate that we got yes or no for confirmation."""
         if slot_value in ["yes", "no"]:
             return {'confirm_form': slot_value}
@@ -312,6 +505,7 @@ class ValidateModifyBidForm(FormValidationAction):
             return {'confirm_form': None}
 
 
+@instrument
 class ActionSubmitModifyBid(Action):
     """Action to call once have collected all of the information for the modify bid form.
     Either does the modification or says 'ok, cancelled' depending on value of confirm_form slot."""
@@ -319,13 +513,17 @@ class ActionSubmitModifyBid(Action):
     def name(self) -> Text:
         return "action_submit_modify_bid"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         if tracker.get_slot('confirm_form') == "yes":  # do the modification
             artwork_id = tracker.get_slot('artwork_id')
             bid_value = int(tracker.get_slot('bid_value'))
-            text = db_handler.modify_bid_value('Foo', artwork_id, bid_value)
+            user_name = (await get_user(tracker)).user_name
+            if bid_journal is not None:  # acknowledged once saved in the journal
+                text = (await bid_journal.submit_bid_async(user_name, artwork_id, bid_value)).message
+            else:
+                text = await async_db_handler.modify_bid_value(user_name, artwork_id, bid_value)
             dispatcher.utter_message(text=text)
         else:  # user said no
             dispatcher.utter_message(response='utter_confirm_request_cancel')
@@ -0,0 +1,68 @@
+# artwork_search.py
+# Full-text search over the artwork catalog (title, artist name, medium and category), using the
+# artwork_fts FTS5 table defined in db_models.py. Free text such as "show me Eve Evans sculptures"
+# is turned into an FTS5 query, and the matching artworks are ranked with bm25 and paginated.
+# The functions are used through db_handler.search_artworks() and async_db_handler.search_artworks().
+# Resources consulted:
+# https://www.sqlite.org/fts5.html#full_text_query_syntax
+# https://www.sqlite.org/fts5.html#the_bm25_function
+# https://www.sqlite.org/fts5.html#porter_tokenizer
+# https://docs.sqlalchemy.org/en/14/core/tutorial.html#using-textual-sql
+###################################
+import re
+from collections import namedtuple
+
+from sqlalchemy import text
+
+SearchResult = namedtuple('SearchResult', ['artwork_id', 'title', 'artist_name', 'medium', 'category', 'min_bid'])
+SearchPage = namedtuple('SearchPage', ['query', 'page', 'per_page', 'total', 'results'])
+
+DEFAULT_PER_PAGE = 10
+MAX_PER_PAGE = 50
+
+# Words of a search request that do not describe the artwork itself
+STOP_WORDS = frozenset("""a about all an and any are art artwork artworks by can do find for from get have i im in is
+it looking look me made my of on or piece pieces please search see show some that the there to what which with
+you""".split())
+# Words people use that do not appear in the catalog, replaced by the word used in the catalog
+SYNONYMS = {'photo': 'photograph', 'photos': 'photograph', 'picture': 'photograph', 'pictures': 'photograph',
+            'sculptor': 'sculpture', 'painter': 'painting'}
+
+# bm25 weights of the columns artwork_id (not indexed), title, artist_name, medium, category
+_RANK = "bm25(artwork_fts, 0.0, 10.0, 5.0, 2.0, 5.0)"
+_SEARCH_SQL = text(f"""SELECT artwork.artwork_id, artwork.title, artwork.artist_name, artwork.medium,
+    artwork.category, artwork.min_bid
+FROM artwork_fts JOIN artwork ON artwork.artwork_id = artwork_fts.artwork_id
+WHERE artwork_fts MATCH :match
+ORDER BY {_RANK}
+LIMIT :limit OFFSET :offset""")
+_COUNT_SQL = text("SELECT count(*) FROM artwork_fts WHERE artwork_fts MATCH :match")
+
+
+def search_terms(query: str):
+    """Returns the list of words of the query that describe the artwork (lower case, no stop words)."""
+    words = re.findall(r"\w+", query.lower().replace("'", ""))
+    return [SYNONYMS.get(word, word) for word in words if word not in STOP_WORDS]
+
+
+def match_expression(terms, any_term=False):
+    """Builds the FTS5 query for a list of terms. Every term is quoted so that user input can never be
+    interpreted as FTS5 syntax. By default all the terms must match, with any_term=True one is enough."""
+    quoted = ['"' + term.replace('"', '""') + '"' for term in terms]
+    return (" OR " if any_term else " ").join(quoted)
+
+
+def _search_artworks(session, query, page, per_page):
+    """Does the work of db_handler.search_artworks() and returns a SearchPage."""
+    page = max(int(page), 1)
+    per_page = min(max(int(per_page), 1), MAX_PER_PAGE)
+    terms = search_terms(query)
+    if not terms:
+        return SearchPage(query, page, per_page, 0, [])
+    match = match_expression(terms)
+    total = session.execute(_COUNT_SQL, {'match': match}).scalar()
+    if total == 0 and len(terms) > 1:  # nothing matches every term, so rank the artworks matching any term
+        match = match_expression(terms, any_term=True)
+        total = session.execute(_COUNT_SQL, {'match': match}).scalar()
+    rows = session.execute(_SEARCH_SQL, {'match': match, 'limit': per_page, 'offset': (page - 1) * per_page})
+    return SearchPage(query, page, per_page, total, [SearchResult(*row) for row in rows])
@@ -0,0 +1,100 @@
+# artwork_suggestions.py
+# Suggestions of existing artwork ID codes for a mistyped one, so that the actions can offer the likely
+# artworks as buttons instead of only asking the user to try again.
+# Every ID code has the format ABC123 (3 capital letters and 3 digits), so instead of searching a tree of
+# all the ID codes, the index generates the few codes of this format that are one typing mistake away
+# from the text of the user (a wrong, missing, extra or swapped character) and keeps those that exist,
+# with a set lookup each: a suggestion costs about a hundred lookups whatever the size of the catalog.
+# Characters that look alike and are often confused (O and 0, I and 1, S and 5, ...) are corrected first
+# according to their position (letter or digit), and count as half a mistake. Lower case letters,
+# spaces and dashes are ignored.
+# Resources consulted:
+# https://en.wikipedia.org/wiki/Damerau%E2%80%93Levenshtein_distance
+# https://norvig.com/spell-correct.html
+###################################
+import re
+import string
+
+SUGGESTION_LIMIT = 3  # number of artwork ID codes suggested
+
+# An artwork ID code: 3 capital letters followed by 3 digits (also used by the NLU fast path, see nlu/fast_path.py)
+ARTWORK_ID_PATTERN = re.compile(r"^[A-Z]{3}\d{3}$")
+
+ID_LENGTH = 6
+_LETTER_POSITIONS = range(3)  # the other positions are digits
+_CONFUSED_DIGITS = {'O': '0', 'Q': '0', 'D': '0', 'I': '1', 'L': '1', 'Z': '2', 'S': '5', 'G': '6', 'T': '7',
+                    'B': '8'}  # letter typed instead of a digit
+_CONFUSED_LETTERS = {'0': 'O', '1': 'I', '2': 'Z', '5': 'S', '6': 'G', '7': 'T', '8': 'B'}  # and the opposite
+_CONFUSION_COST = 0.5
+_EDIT_COST = 1.0
+
+
+def normalize(text: str):
+    """Returns the text in upper case without spaces, dashes and other punctuation."""
+    return re.sub(r'[^0-9A-Z]', '', text.upper())
+
+
+def _fix_confusions(characters):
+    """Replaces the characters typed for a look-alike of the other kind at their position (e.g. O in the
+    digits). Returns the new list of characters and the number of characters replaced."""
+    fixed = list(characters)
+    confusions = 0
+    for position, character in enumerate(fixed):
+        table = _CONFUSED_LETTERS if position in _LETTER_POSITIONS else _CONFUSED_DIGITS
+        if character in table:
+            fixed[position] = table[character]
+            confusions += 1
+    return fixed, confusions
+
+
+def _alphabet(position):
+    return string.ascii_uppercase if position in _LETTER_POSITIONS else string.digits
+
+
+class ArtworkIdIndex:
+    """Set of the artwork ID codes of the catalog, which suggests the existing codes closest to a text."""
+
+    def __init__(self, artwork_ids):
+        self._ids = frozenset(artwork_ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _candidates(self, code):
+        """Yields the pairs (cost, artwork ID code) of the codes of the right format at most one mistake
+        (plus any number of confusions) away from the normalized code."""
+        if len(code) == ID_LENGTH:
+            fixed, confusions = _fix_confusions(code)
+            base = confusions * _CONFUSION_COST
+            yield base, ''.join(fixed)
+            for position in range(ID_LENGTH):  # a wrong character
+                prefix, suffix = ''.join(fixed[:position]), ''.join(fixed[position + 1:])
+                for character in _alphabet(position):
+                    if character != fixed[position]:
+                        yield base + _EDIT_COST, prefix + character + suffix
+            for position in range(ID_LENGTH - 1):  # two characters swapped
+                swapped = list(code)
+                swapped[position], swapped[position + 1] = swapped[position + 1], swapped[position]
+                fixed, confusions = _fix_confusions(swapped)
+                yield confusions * _CONFUSION_COST + _EDIT_COST, ''.join(fixed)
+        elif len(code) == ID_LENGTH - 1:  # a missing character
+            for position in range(ID_LENGTH):
+                fixed, confusions = _fix_confusions(code[:position] + '?' + code[position:])
+                prefix, suffix = ''.join(fixed[:position]), ''.join(fixed[position + 1:])
+                for character in _alphabet(position):
+                    yield confusions * _CONFUSION_COST + _EDIT_COST, prefix + character + suffix
+        elif len(code) == ID_LENGTH + 1:  # an extra character
+            for position in range(ID_LENGTH + 1):
+                fixed, confusions = _fix_confusions(code[:position] + code[position + 1:])
+                yield confusions * _CONFUSION_COST + _EDIT_COST, ''.join(fixed)
+
+    def suggest(self, text: str, limit: int = SUGGESTION_LIMIT):
+        """Returns up to limit existing artwork ID codes close to the text typed by the user, the closest first
+        (the code itself, in upper case, if it exists)."""
+        if not text:
+            return []
+        costs = {}
+        for cost, candidate in self._candidates(normalize(text)):
+            if candidate in self._ids and cost < costs.get(candidate, float('inf')):
+                costs[candidate] = cost
+        return sorted(costs, key=lambda artwork_id: (costs[artwork_id], artwork_id))[:limit]
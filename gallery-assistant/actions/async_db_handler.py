@@ -0,0 +1,168 @@
+# async_db_handler.py
+# Async versions of the functions in db_handler.py, used by the custom actions.
+# The action server runs every action on a single asyncio event loop, so a blocking query
+# would stall the responses of every other conversation. These functions run the same
+# queries as db_handler.py (through AsyncSession.run_sync) on the aiosqlite driver instead.
+# The catalog snapshot (see catalog_snapshot.py) is read directly: it is an immutable, memory-mapped
+# file, so its queries never wait for a lock or for the disk.
+# Resources consulted:
+# see db_handler.py
+# https://docs.sqlalchemy.org/en/14/orm/extensions/asyncio.html
+# https://docs.sqlalchemy.org/en/14/orm/extensions/asyncio.html#running-synchronous-methods-and-functions-under-asyncio
+# https://docs.python.org/3/library/contextlib.html#contextlib.asynccontextmanager
+###################################
+from contextlib import asynccontextmanager
+
+from .db_models import AsyncSessionFactory, get_async_engine
+from . import db_handler
+from .db_handler import catalog_cache, portfolio_cache, suggestion_index_cache, CatalogEntry, PORTFOLIO_MAX_BIDS
+from .artwork_suggestions import ArtworkIdIndex, SUGGESTION_LIMIT
+from .artwork_search import _search_artworks, DEFAULT_PER_PAGE
+
+
+@asynccontextmanager
+async def async_session_scope():
+    """Async counterpart of db_handler.session_scope(): commits the changes when the block ends
+    (or rolls them back if an exception was raised) and then closes the session."""
+    async with AsyncSessionFactory() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+
+async def get_bids_for_user(user_name: str, after_artwork_id: str = None, limit: int = None):
+    """Async version of db_handler.get_bids_for_user()."""
+    portfolio = db_handler._cached_portfolio(user_name)
+    if portfolio is not None:
+        return portfolio.page(after_artwork_id, limit)
+    async with async_session_scope() as session:
+        return await session.run_sync(db_handler._query_bids_for_user, user_name, after_artwork_id, limit)
+
+
+async def iter_bids_for_user(user_name: str, page_size: int = db_handler.BID_PAGE_SIZE):
+    """Async version of db_handler.iter_bids_for_user() (async generator)."""
+    after_artwork_id = None
+    while True:
+        page = await get_bids_for_user(user_name, after_artwork_id, page_size)
+        for pair in page:
+            yield pair
+        if len(page) < page_size:
+            return
+        after_artwork_id = page[-1][0]
+
+
+async def count_bids_for_user(user_name: str):
+    """Async version of db_handler.count_bids_for_user()."""
+    portfolio = db_handler._cached_portfolio(user_name)
+    if portfolio is not None:
+        return len(portfolio)
+    async with async_session_scope() as session:
+        return await session.run_sync(db_handler._count_bids_for_user, user_name)
+
+
+async def submit_bid(user_name: str, artwork_id: str, new_value: int, create_if_not_exists=True):
+    """Async version of db_handler.submit_bid()."""
+    async with async_session_scope() as session:  # the bid is committed when this block ends
+        result = await session.run_sync(db_handler._write_bid_value, user_name, artwork_id, new_value,
+                                        create_if_not_exists)
+    db_handler._bids_written([result])
+    return result
+
+
+async def modify_bid_value(user_name: str, artwork_id: str, new_value: int, create_if_not_exists=True):
+    """Async version of db_handler.modify_bid_value()."""
+    result = await submit_bid(user_name, artwork_id, new_value, create_if_not_exists)
+    return result.message
+
+
+async def apply_bids(bids, create_if_not_exists=True, chunk_size=db_handler.BULK_BID_CHUNK_SIZE):
+    """Async version of db_handler.apply_bids()."""
+    results = []
+    for chunk in db_handler._chunks(bids, chunk_size):
+        async with async_session_scope() as session:  # each chunk is committed when this block ends
+            chunk_results = await session.run_sync(db_handler._apply_bid_chunk, chunk, create_if_not_exists)
+        db_handler._bids_written(chunk_results)
+        results.extend(chunk_results)
+    return results
+
+
+async def get_artwork_info(artwork_id: str):
+    """Async version of db_handler.get_artwork_info() (shares the same catalog cache)."""
+    artwork = catalog_cache.get(artwork_id)
+    if artwork is None:
+        async with async_session_scope() as session:
+            artwork = await session.run_sync(db_handler._query_artwork, artwork_id)
+        if artwork is not None:  # unknown ids are not cached
+            catalog_cache.put(artwork_id, artwork)
+    return artwork
+
+
+async def get_catalog_entry(artwork_id: str):
+    """Async version of db_handler.get_catalog_entry()."""
+    if db_handler.catalog_snapshot is not None:
+        return db_handler.catalog_snapshot.get_entry(artwork_id)
+    artwork = await get_artwork_info(artwork_id)
+    return None if artwork is None else CatalogEntry._make(artwork[:len(CatalogEntry._fields)])
+
+
+async def get_min_bid_amount(artwork_id: str):
+    """Async version of db_handler.get_min_bid_amount()."""
+    artwork = await get_catalog_entry(artwork_id)
+    if artwork is None:
+        return None
+    else:
+        return artwork.min_bid
+
+
+async def get_bid_info(user_name: str, artwork_id: str):
+    """Async version of db_handler.get_bid_info()."""
+    portfolio = db_handler._cached_portfolio(user_name)
+    if portfolio is not None:
+        value = portfolio.get_value(artwork_id)
+        return None if value is None else db_handler.BidInfo(user_name, artwork_id, value)
+    async with async_session_scope() as session:
+        return await session.run_sync(db_handler._query_bid, user_name, artwork_id)
+
+
+async def get_portfolio(user_name: str):
+    """Async version of db_handler.get_portfolio() (shares the same portfolio cache)."""
+    portfolio = portfolio_cache.get(user_name)
+    if portfolio is None:
+        version = db_handler.data_versions.user(user_name)
+        async with async_session_scope() as session:
+            portfolio = await session.run_sync(db_handler._query_portfolio, user_name, PORTFOLIO_MAX_BIDS)
+        if db_handler.data_versions.user(user_name) == version:
+            portfolio_cache.put(user_name, portfolio)
+    return portfolio
+
+
+async def search_artworks(query: str, page: int = 1, per_page: int = DEFAULT_PER_PAGE):
+    """Async version of db_handler.search_artworks()."""
+    if db_handler.catalog_snapshot is not None:
+        return db_handler.catalog_snapshot.search(query, page, per_page)
+    async with async_session_scope() as session:
+        return await session.run_sync(_search_artworks, query, page, per_page)
+
+
+async def suggest_artwork_ids(text: str, limit: int = SUGGESTION_LIMIT):
+    """Async version of db_handler.suggest_artwork_ids() (shares the same index)."""
+    index = suggestion_index_cache.get('index')
+    if index is None:
+        if db_handler.catalog_snapshot is not None:
+            index = ArtworkIdIndex(db_handler.catalog_snapshot.get_artwork_ids())
+        else:
+            async with async_session_scope() as session:
+                index = ArtworkIdIndex(await session.run_sync(db_handler._query_artwork_ids))
+        suggestion_index_cache.put('index', index)
+    return index.suggest(text, limit)
+
+
+async def dispose_engine():
+    """Closes the pooled connections. Scripts using this module should call it before exiting,
+    since each open aiosqlite connection keeps a worker thread alive."""
+    await get_async_engine().dispose()
+    if db_handler.catalog_snapshot is not None:
+        db_handler.catalog_snapshot.dispose()
@@ -0,0 +1,92 @@
+# bid_event_relay.py
+# Relay of the bid updates made by the other processes (the action servers write the bids, the web application
+# streams them) to the in-process hub of bid_events.py. A single thread checks the change counters of the
+# database (see ChangeCounter in db_models.py) every interval, and when the catalog or the bids changed, reads
+# the statistics of the watched artworks and the bids of the watched users with one query each and publishes
+# the states that changed. The cost of watching is therefore one primary key read per interval, and two queries
+# per change, whatever the number of subscribers: the hub sends the events to all of them. The relay is also
+# woken up at once by the bids written by this process.
+# Resources consulted:
+# see bid_events.py
+# https://docs.python.org/3/library/threading.html#event-objects
+###################################
+import logging
+import threading
+
+from . import db_handler
+from .bid_events import artwork_stats, bid_state
+
+logger = logging.getLogger(__name__)
+
+RELAY_INTERVAL = 0.5  # seconds between two checks of the change counters
+
+
+class BidEventRelay:
+    """Thread publishing the changes of the watched artworks and users to a BidEventHub, see the top of this
+    file. start() may be called several times: the thread is only started once."""
+
+    def __init__(self, hub=None, interval: float = RELAY_INTERVAL):
+        self.hub = hub if hub is not None else db_handler.bid_event_hub
+        self.interval = interval
+        self.reads = 0  # number of times the watched artworks and users were read
+        self._versions = None  # versions of the change counters at the last read
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name='bid-event-relay', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            self.hub.notify_change()
+            thread.join()
+
+    def relay_changes(self, force: bool = False):
+        """Reads the watched artworks and users if the catalog or the bids changed since the last read (or if
+        force is True), and publishes their states that changed. Returns the number of states published."""
+        counters = db_handler.get_change_counters()
+        versions = (counters['catalog'].version, counters['bids'].version)
+        if versions == self._versions and not force:
+            return 0
+        self._versions = versions
+        self.reads += 1
+        published = 0
+        artwork_ids = set(self.hub.watched('artwork')).union(self.hub.watched('highest_bid'))
+        if artwork_ids:
+            for artwork in db_handler.get_artworks_by_id(sorted(artwork_ids)):
+                published += bool(self.hub.publish(('artwork', artwork.artwork_id), artwork.artwork_id,
+                                                   artwork_stats(artwork)))
+                published += bool(self.hub.publish(('highest_bid', artwork.artwork_id), artwork.artwork_id,
+                                                   artwork.highest_bid))
+        user_names = self.hub.watched('user')
+        if user_names:
+            values = {user_name: {} for user_name in user_names}
+            for bid in db_handler.get_bids_for_users(user_names):
+                values[bid.user_name][bid.artwork_id] = bid.value
+            for user_name, user_values in values.items():
+                channel = ('user', user_name)
+                for artwork_id in set(user_values).union(self.hub.states(channel)):  # and the deleted bids
+                    published += bool(self.hub.publish(channel, artwork_id,
+                                                       bid_state(artwork_id, user_values.get(artwork_id))))
+        return published
+
+    def _run(self):
+        while not self._stopped.is_set():
+            woken = self.hub.wait_for_change(self.interval)
+            if self._stopped.is_set():
+                return
+            if not any(self.hub.watched(kind) for kind in ('artwork', 'highest_bid', 'user')):
+                self._versions = None  # the next subscribers are sent the states as they are then
+                continue
+            try:
+                self.relay_changes(force=woken)
+            except Exception:  # e.g. the database is locked for too long: tried again at the next interval
+                logger.exception("Could not read the bid updates")
@@ -0,0 +1,159 @@
+# bid_events.py
+# In-process publish/subscribe of the bid updates, for the clients that watch an auction live (the
+# Server-Sent Events streams of the web application) instead of polling the database.
+# A subscriber listens to channels: ('artwork', artwork_id) for the bid statistics of an artwork, and
+# ('user', user_name) for the bids of a user. The auctions are sealed-bid, so the statistics only have the
+# minimum bid and the number of bids; the highest bid of an artwork has its own channel ('highest_bid',
+# artwork_id), which the server only uses to tell a user that they were outbid and never sends. An event gives the new state of a key of its channel (the
+# statistics of the artwork, or the value of the bid of the user on an artwork), and the hub keeps the last
+# state published of every key, so a state that did not change is never sent twice. Every subscriber has
+# a bounded queue that keeps only the latest state of each key: a slow client gets the current state
+# rather than every intermediate one, and a client that does not read at all costs at most max_queued events.
+# The states are published by the bid writes of this process (db_handler publishes them once committed) and
+# by the relay of bid_event_relay.py, which reads the changes made by the other processes.
+# Resources consulted:
+# https://docs.python.org/3/library/threading.html#condition-objects
+# https://docs.python.org/3/library/collections.html#collections.OrderedDict
+###################################
+import threading
+from collections import OrderedDict
+
+SUBSCRIBER_QUEUE_SIZE = 256  # maximum number of events waiting to be sent to a subscriber
+
+
+def artwork_stats(artwork):
+    """State of the channel ('artwork', artwork_id) for an ArtworkInfo: its minimum bid and number of bids, which
+    anyone may know (unlike the values of the bids)."""
+    return {'artwork_id': artwork.artwork_id, 'min_bid': artwork.min_bid, 'bid_count': artwork.bid_count}
+
+
+def bid_state(artwork_id, value):
+    """State of a key of the channel ('user', user_name): the value of the bid of the user on an artwork
+    (None if the bid was deleted)."""
+    return {'artwork_id': artwork_id, 'value': value}
+
+
+class Subscription:
+    """Channels listened to by one client and the events waiting to be sent to it."""
+
+    def __init__(self, max_queued: int = SUBSCRIBER_QUEUE_SIZE):
+        self.channels = set()
+        self.max_queued = max_queued
+        self.dropped = 0  # number of events dropped because the queue was full
+        self._events = OrderedDict()  # (channel, key) -> latest state, in the order of their first event
+        self._condition = threading.Condition()
+
+    def put(self, channel, key, state):
+        with self._condition:
+            event_key = (channel, key)
+            if event_key not in self._events and len(self._events) >= self.max_queued:
+                self._events.popitem(last=False)
+                self.dropped += 1
+            self._events[event_key] = state  # replaces the state not sent yet, if any
+            self._condition.notify()
+
+    def get(self, timeout: float = None):
+        """Returns the next event (channel, key, state), or None if there was none for timeout seconds."""
+        with self._condition:
+            if not self._events:
+                self._condition.wait(timeout)
+            if not self._events:
+                return None
+            (channel, key), state = self._events.popitem(last=False)
+            return channel, key, state
+
+
+class BidEventHub:
+    """Channels of the bid updates and their subscribers, see the top of this file."""
+
+    def __init__(self):
+        self._subscribers = {}  # channel -> set of Subscription
+        self._states = {}  # channel -> {key: last state published}, for the channels with subscribers
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self.published = 0  # number of states published to at least one subscriber
+
+    def subscribe(self, channels=(), max_queued: int = SUBSCRIBER_QUEUE_SIZE):
+        """Returns a new Subscription to the channels. Call unsubscribe() when the client leaves."""
+        subscription = Subscription(max_queued)
+        for channel in channels:
+            self.add_channel(subscription, channel)
+        return subscription
+
+    def add_channel(self, subscription: Subscription, channel):
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+            subscription.channels.add(channel)
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+                        self._states.pop(channel, None)
+            subscription.channels.clear()
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({subscription for subscribers in self._subscribers.values() for subscription in subscribers})
+
+    def watched(self, kind: str):
+        """Returns the artwork ids (kinds 'artwork' and 'highest_bid') or user names (kind 'user') that have
+        subscribers."""
+        with self._lock:
+            return [name for channel_kind, name in self._subscribers if channel_kind == kind]
+
+    def states(self, channel):
+        """Returns the last state published of every key of a channel."""
+        with self._lock:
+            return dict(self._states.get(channel, {}))
+
+    def seed(self, channel, states):
+        """Records the states {key: state} that a new subscriber was sent directly (read from the database),
+        for the keys of the channel that have no state published yet."""
+        with self._lock:
+            if channel in self._subscribers:
+                known = self._states.setdefault(channel, {})
+                for key, state in states.items():
+                    known.setdefault(key, state)
+
+    def publish(self, channel, key, state):
+        """Sends the new state of a key to the subscribers of its channel, unless it is the last state
+        published. Returns the number of subscribers it was sent to."""
+        with self._lock:  # the states of a key reach every subscriber in the order they were published
+            subscribers = self._subscribers.get(channel)
+            if not subscribers:
+                return 0
+            states = self._states.setdefault(channel, {})
+            if key in states and states[key] == state:
+                return 0
+            states[key] = state
+            for subscription in subscribers:
+                subscription.put(channel, key, state)
+            self.published += 1
+            return len(subscribers)
+
+    def publish_bids(self, results):
+        """Publishes the bids written by this process (their BidResult, once committed) to the channels of
+        their users, and wakes the relay up if the statistics or the highest bid of one of their artworks are
+        watched."""
+        if not self._subscribers:
+            return
+        for result in results:
+            self.publish(('user', result.user_name), result.artwork_id, bid_state(result.artwork_id, result.value))
+            if ('artwork', result.artwork_id) in self._subscribers or \
+                    ('highest_bid', result.artwork_id) in self._subscribers:
+                self._changed.set()
+
+    def notify_change(self):
+        """Wakes the relay up (see wait_for_change())."""
+        self._changed.set()
+
+    def wait_for_change(self, timeout: float):
+        """Waits until notify_change() is called or timeout seconds passed. Returns True in the first case."""
+        changed = self._changed.wait(timeout)
+        self._changed.clear()
+        return changed
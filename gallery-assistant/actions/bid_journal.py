@@ -0,0 +1,273 @@
+# bid_journal.py
+# Write-behind journal for the bids, for the spike of bids in the last minutes before the bidding closes.
+# Instead of writing each bid to the bid table in its own transaction, the bids are handled by a commit
+# thread in groups: all the bids submitted since the previous group are validated together (with the
+# same bulk queries as db_handler.apply_bids()), the valid ones are appended to the journal file, and
+# a single fsync makes the whole group durable (group commit). Each bid is acknowledged once its group
+# is synced. A flush thread then writes the journaled bids to the bid table in batches, and saves the
+# sequence number of the last bid written in the bid_journal_checkpoint table in the same transaction.
+# When the journal is opened (e.g. after a crash of the action server), the bids after the checkpoint
+# are written to the bid table first, so replaying the journal never applies a bid twice.
+# The bids are visible in the bid table (and to the other processes) after at most flush_interval.
+# The database commits with synchronous=NORMAL (see db_models.py), which in WAL mode does not sync the
+# transactions to the disk, so the journal file is only emptied after a full checkpoint has written the
+# flushed bids to the database file and synced it.
+# The action server uses a journal when GALLERY_BID_JOURNAL is set to the path of the journal file
+# (one file per action server, e.g. GALLERY_BID_JOURNAL=bids.journal).
+# Resources consulted:
+# see db_handler.py
+# https://www.sqlite.org/atomiccommit.html
+# https://www.sqlite.org/pragma.html#pragma_wal_checkpoint
+# https://www.sqlite.org/pragma.html#pragma_synchronous
+# https://docs.python.org/3/library/os.html#os.fsync
+# https://docs.python.org/3/library/threading.html#condition-objects
+# https://docs.python.org/3/library/concurrent.futures.html#future-objects
+# https://docs.python.org/3/library/asyncio-future.html#asyncio.wrap_future
+###################################
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from concurrent.futures import Future
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import db_handler
+from .db_handler import session_scope
+from .db_models import BidJournalCheckpoint
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FLUSH_INTERVAL = 0.05  # seconds between two flushes of the journaled bids to the bid table
+JOURNAL_BATCH_SIZE = db_handler.BULK_BID_CHUNK_SIZE  # bids validated or written per transaction
+JOURNAL_MAX_BYTES = 16 * 1024 * 1024  # size above which the journal file is emptied once all its bids are written
+
+
+def _query_checkpoint(session, journal):
+    return session.execute(select(BidJournalCheckpoint.last_sequence)
+                           .where(BidJournalCheckpoint.journal == journal)).scalar() or 0
+
+
+def _write_journal_batch(session, journal, records):
+    """Writes a batch of journal records (sequence, user_name, artwork_id, value) to the bid table and
+    moves the checkpoint of the journal to the last one. Returns the list of BidResult."""
+    results = db_handler._apply_bid_chunk(session, [record[1:] for record in records], True)
+    statement = sqlite_insert(BidJournalCheckpoint).values(journal=journal, last_sequence=records[-1][0])
+    session.execute(statement.on_conflict_do_update(index_elements=['journal'],
+                                                    set_={'last_sequence': statement.excluded.last_sequence}))
+    return results
+
+
+def _sync_database():
+    """Makes the committed transactions durable: a full checkpoint copies the write-ahead log to the database
+    file and syncs it. Returns False if the checkpoint could not complete (e.g. a reader kept an older snapshot
+    for longer than the busy timeout), in which case the journal must be kept."""
+    with session_scope() as session:
+        busy, _, _ = session.execute(text('PRAGMA wal_checkpoint(FULL)')).one()
+    return not busy
+
+
+def read_journal(path):
+    """Yields the records (sequence, user_name, artwork_id, value) of a journal file. A last line that was
+    only partly written (the server stopped during the append, so the bid was never acknowledged) is skipped."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as journal_file:
+        for line in journal_file:
+            if not line.endswith(b'\n'):
+                logger.warning("Skipping the incomplete last record of the bid journal %s", path)
+                return
+            yield tuple(json.loads(line))
+
+
+class BidJournal:
+    """Append-only journal of the bids of one action server, see the top of this file.
+    Call open() before submitting bids and close() when the server stops."""
+
+    def __init__(self, path: str, flush_interval: float = JOURNAL_FLUSH_INTERVAL,
+                 batch_size: int = JOURNAL_BATCH_SIZE):
+        self.path = os.path.abspath(path)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # Guards the queues below, the sequence numbers and the counters
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._file = None  # only written by the commit thread
+        self._next_sequence = 1
+        self._flushed_sequence = 0  # last record written to the bid table
+        self._submitted = []  # (user_name, artwork_id, value, future) waiting for the commit thread
+        self._pending = []  # records synced to the journal but not written to the bid table yet
+        self._pending_values = {}  # (user_name, artwork_id) -> (sequence, value) of the last pending bid
+        self._closing = False
+        self._threads = []
+        self.counters = Counter()  # submitted, appended, fsyncs, flushed, batches, rejected, replayed
+
+    def open(self):
+        """Writes the bids of the journal that are not in the bid table yet (after a crash), then starts
+        a new, empty journal file and the commit and flush threads. Returns the number of bids replayed."""
+        with session_scope() as session:
+            checkpoint = _query_checkpoint(session, self.path)
+        last_sequence = checkpoint
+        replayed = []
+        for record in read_journal(self.path):
+            last_sequence = max(last_sequence, record[0])
+            if record[0] > checkpoint:
+                replayed.append(record)
+        for chunk in db_handler._chunks(replayed, self.batch_size):
+            self._write_batch(chunk)
+        if replayed:
+            logger.info("Replayed %d bids of the bid journal %s", len(replayed), self.path)
+        self.counters['replayed'] += len(replayed)
+        # Every bid of the journal is now in the bid table, so the file can be emptied once they are durable
+        # (otherwise the next journal records are appended and the bids replayed are skipped at the next open)
+        self._file = open(self.path, 'wb' if _sync_database() else 'ab')
+        os.fsync(self._file.fileno())
+        self._next_sequence = last_sequence + 1
+        self._flushed_sequence = last_sequence
+        self._threads = [threading.Thread(target=self._commit_loop, name='bid-journal-commit', daemon=True),
+                         threading.Thread(target=self._flush_loop, name='bid-journal-flush', daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return len(replayed)
+
+    def close(self):
+        """Waits for the submitted bids to be journaled and written to the bid table, then stops the threads."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self.flush()
+        self._file.close()
+
+    def _submit(self, user_name, artwork_id, new_value):
+        """Queues a bid for the commit thread and returns a Future of its BidResult."""
+        future = Future()
+        with self._condition:
+            if self._closing:
+                raise RuntimeError(f"The bid journal {self.path} is closed")
+            self._submitted.append((user_name, artwork_id, new_value, future))
+            self.counters['submitted'] += 1
+            self._condition.notify_all()
+        return future
+
+    def submit_bid(self, user_name: str, artwork_id: str, new_value: int):
+        """Like db_handler.submit_bid(), but the bid is appended to the journal: returns the BidResult
+        once the bid is durably saved in the journal (it is written to the bid table later)."""
+        return self._submit(user_name, artwork_id, new_value).result()
+
+    async def submit_bid_async(self, user_name: str, artwork_id: str, new_value: int):
+        """Async version of submit_bid(), used by the custom actions."""
+        return await asyncio.wrap_future(self._submit(user_name, artwork_id, new_value))
+
+    def _commit_loop(self):
+        """Commit thread: journals the bids submitted since the previous group."""
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._submitted or self._closing)
+                if not self._submitted:  # closing
+                    return
+                group = self._submitted[:self.batch_size]
+                del self._submitted[:self.batch_size]
+            try:
+                results = self._commit(group)
+            except Exception as error:  # e.g. the disk is full: the bids of the group are not acknowledged
+                logger.exception("Could not journal %d bids", len(group))
+                for *_, future in group:
+                    future.set_exception(error)
+            else:
+                for (*_, future), result in zip(group, results):
+                    future.set_result(result)
+
+    def _commit(self, group):
+        """Validates a group of submitted bids, appends the valid ones to the journal with a single fsync
+        and returns their BidResult."""
+        bids = [(user_name, artwork_id, value) for user_name, artwork_id, value, _ in group]
+        with self._condition:  # the bids of the journal that are not in the bid table yet
+            pending_values = {(user_name, artwork_id): self._pending_values[(user_name, artwork_id)][1]
+                              for user_name, artwork_id, _ in bids if (user_name, artwork_id) in self._pending_values}
+            truncate = (not self._pending and self._flushed_sequence == self._next_sequence - 1
+                        and self._file.tell() >= JOURNAL_MAX_BYTES)
+        if truncate and _sync_database():  # every bid of the journal is durably in the bid table
+            self._file.truncate(0)
+            self._file.seek(0)
+        with session_scope() as session:
+            results = db_handler._check_bid_chunk(session, bids, True, pending_values)
+        records = []
+        for result in results:
+            if result.written:  # i.e. valid: invalid bids are not journaled
+                records.append((self._next_sequence, result.user_name, result.artwork_id, result.value))
+                self._next_sequence += 1
+        if records:
+            self._file.write(b''.join(json.dumps(record).encode() + b'\n' for record in records))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        with self._condition:
+            self._pending.extend(records)
+            for sequence, user_name, artwork_id, value in records:
+                self._pending_values[(user_name, artwork_id)] = (sequence, value)
+            self.counters['appended'] += len(records)
+            self.counters['fsyncs'] += bool(records)
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify_all()  # wakes up the flush thread
+            db_handler._record_in_portfolios(results)  # the user sees the bid as soon as it is acknowledged
+        return results
+
+    def _flush_loop(self):
+        """Flush thread: writes the journaled bids to the bid table every flush_interval."""
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._closing or len(self._pending) >= self.batch_size,
+                                         self.flush_interval)
+                if self._closing:
+                    return
+            try:
+                self.flush()
+            except Exception:  # e.g. the database is locked: the bids stay in the journal and are retried
+                logger.exception("Could not write the journaled bids to the bid table")
+
+    def flush(self):
+        """Writes the journaled bids to the bid table, batch_size bids per transaction, and returns the
+        number of bids written."""
+        with self._flush_lock:
+            with self._condition:
+                records, self._pending = self._pending, []
+            flushed = 0
+            try:
+                for chunk in db_handler._chunks(records, self.batch_size):
+                    self._write_batch(chunk)
+                    flushed += len(chunk)
+            finally:
+                if flushed < len(records):  # put the bids that were not written back in front of the queue
+                    with self._condition:
+                        self._pending = records[flushed:] + self._pending
+            return flushed
+
+    def _write_batch(self, records):
+        with session_scope() as session:  # the bids and the checkpoint are committed together
+            results = _write_journal_batch(session, self.path, records)
+        # The portfolios already have the values acknowledged, and must not get back the older value of a bid
+        # that was modified again since (only the last journaled value of each bid is recorded)
+        db_handler._bids_written(results, update_portfolios=False)
+        latest = []
+        with self._condition:  # so that an older value is never recorded after a newer one was acknowledged
+            self._flushed_sequence = max(self._flushed_sequence, records[-1][0])
+            for (sequence, user_name, artwork_id, _), result in zip(records, results):
+                if self._pending_values.get((user_name, artwork_id), (sequence,))[0] == sequence:
+                    self._pending_values.pop((user_name, artwork_id), None)
+                    latest.append(result)
+                if not result.written:  # e.g. the minimum bid was raised after the bid was acknowledged
+                    logger.warning("Journaled bid %d was rejected by the database: %s", sequence, result.message)
+                    db_handler.portfolio_cache.invalidate(user_name)  # it has the value acknowledged
+                    self.counters['rejected'] += 1
+            self.counters['flushed'] += len(records)
+            self.counters['batches'] += 1
+            db_handler._record_in_portfolios(latest)
+
+    def stats(self):
+        """Returns the counters of the journal and the number of bids not written to the bid table yet."""
+        with self._condition:
+            return dict(self.counters, pending=len(self._pending))
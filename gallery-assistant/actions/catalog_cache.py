@@ -0,0 +1,133 @@
+# catalog_cache.py
+# Small in-memory cache for the artwork catalog.
+# The artwork rows almost never change, but the custom actions look them up
+# several times per conversation turn. This cache sits in front of the database
+# queries in db_handler.py so that repeated lookups do not go to disk.
+# DataVersions numbers the changes of the artworks and users, so that the values
+# derived from them (e.g. the messages cached in response_cache.py) can be keyed
+# on the version of the data they were built from.
+# Resources consulted:
+# https://docs.python.org/3/library/collections.html#collections.OrderedDict
+# https://docs.python.org/3/library/threading.html#lock-objects
+# https://docs.python.org/3/library/time.html#time.monotonic
+###################################
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()  # sentinel to distinguish "not in cache" from a cached None
+
+
+class CatalogCache:
+    """Bounded LRU cache where each entry also expires after a time-to-live (in seconds).
+    The least recently used entry is evicted when the cache is full. Hit and miss counters
+    are kept so that the effectiveness of the cache can be checked."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expiry time, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Returns the cached value for key, or default if the key is not cached or has expired."""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():  # entry is stale
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)  # mark as most recently used
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """Returns the cached value for key like get(), but without counting a hit or a miss nor
+        marking the entry as recently used (e.g. to update a cached value in place)."""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING or entry[0] < time.monotonic():
+                return default
+            return entry[1]
+
+    def put(self, key, value):
+        """Adds (or replaces) the value for key, evicting the least recently used entry if needed."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Removes key from the cache (does nothing if it is not cached)."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry (the counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns a dictionary with the hit/miss counters and the current size of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self._entries),
+                    'max_size': self.max_size,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+class DataVersions:
+    """Version numbers of the artworks and of the users, increased every time one of their bids is
+    written. A value computed from the data of an artwork can be cached under its current version:
+    after a change, the new version gives another key, so the stale value is never read again (and
+    is eventually evicted from the LRU cache)."""
+
+    def __init__(self):
+        self._counter = itertools.count(1)  # versions are never reused, even after bump_all()
+        self._lock = threading.Lock()
+        self._base = 0  # version of everything that did not change since the last bump_all()
+        self._versions = {}  # ('artwork', artwork_id) or ('user', user_name) -> version
+
+    def catalog(self):
+        """Returns the current version of the catalog itself (titles, artists, minimum bids), which the bids do not
+        change: it only changes with bump_all() (e.g. when another catalog snapshot is loaded)."""
+        with self._lock:
+            return self._base
+
+    def artwork(self, artwork_id):
+        """Returns the current version of an artwork (its bids and bid statistics)."""
+        with self._lock:
+            return self._versions.get(('artwork', artwork_id), self._base)
+
+    def user(self, user_name):
+        """Returns the current version of a user (their bids)."""
+        with self._lock:
+            return self._versions.get(('user', user_name), self._base)
+
+    def bump(self, artwork_ids=(), user_names=()):
+        """Gives a new version to the artworks and users whose data changed."""
+        with self._lock:
+            version = next(self._counter)
+            for artwork_id in artwork_ids:
+                self._versions[('artwork', artwork_id)] = version
+            for user_name in user_names:
+                self._versions[('user', user_name)] = version
+
+    def bump_all(self):
+        """Gives a new version to every artwork and user (e.g. after the statistics were recomputed)."""
+        with self._lock:
+            self._versions.clear()
+            self._base = next(self._counter)
@@ -0,0 +1,132 @@
+# catalog_snapshot.py
+# Read-only snapshot of the artwork catalog, for the processes that mostly read it (the action servers and
+# the web application). export_catalog.py copies the catalog columns of the artwork table and the full-text
+# index to a separate SQLite file, and publishes it by renaming it over the previous snapshot. The readers
+# open the file with immutable=1 (SQLite takes no locks and never checks for changes) and a large mmap_size,
+# so the pages are read straight from the memory mapping of the file and shared by every worker of the
+# machine. A snapshot file is never modified once published: a new export replaces the file (the open
+# connections keep reading the old one), and CatalogSnapshot switches to the new file when it sees that the
+# path now points to another file. The database itself is then only used for the bids and bid statistics.
+# The action server and the web application use a snapshot when GALLERY_CATALOG_SNAPSHOT is set to the path
+# of the snapshot file (e.g. GALLERY_CATALOG_SNAPSHOT=catalog.db).
+# Resources consulted:
+# see db_handler.py
+# https://www.sqlite.org/uri.html#uriimmutable
+# https://www.sqlite.org/mmap.html
+# https://docs.sqlalchemy.org/en/14/dialects/sqlite.html#uri-connections
+# https://docs.python.org/3/library/os.html#os.replace
+###################################
+import os
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+from .artwork_search import _search_artworks
+from .db_models import POOL_SIZE, POOL_MAX_OVERFLOW, SQL_ECHO
+
+CATALOG_SNAPSHOT_PATH = os.environ.get('GALLERY_CATALOG_SNAPSHOT')  # None: the catalog is read from the database
+SNAPSHOT_CHECK_INTERVAL = 1.0  # seconds between two checks for a new snapshot file
+SNAPSHOT_MMAP_SIZE = 256 * 1024 * 1024  # bytes of the snapshot file mapped in memory (more than the catalog needs)
+
+# The catalog columns of an artwork (ArtworkInfo without the bid statistics, which are not in the snapshot)
+CatalogEntry = namedtuple('CatalogEntry', ['artwork_id', 'title', 'artist_name', 'medium', 'category', 'min_bid'])
+# The lookup of an artwork is the most frequent query, so it runs on the DBAPI cursor directly: building and
+# executing a select() costs about 20 times more than reading the row from the mapped file.
+_CATALOG_ENTRY_SQL = f"SELECT {', '.join(CatalogEntry._fields)} FROM artwork WHERE artwork_id = ?"
+
+
+def _query_catalog_entry(dbapi_connection, artwork_id):
+    cursor = dbapi_connection.cursor()
+    try:
+        row = cursor.execute(_CATALOG_ENTRY_SQL, (artwork_id,)).fetchone()
+    finally:
+        cursor.close()
+    return None if row is None else CatalogEntry(*row)
+
+
+def set_snapshot_pragmas(dbapi_connection, connection_record):
+    """Configures every new connection to a snapshot file."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA mmap_size={SNAPSHOT_MMAP_SIZE}')
+    cursor.execute('PRAGMA query_only=1')
+    cursor.close()
+
+
+class CatalogSnapshot:
+    """Reads the catalog from the snapshot file at path (see the top of this file). on_swap is called
+    when a new snapshot file is published, e.g. to drop the values derived from the previous one."""
+
+    def __init__(self, path: str, on_swap=None):
+        self.path = os.path.abspath(path)
+        self.on_swap = on_swap
+        self.swaps = 0  # number of times a new snapshot file was opened
+        self._engine = None
+        self._file_id = None  # (inode, modification time) of the file the engine reads
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def _create_engine(self):
+        # The pool keeps the connections (and their memory mapping) open between the queries. The pooled
+        # connections are used from several threads, which is safe since the file is never written.
+        engine = create_engine(f'sqlite:///file:{self.path}?immutable=1&uri=true', echo=SQL_ECHO,
+                               poolclass=QueuePool, pool_size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW,
+                               connect_args={'check_same_thread': False})
+        event.listen(engine, 'connect', set_snapshot_pragmas)
+        return engine
+
+    def get_engine(self):
+        """Returns the engine of the current snapshot file, switching to a new file when one was published
+        since the last check (at most every SNAPSHOT_CHECK_INTERVAL seconds)."""
+        now = time.monotonic()
+        if now < self._next_check:
+            return self._engine
+        with self._lock:
+            if now >= self._next_check:
+                try:
+                    stat = os.stat(self.path)
+                except FileNotFoundError:
+                    if self._engine is None:
+                        raise FileNotFoundError(f"No catalog snapshot at {self.path}, run export_catalog.py")
+                    stat = None  # keep reading the current snapshot
+                if stat is not None and (stat.st_ino, stat.st_mtime_ns) != self._file_id:
+                    previous, self._engine = self._engine, self._create_engine()
+                    self._file_id = (stat.st_ino, stat.st_mtime_ns)
+                    if previous is not None:
+                        # The connections in use finish their query on the previous file, and are closed
+                        # when they are returned
+                        previous.dispose()
+                        self.swaps += 1
+                        if self.on_swap is not None:
+                            self.on_swap()
+                self._next_check = now + SNAPSHOT_CHECK_INTERVAL
+            return self._engine
+
+    def get_entry(self, artwork_id: str):
+        """Returns the CatalogEntry of an artwork, or None if no artwork has this id."""
+        connection = self.get_engine().raw_connection()
+        try:
+            return _query_catalog_entry(connection, artwork_id)
+        finally:
+            connection.close()  # returns it to the pool
+
+    def get_artwork_ids(self):
+        """Returns the list of the ID codes of the artworks of the snapshot."""
+        connection = self.get_engine().raw_connection()
+        try:
+            return [row[0] for row in connection.execute("SELECT artwork_id FROM artwork")]
+        finally:
+            connection.close()
+
+    def search(self, query: str, page: int, per_page: int):
+        """Same as db_handler.search_artworks(), on the snapshot."""
+        with self.get_engine().connect() as connection:
+            return _search_artworks(connection, query, page, per_page)
+
+    def dispose(self):
+        """Closes the pooled connections."""
+        with self._lock:
+            if self._engine is not None:
+                self._engine.dispose()
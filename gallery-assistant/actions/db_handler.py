@@ -10,20 +10,410 @@
 # https://docs.sqlalchemy.org/en/14/orm/query.html  <-- Query API
 # https://docs.sqlalchemy.org/en/14/orm/session_api.html  <--  Session API
 # https://docs.python.org/3/reference/import.html#package-relative-imports
+# https://docs.sqlalchemy.org/en/14/orm/session_basics.html#when-do-i-construct-a-session-when-do-i-commit-it-and-when-do-i-close-it
+# https://docs.sqlalchemy.org/en/14/orm/query.html#sqlalchemy.orm.Query.update
+# https://docs.sqlalchemy.org/en/14/core/tutorial.html#correlated-updates
+# https://docs.sqlalchemy.org/en/14/dialects/sqlite.html#insert-on-conflict-upsert
+# https://www.sqlite.org/lang_upsert.html
+# https://www.sqlite.org/lang_transaction.html  <-- BEGIN IMMEDIATE
+# https://docs.sqlalchemy.org/en/14/core/tutorial.html#executing-multiple-statements  <-- executemany
+# https://docs.python.org/3/library/collections.html#collections.namedtuple
 ###################################
-from .db_models import Session, User, Bid, Artwork
+from contextlib import contextmanager
+from collections import namedtuple
+from itertools import islice
 
-session = Session()
+from sqlalchemy import func, select, update, literal, tuple_, bindparam, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
+from .db_models import Session, User, Bid, Artwork, ChangeCounter
+from .catalog_cache import CatalogCache, DataVersions
+from .catalog_snapshot import CatalogSnapshot, CatalogEntry, CATALOG_SNAPSHOT_PATH
+from .portfolio_cache import Portfolio, PORTFOLIO_CACHE_SIZE, PORTFOLIO_MAX_BIDS
+from .artwork_search import _search_artworks, DEFAULT_PER_PAGE
+from .artwork_suggestions import ArtworkIdIndex, SUGGESTION_LIMIT
+from .bid_events import BidEventHub
 
-def get_bids_for_user(user_name: str):
-    """Function that takes a user_name and returns a list of pairs (artwork_id, value) for
-    each bid made by the user that can be found in the database."""
-    user = session.query(User).get(user_name)  # returns user with this primary key or None if it does not exist
-    if user is None:
-        return []
+# Artwork rows are looked up several times per conversation turn but almost never change,
+# so they are kept in a bounded in-memory cache. Entries are dropped when a bid is written.
+CATALOG_CACHE_SIZE = 1024  # maximum number of artworks kept in memory
+CATALOG_CACHE_TTL = 300  # seconds before a cached artwork is re-read from the database
+catalog_cache = CatalogCache(max_size=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL)
+# Version of the data of every artwork and user, increased when one of their bids is written (see
+# response_cache.py). Like the catalog cache, it only sees the writes made by this process.
+data_versions = DataVersions()
+# Bids of the users of the current conversations (see portfolio_cache.py), updated when a bid is written
+portfolio_cache = CatalogCache(max_size=PORTFOLIO_CACHE_SIZE, ttl=CATALOG_CACHE_TTL)
+# Index of the artwork ID codes for the suggestions (see artwork_suggestions.py), a single entry that is
+# built again after the TTL, so that new artworks are suggested too
+suggestion_index_cache = CatalogCache(max_size=1, ttl=CATALOG_CACHE_TTL)
+# Live bid updates (see bid_events.py), published when a bid written by this process is committed
+bid_event_hub = BidEventHub()
+
+
+def _catalog_swapped():
+    """Drops the values derived from the previous catalog snapshot."""
+    data_versions.bump_all()  # the cached messages showing the catalog are rebuilt
+    suggestion_index_cache.clear()
+
+
+# Read-only snapshot of the catalog (see catalog_snapshot.py), used for the catalog lookups, the search and
+# the suggestions when GALLERY_CATALOG_SNAPSHOT is set
+catalog_snapshot = CatalogSnapshot(CATALOG_SNAPSHOT_PATH, on_swap=_catalog_swapped) if CATALOG_SNAPSHOT_PATH else None
+
+
+@contextmanager
+def session_scope():
+    """Unit of work around a short-lived session. Every function of this module opens its own
+    scope, so no state is shared between the requests handled by the action server. The changes
+    are committed when the block ends (or rolled back if an exception was raised) and the session
+    is then closed and removed from the thread-local registry. Returned objects are detached,
+    so any relationship that the caller needs must be loaded inside the scope."""
+    session = Session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        Session.remove()
+
+
+# The queries themselves are written as private functions taking the session as first argument.
+# The public functions below run them in a synchronous session_scope(), while async_db_handler.py
+# runs the very same functions through AsyncSession.run_sync().
+
+def _query_bids_for_user(session, user_name, after_artwork_id=None, limit=None):
+    # Plain (artwork_id, value) rows selected with Core (no ORM objects), in artwork id order so that
+    # the next page starts right after the last artwork id of the previous one (keyset pagination).
+    # The primary key index (user_name, artwork_id) serves both the filter and the order.
+    query = select(Bid.artwork_id, Bid.value).where(Bid.user_name == user_name).order_by(Bid.artwork_id)
+    if after_artwork_id is not None:
+        query = query.where(Bid.artwork_id > after_artwork_id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [tuple(row) for row in session.execute(query)]
+
+
+def _count_bids_for_user(session, user_name):
+    return session.execute(select(func.count()).where(Bid.user_name == user_name)).scalar()
+
+
+class BidResult(namedtuple('BidResult', ['status', 'user_name', 'artwork_id', 'value', 'min_bid',
+                                         'previous_value'])):
+    """Structured result of a bid submission. status is one of the BID_* constants below,
+    previous_value is the value of the bid before the submission (None if there was no bid)."""
+    __slots__ = ()
+
+    @property
+    def written(self):
+        """True if the bid was saved to the database."""
+        return self.status in (BID_CREATED, BID_UPDATED)
+
+    @property
+    def message(self):
+        """Confirmation/error message for the user."""
+        if self.status == BID_CREATED:
+            return f"Ok {self.user_name}, your bid for artwork {self.artwork_id} with value {self.value} was " \
+                   f"successfully created."
+        elif self.status == BID_UPDATED:
+            return f"Ok {self.user_name}, your bid for artwork {self.artwork_id} was successfully updated with the " \
+                   f"new value {self.value}."
+        elif self.status == BID_BELOW_MINIMUM and self.previous_value is None:
+            return f"Sorry {self.user_name}, I could not create your bid with value {self.value} since the minimum " \
+                   f"bid for artwork {self.artwork_id} is {self.min_bid}."
+        elif self.status == BID_BELOW_MINIMUM:
+            return f"Sorry {self.user_name}, I could not update your bid with the new value {self.value} since the " \
+                   f"minimum bid for artwork {self.artwork_id} is {self.min_bid}."
+        elif self.status == BID_INVALID_VALUE:
+            return f"Sorry {self.user_name}, {self.value} is not a valid bid amount."
+        elif self.status == BID_NOT_FOUND:
+            return f"An error occurred: there is no bid for user {self.user_name} and artwork {self.artwork_id} " \
+                   f"currently in the database."
+        else:
+            return f"An error occurred: either the user {self.user_name} or the artwork {self.artwork_id} does " \
+                   f"not exist."
+
+
+BID_CREATED = 'created'
+BID_UPDATED = 'updated'
+BID_BELOW_MINIMUM = 'below_minimum'
+BID_NOT_FOUND = 'not_found'  # no existing bid to update and creation was not allowed
+BID_UNKNOWN_USER_OR_ARTWORK = 'unknown_user_or_artwork'
+BID_INVALID_VALUE = 'invalid_value'  # only reported by apply_bids(), the value is not an integer
+
+BULK_BID_CHUNK_SIZE = 500  # number of bids validated and written per transaction by apply_bids()
+
+
+def _bid_upsert_statement(user_name, artwork_id, new_value, create_if_not_exists):
+    """Builds the single statement that writes a bid. The minimum bid is checked inside the statement,
+    so the bid cannot be written if it is too low, even if the artwork changed in the meantime:
+
+    INSERT INTO bid (user_name, artwork_id, value)
+    SELECT user.user_name, artwork.artwork_id, :value FROM user JOIN artwork ON artwork.artwork_id = :artwork_id
+    WHERE user.user_name = :user_name AND artwork.min_bid <= :value
+    ON CONFLICT (user_name, artwork_id) DO UPDATE SET value = excluded.value
+
+    If create_if_not_exists is False, it is an UPDATE of the existing bid with the same check instead."""
+    if create_if_not_exists:
+        source = select(User.user_name, Artwork.artwork_id, literal(new_value)) \
+            .join_from(User, Artwork, Artwork.artwork_id == artwork_id) \
+            .where(User.user_name == user_name, Artwork.min_bid <= new_value)
+        statement = sqlite_insert(Bid).from_select(['user_name', 'artwork_id', 'value'], source)
+        return statement.on_conflict_do_update(index_elements=['user_name', 'artwork_id'],
+                                               set_={'value': statement.excluded.value})
     else:
-        return [(b.artwork.artwork_id, b.value) for b in user.bids]
+        min_bid = select(Artwork.min_bid).where(Artwork.artwork_id == artwork_id).scalar_subquery()
+        return update(Bid).where(Bid.user_name == user_name, Bid.artwork_id == artwork_id, min_bid <= new_value) \
+            .values(value=new_value).execution_options(synchronize_session=False)
+
+
+def _begin_write(session):
+    """Starts the transaction of a session that reads and then writes the bids with BEGIN IMMEDIATE, so it must be
+    the first statement of the session. The write lock is taken before the reads (waiting up to the busy timeout),
+    whereas a deferred transaction that must upgrade its read lock fails at once with "database is locked" when
+    another connection wrote in the meantime (the busy timeout does not apply to it)."""
+    session.execute(text('BEGIN IMMEDIATE'))
+
+
+def _write_bid_value(session, user_name, artwork_id, new_value, create_if_not_exists):
+    """Does the work of submit_bid() and returns a BidResult."""
+    _begin_write(session)
+    # One read fetches everything needed to explain the outcome (instead of a lookup per table).
+    min_bid, user_exists, previous_value = session.query(
+        select(Artwork.min_bid).where(Artwork.artwork_id == artwork_id).scalar_subquery(),
+        select(User.user_name).where(User.user_name == user_name).exists(),
+        select(Bid.value).where(Bid.user_name == user_name, Bid.artwork_id == artwork_id).scalar_subquery()).one()
+    result = BidResult(None, user_name, artwork_id, new_value, min_bid, previous_value)
+    if previous_value is None and not create_if_not_exists:
+        return result._replace(status=BID_NOT_FOUND)
+    if min_bid is None or not user_exists:
+        return result._replace(status=BID_UNKNOWN_USER_OR_ARTWORK)
+    if new_value < min_bid:  # bid is not valid
+        return result._replace(status=BID_BELOW_MINIMUM)
+    written = session.execute(_bid_upsert_statement(user_name, artwork_id, new_value, create_if_not_exists))
+    if written.rowcount == 0:  # the artwork changed between the read and the write
+        return result._replace(status=BID_BELOW_MINIMUM)
+    return result._replace(status=BID_CREATED if previous_value is None else BID_UPDATED)
+
+
+def _check_bid_chunk(session, chunk, create_if_not_exists, pending_values=None):
+    """Validates a chunk of (user_name, artwork_id, value) triples without writing them and returns the list
+    of BidResult (in the same order), whose status is BID_CREATED or BID_UPDATED for the bids that can be
+    written. pending_values: {(user_name, artwork_id): value} of bids that are not in the bid table yet."""
+    # Fetch the minimum bids, the users and the existing bids of the whole chunk with one query each
+    artwork_ids = {artwork_id for _, artwork_id, _ in chunk}
+    user_names = {user_name for user_name, _, _ in chunk}
+    min_bids = dict(session.execute(select(Artwork.artwork_id, Artwork.min_bid)
+                                    .where(Artwork.artwork_id.in_(artwork_ids))).all())
+    users = set(session.execute(select(User.user_name).where(User.user_name.in_(user_names))).scalars())
+    pairs = {(user_name, artwork_id) for user_name, artwork_id, _ in chunk}
+    current_values = {(user_name, artwork_id): value for user_name, artwork_id, value in session.execute(
+        select(Bid.user_name, Bid.artwork_id, Bid.value).where(tuple_(Bid.user_name, Bid.artwork_id).in_(pairs)))}
+    current_values.update(pending_values or {})
+
+    results = []
+    for user_name, artwork_id, value in chunk:
+        previous_value = current_values.get((user_name, artwork_id))
+        result = BidResult(None, user_name, artwork_id, value, min_bids.get(artwork_id), previous_value)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            results.append(result._replace(status=BID_INVALID_VALUE))
+            continue
+        result = result._replace(value=value)
+        if previous_value is None and not create_if_not_exists:
+            results.append(result._replace(status=BID_NOT_FOUND))
+        elif result.min_bid is None or user_name not in users:
+            results.append(result._replace(status=BID_UNKNOWN_USER_OR_ARTWORK))
+        elif value < result.min_bid:
+            results.append(result._replace(status=BID_BELOW_MINIMUM))
+        else:
+            results.append(result._replace(status=BID_CREATED if previous_value is None else BID_UPDATED))
+            current_values[(user_name, artwork_id)] = value  # a later bid in the chunk replaces this one
+    return results
+
+
+def _apply_bid_chunk(session, chunk, create_if_not_exists):
+    """Does the work of apply_bids() for one chunk of (user_name, artwork_id, value) triples and
+    returns the list of BidResult (in the same order)."""
+    _begin_write(session)
+    results = _check_bid_chunk(session, chunk, create_if_not_exists)
+    # parameters of the bids to write
+    rows = [{'b_user_name': result.user_name, 'b_artwork_id': result.artwork_id, 'b_value': result.value}
+            for result in results if result.written]
+    if rows:  # one executemany for all the valid bids of the chunk
+        statement = sqlite_insert(Bid).values(user_name=bindparam('b_user_name'),
+                                              artwork_id=bindparam('b_artwork_id'), value=bindparam('b_value'))
+        statement = statement.on_conflict_do_update(index_elements=['user_name', 'artwork_id'],
+                                                    set_={'value': statement.excluded.value})
+        session.execute(statement, rows)
+    return results
+
+
+def _chunks(iterable, size):
+    """Splits an iterable into lists of at most size elements (without loading it all in memory)."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def _recompute_bid_statistics(session):
+    """Recomputes bid_count and highest_bid of every artwork from the bid table."""
+    bids = session.query(Bid).filter(Bid.artwork_id == Artwork.artwork_id)  # correlated with the updated row
+    session.query(Artwork).update(
+        {Artwork.bid_count: bids.with_entities(func.count()).scalar_subquery(),
+         Artwork.highest_bid: bids.with_entities(func.max(Bid.value)).scalar_subquery()},
+        synchronize_session=False)
+
+
+# The artworks and bids leave this module as immutable records built from the selected columns, rather
+# than as ORM objects: they take less memory in the catalog cache, can be shared between threads and
+# conversations, and reading them can never trigger a lazy load (e.g. of artwork.bidders) after the
+# session is closed.
+ArtworkInfo = namedtuple('ArtworkInfo', ['artwork_id', 'title', 'artist_name', 'medium', 'category', 'min_bid',
+                                         'bid_count', 'highest_bid'])
+BidInfo = namedtuple('BidInfo', ['user_name', 'artwork_id', 'value'])
+# Number of changes of a kind of data and unix time of the last one (see ChangeCounter in db_models.py)
+ChangeCount = namedtuple('ChangeCount', ['version', 'changed_at'])
+
+_ARTWORK_INFO_COLUMNS = [getattr(Artwork, field) for field in ArtworkInfo._fields]
+_BID_INFO_COLUMNS = [getattr(Bid, field) for field in BidInfo._fields]
+
+
+def _query_artwork(session, artwork_id):
+    row = session.execute(select(*_ARTWORK_INFO_COLUMNS).where(Artwork.artwork_id == artwork_id)).first()
+    return None if row is None else ArtworkInfo(*row)
+
+
+def _query_artworks(session, after_artwork_id, limit):
+    # Keyset pagination in artwork id order, like _query_bids_for_user()
+    query = select(*_ARTWORK_INFO_COLUMNS).order_by(Artwork.artwork_id).limit(limit)
+    if after_artwork_id is not None:
+        query = query.where(Artwork.artwork_id > after_artwork_id)
+    return [ArtworkInfo(*row) for row in session.execute(query)]
+
+
+def _query_artworks_by_id(session, artwork_ids):
+    query = select(*_ARTWORK_INFO_COLUMNS).where(Artwork.artwork_id.in_(artwork_ids))
+    return [ArtworkInfo(*row) for row in session.execute(query)]
+
+
+def _query_bids_for_users(session, user_names):
+    query = select(Bid.user_name, Bid.artwork_id, Bid.value).where(Bid.user_name.in_(user_names))
+    return [tuple(row) for row in session.execute(query)]
+
+
+def _query_change_counters(session):
+    query = select(ChangeCounter.name, ChangeCounter.version, ChangeCounter.changed_at)
+    return {name: ChangeCount(version, changed_at) for name, version, changed_at in session.execute(query)}
+
+
+def _query_popular_artworks(session, limit):
+    query = select(*_ARTWORK_INFO_COLUMNS).order_by(Artwork.bid_count.desc()).limit(limit)
+    return [ArtworkInfo(*row) for row in session.execute(query)]
+
+
+def _query_bid(session, user_name, artwork_id):
+    row = session.execute(select(*_BID_INFO_COLUMNS)
+                          .where(Bid.user_name == user_name, Bid.artwork_id == artwork_id)).first()
+    return None if row is None else BidInfo(*row)
+
+
+def _query_artwork_ids(session):
+    return [row[0] for row in session.execute(select(Artwork.artwork_id))]
+
+
+def _query_portfolio(session, user_name, max_bids):
+    exists = session.execute(select(User.user_name).where(User.user_name == user_name)).first() is not None
+    bids = _query_bids_for_user(session, user_name, limit=max_bids + 1) if exists else []
+    return Portfolio(user_name, exists, bids, complete=len(bids) <= max_bids)
+
+
+def _record_in_portfolios(results):
+    """Updates the cached portfolios of the users with the bids written, given their BidResult."""
+    for result in results:
+        if result.written:
+            portfolio = portfolio_cache.peek(result.user_name)
+            if portfolio is not None and portfolio.complete:
+                portfolio.set_value(result.artwork_id, result.value)
+
+
+def _cached_portfolio(user_name):
+    """Returns the portfolio of a user if it is in memory with all the bids of the user, None otherwise."""
+    portfolio = portfolio_cache.get(user_name)
+    return portfolio if portfolio is not None and portfolio.complete else None
+
+
+def _bids_written(results, update_portfolios=True):
+    """Updates the cached data of the bids written (once they are committed), given their BidResult."""
+    written = [result for result in results if result.written]
+    if written:
+        artwork_ids = {result.artwork_id for result in written}
+        for artwork_id in artwork_ids:
+            catalog_cache.invalidate(artwork_id)  # number of bids changed
+        data_versions.bump(artwork_ids, {result.user_name for result in written})
+        if update_portfolios:
+            _record_in_portfolios(written)
+        bid_event_hub.publish_bids(written)
+
+
+BID_PAGE_SIZE = 100  # number of bids fetched per query by iter_bids_for_user()
+
+
+def get_bids_for_user(user_name: str, after_artwork_id: str = None, limit: int = None):
+    """Function that takes a user_name and returns a list of pairs (artwork_id, value) for
+    each bid made by the user that can be found in the database, ordered by artwork id.
+    To get the bids one page at a time, give the number of bids per page as limit and the
+    last artwork id of the previous page as after_artwork_id."""
+    portfolio = _cached_portfolio(user_name)
+    if portfolio is not None:
+        return portfolio.page(after_artwork_id, limit)
+    with session_scope() as session:
+        return _query_bids_for_user(session, user_name, after_artwork_id, limit)
+
+
+def iter_bids_for_user(user_name: str, page_size: int = BID_PAGE_SIZE):
+    """Generator that yields the pairs (artwork_id, value) of all the bids of a user, fetching
+    them page_size at a time so that they are never all loaded in memory at once."""
+    after_artwork_id = None
+    while True:
+        page = get_bids_for_user(user_name, after_artwork_id, page_size)
+        yield from page
+        if len(page) < page_size:
+            return
+        after_artwork_id = page[-1][0]
+
+
+def count_bids_for_user(user_name: str):
+    """Function that returns the number of bids made by a user."""
+    portfolio = _cached_portfolio(user_name)
+    if portfolio is not None:
+        return len(portfolio)
+    with session_scope() as session:
+        return _count_bids_for_user(session, user_name)
+
+
+def submit_bid(user_name: str, artwork_id: str, new_value: int, create_if_not_exists=True):
+    """
+    Function that creates or updates the bid of a user for an artwork, if the new value is greater
+    or equal to the minimum bid of the artwork. The bid is written with a single upsert statement
+    that checks the minimum bid itself, so concurrent bids on the same artwork cannot interleave.
+
+    :param user_name: user name (string)
+    :param artwork_id: artwork id code (string), format: ABC123
+    :param new_value: int, must be >= min_bid of artwork
+    :param create_if_not_exists: set to true if bid should be created if it does not exist
+    :return: BidResult (status is one of BID_CREATED, BID_UPDATED, BID_BELOW_MINIMUM, BID_NOT_FOUND,
+             BID_UNKNOWN_USER_OR_ARTWORK)
+    """
+    with session_scope() as session:  # the bid is committed when this block ends
+        result = _write_bid_value(session, user_name, artwork_id, new_value, create_if_not_exists)
+    _bids_written([result])  # only once the change is saved to the database
+    return result
 
 
 def modify_bid_value(user_name: str, artwork_id: str, new_value: int, create_if_not_exists=True):
@@ -39,45 +429,114 @@ def modify_bid_value(user_name: str, artwork_id: str, new_value: int, create_if_
     :param create_if_not_exists: set to true if bid should be created if it does not exist
     :return: Confirmation/Error message (string)
     """
-    bid = session.query(Bid).get({"user_name": user_name, "artwork_id": artwork_id})
-    if bid is None:
-        if create_if_not_exists:
-            user = session.query(User).get(user_name)
-            artwork = session.query(Artwork).get(artwork_id)
-            if user is not None and artwork is not None:
-                if new_value >= artwork.min_bid:  # bid is valid
-                    new_bid = Bid(user=user, artwork=artwork, value=new_value)
-                    session.add(new_bid)
-                    session.commit()
-                    return f"Ok {user_name}, your bid for artwork {artwork_id} with value {new_value} was " \
-                           f"successfully created."
-                else:  # bid is not valid
-                    return f"Sorry {user_name}, I could not create your bid with value {new_value} since the minimum " \
-                           f"bid for artwork {artwork_id} is {artwork.min_bid}."
-            else:
-                return f"An error occurred: either the user {user_name} or the artwork {artwork_id} does not exist."
-        else:
-            return f"An error occurred: there is no bid for user {user_name} and artwork {artwork_id} " \
-               f"currently in the database."
-    else:  # there was such a bid in the database
-        if new_value >= bid.artwork.min_bid:  # new bid is valid
-            bid.value = new_value  # pending change
-            session.commit()  # save change to database
-            return f"Ok {user_name}, your bid for artwork {artwork_id} was successfully updated with the new " \
-                   f"value {new_value}."
-        else:  # new bid is not valid
-            return f"Sorry {user_name}, I could not update your bid with the new value {new_value} since the minimum " \
-                   f"bid for artwork {artwork_id} is {bid.artwork.min_bid}."
+    return submit_bid(user_name, artwork_id, new_value, create_if_not_exists).message
+
+
+def apply_bids(bids, create_if_not_exists=True, chunk_size=BULK_BID_CHUNK_SIZE):
+    """
+    Function to create or update many bids at once (e.g. to import the absentee and phone bids).
+    The bids are validated against the minimum bids in bulk and written with executemany, one
+    transaction per chunk. When the same user bids several times on an artwork, the last bid wins.
+
+    :param bids: iterable of triples (user_name, artwork_id, value)
+    :param create_if_not_exists: set to true if bids should be created if they do not exist
+    :param chunk_size: number of bids written per transaction
+    :return: list of BidResult, one per input triple (in the same order)
+    """
+    results = []
+    for chunk in _chunks(bids, chunk_size):
+        with session_scope() as session:  # each chunk is committed when this block ends
+            chunk_results = _apply_bid_chunk(session, chunk, create_if_not_exists)
+        _bids_written(chunk_results)
+        results.extend(chunk_results)
+    return results
 
 
-def get_artwork_info(artwork_id: str):
+def get_artwork_info(artwork_id: str, cached: bool = True):
     """
     Function to get information about artwork.
 
     :param artwork_id: artwork id code (string)
-    :return: Artwork object or None if no artwork has this id number
+    :param cached: False to read the artwork from the database even if it is in the catalog cache (whose bid
+    statistics do not include the bids written by the other processes)
+    :return: ArtworkInfo or None if no artwork has this id number
     """
-    return session.query(Artwork).get(artwork_id)
+    artwork = catalog_cache.get(artwork_id) if cached else None
+    if artwork is None:
+        with session_scope() as session:
+            artwork = _query_artwork(session, artwork_id)
+        if artwork is not None:  # unknown ids are not cached
+            catalog_cache.put(artwork_id, artwork)
+    return artwork
+
+
+ARTWORK_PAGE_SIZE = 50  # default number of artworks per page of get_artworks()
+
+
+def get_artworks(after_artwork_id: str = None, limit: int = ARTWORK_PAGE_SIZE):
+    """
+    Function to get the artworks of the catalog one page at a time, ordered by artwork id, with their bid
+    statistics as currently in the database (the catalog cache is not used).
+
+    :param after_artwork_id: last artwork id of the previous page (None for the first page)
+    :param limit: number of artworks per page
+    :return: list of ArtworkInfo
+    """
+    with session_scope() as session:
+        return _query_artworks(session, after_artwork_id, limit)
+
+
+def get_artworks_by_id(artwork_ids):
+    """
+    Function to get several artworks at once, with their bid statistics as currently in the database.
+
+    :param artwork_ids: iterable of artwork id codes
+    :return: list of ArtworkInfo of the artworks that exist, in no particular order
+    """
+    artworks = []
+    with session_scope() as session:
+        for chunk in _chunks(artwork_ids, BULK_BID_CHUNK_SIZE):
+            artworks.extend(_query_artworks_by_id(session, chunk))
+    return artworks
+
+
+def get_bids_for_users(user_names):
+    """
+    Function to get all the bids of several users at once.
+
+    :param user_names: iterable of user names
+    :return: list of BidInfo, in no particular order
+    """
+    bids = []
+    with session_scope() as session:
+        for chunk in _chunks(user_names, BULK_BID_CHUNK_SIZE):
+            bids.extend(BidInfo(*row) for row in _query_bids_for_users(session, chunk))
+    return bids
+
+
+def get_change_counters():
+    """
+    Function to get the number of changes of the catalog and of the bids made by any process, e.g. to
+    tell whether a page of data sent earlier is still up to date.
+
+    :return: dictionary {'catalog': ChangeCount, 'bids': ChangeCount}
+    """
+    with session_scope() as session:
+        return _query_change_counters(session)
+
+
+def get_catalog_entry(artwork_id: str):
+    """
+    Function to get the catalog information about an artwork (without the bid statistics), from the
+    catalog snapshot if there is one.
+
+    :param artwork_id: artwork id code (string)
+    :return: CatalogEntry or None if no artwork has this id number
+    """
+    if catalog_snapshot is not None:
+        return catalog_snapshot.get_entry(artwork_id)
+    artwork = get_artwork_info(artwork_id)
+    return None if artwork is None else CatalogEntry._make(artwork[:len(CatalogEntry._fields)])
 
 
 def get_min_bid_amount(artwork_id: str):
@@ -87,7 +546,7 @@ def get_min_bid_amount(artwork_id: str):
     :param artwork_id: artwork id code (string)
     :return: minimum bid amount (int) or None if no such artwork exists
     """
-    artwork = get_artwork_info(artwork_id)
+    artwork = get_catalog_entry(artwork_id)
     if artwork is None:
         return None
     else:
@@ -100,6 +559,111 @@ def get_bid_info(user_name: str, artwork_id: str):
 
     :param user_name: string
     :param artwork_id: string
-    :return: Bid object if it exists, None otherwise
+    :return: BidInfo if it exists, None otherwise
+    """
+    portfolio = _cached_portfolio(user_name)
+    if portfolio is not None:
+        value = portfolio.get_value(artwork_id)
+        return None if value is None else BidInfo(user_name, artwork_id, value)
+    with session_scope() as session:
+        return _query_bid(session, user_name, artwork_id)
+
+
+def get_portfolio(user_name: str):
+    """
+    Function to get the bids of a user, loaded from the database the first time and then kept in memory
+    (and updated when a bid of the user is written), so that get_bids_for_user(), count_bids_for_user()
+    and get_bid_info() are then answered from memory.
+
+    :param user_name: user name (string)
+    :return: Portfolio (its exists attribute is False if there is no such user)
+    """
+    portfolio = portfolio_cache.get(user_name)
+    if portfolio is None:
+        version = data_versions.user(user_name)
+        with session_scope() as session:
+            portfolio = _query_portfolio(session, user_name, PORTFOLIO_MAX_BIDS)
+        if data_versions.user(user_name) == version:  # no bid of the user was written during the query
+            portfolio_cache.put(user_name, portfolio)
+    return portfolio
+
+
+def search_artworks(query: str, page: int = 1, per_page: int = DEFAULT_PER_PAGE):
+    """
+    Function to search the artworks whose title, artist name, medium or category match a free text query
+    (e.g. "Eve Evans sculptures"), using the full-text index.
+
+    :param query: free text (string)
+    :param page: page number, starting at 1
+    :param per_page: number of results per page (at most artwork_search.MAX_PER_PAGE)
+    :return: SearchPage with the total number of matching artworks and the SearchResult of the page,
+             best matches first
+    """
+    if catalog_snapshot is not None:
+        return catalog_snapshot.search(query, page, per_page)
+    with session_scope() as session:
+        return _search_artworks(session, query, page, per_page)
+
+
+def suggest_artwork_ids(text: str, limit: int = SUGGESTION_LIMIT):
+    """
+    Function to find the existing artwork ID codes closest to a mistyped one (e.g. "abc12" or "ABC1O3"),
+    with an in-memory index of the codes built on the first call.
+
+    :param text: artwork ID code typed by the user (string)
+    :param limit: maximum number of codes returned
+    :return: list of artwork ID codes, the closest first (empty if no code is close enough)
+    """
+    index = suggestion_index_cache.get('index')
+    if index is None:
+        if catalog_snapshot is not None:
+            index = ArtworkIdIndex(catalog_snapshot.get_artwork_ids())
+        else:
+            with session_scope() as session:
+                index = ArtworkIdIndex(_query_artwork_ids(session))
+        suggestion_index_cache.put('index', index)
+    return index.suggest(text, limit)
+
+
+def recompute_bid_statistics():
+    """
+    Function to recompute the number of bids and the highest bid stored for every artwork
+    (e.g. after bids were inserted without going through modify_bid_value).
+    """
+    with session_scope() as session:
+        _recompute_bid_statistics(session)
+    catalog_cache.clear()
+    data_versions.bump_all()
+
+
+def prewarm_catalog_cache(limit: int = None):
+    """
+    Function to load the artworks with the most bids in the catalog cache, with a single query, so that
+    the first conversations do not have to wait for them (and the first connection is opened).
+
+    :param limit: number of artworks to load (by default, as many as the cache can hold)
+    :return: number of artworks loaded
+    """
+    with session_scope() as session:
+        artworks = _query_popular_artworks(session, limit or catalog_cache.max_size)
+    for artwork in artworks:
+        catalog_cache.put(artwork.artwork_id, artwork)
+    return len(artworks)
+
+
+def get_portfolio_cache_stats():
+    """
+    Function to get the hit/miss counters of the portfolio cache.
+
+    :return: dictionary with the same keys as get_catalog_cache_stats()
+    """
+    return portfolio_cache.stats()
+
+
+def get_catalog_cache_stats():
+    """
+    Function to get the hit/miss counters of the artwork catalog cache.
+
+    :return: dictionary with the keys hits, misses, evictions, size, max_size and hit_rate
     """
-    return session.query(Bid).get({"user_name": user_name, "artwork_id": artwork_id})
+    return catalog_cache.stats()
@@ -8,18 +8,115 @@
 # https://realpython.com/python-sqlite-sqlalchemy/
 # https://docs.sqlalchemy.org/en/13/orm/basic_relationships.html#association-object
 # https://docs.sqlalchemy.org/en/14/core/engines.html
+# https://docs.sqlalchemy.org/en/14/core/pooling.html
+# https://docs.sqlalchemy.org/en/14/dialects/sqlite.html#threading-pooling-behavior
+# https://docs.sqlalchemy.org/en/14/orm/contextual.html  <-- scoped_session
+# https://www.sqlite.org/wal.html
+# https://www.sqlite.org/pragma.html#pragma_busy_timeout
+# https://docs.sqlalchemy.org/en/14/orm/extensions/asyncio.html
+# https://docs.sqlalchemy.org/en/14/dialects/sqlite.html#module-sqlalchemy.dialects.sqlite.aiosqlite
+# https://docs.sqlalchemy.org/en/14/core/ddl.html#custom-ddl
+# https://www.sqlite.org/lang_createtrigger.html
+# https://www.sqlite.org/fts5.html
+# https://www.sqlite.org/windowfunctions.html
+# https://docs.sqlalchemy.org/en/14/orm/persistence_techniques.html#custom-vertical-partitioning  <-- get_bind()
+# https://docs.sqlalchemy.org/en/14/orm/extensions/asyncio.html#sqlalchemy.ext.asyncio.AsyncSession.sync_session_class
 #############################################
-from sqlalchemy import create_engine
+import os
+import threading
+
+from sqlalchemy import create_engine, event, DDL
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy import Column, String, Integer, ForeignKey, Float, Enum
+from sqlalchemy.orm import sessionmaker, relationship, scoped_session, Session as OrmSession
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy import Column, String, Integer, ForeignKey, Float, Enum, Index
+
+# The database settings can be changed with environment variables. By default, the database is the
+# gallery.db file of the gallery-assistant directory (an absolute path, so that it does not depend on
+# the directory the scripts, the action server or the web application are started from).
+db_path = os.environ.get('GALLERY_DB_PATH',
+                         os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gallery.db'))
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('GALLERY_DB_BUSY_TIMEOUT', 5))  # seconds a connection waits for a write lock
+POOL_SIZE = int(os.environ.get('GALLERY_DB_POOL_SIZE', 5))  # connections kept open in the pool
+# extra connections allowed when many conversations query at the same time
+POOL_MAX_OVERFLOW = int(os.environ.get('GALLERY_DB_POOL_MAX_OVERFLOW', 10))
+# Set to 1 to get the SQL queries made printed out on the standard output
+SQL_ECHO = os.environ.get('GALLERY_SQL_ECHO') == '1'
+
+# The engines are only created when the first query is made (not when this module is imported),
+# so that importing the actions package stays fast and does not need the database file.
+_engine = None
+_async_engine = None
+_engine_lock = threading.Lock()
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Configures every new SQLite connection. In WAL mode, readers do not block the writer
+    (and vice versa), so conversations can keep reading while a bid is being committed."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT * 1000}')  # in milliseconds
+    cursor.execute('PRAGMA synchronous=NORMAL')  # safe with WAL, avoids an fsync on every commit
+    cursor.close()
+
+
+def get_engine():
+    """Returns the engine of the database, created on the first call."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:  # two threads making their first query at the same time get the same engine
+            if _engine is None:
+                # The action server may use a pooled connection from another thread than the one that created
+                # it. This is safe since the pool only hands each connection to one thread at a time.
+                new_engine = create_engine(f'sqlite:///{db_path}', echo=SQL_ECHO, poolclass=QueuePool,
+                                           pool_size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW,
+                                           connect_args={'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT})
+                event.listen(new_engine, 'connect', set_sqlite_pragmas)
+                _engine = new_engine
+    return _engine
+
+
+def get_async_engine():
+    """Returns the async engine (aiosqlite driver) on the same database file, created on the first call.
+    It is used by the action server so that queries do not block its event loop, and gets the same
+    pragmas as the synchronous engine."""
+    global _async_engine
+    if _async_engine is None:
+        with _engine_lock:
+            if _async_engine is None:
+                new_engine = create_async_engine(f'sqlite+aiosqlite:///{db_path}', echo=SQL_ECHO,
+                                                 poolclass=AsyncAdaptedQueuePool, pool_size=POOL_SIZE,
+                                                 max_overflow=POOL_MAX_OVERFLOW,
+                                                 connect_args={'timeout': SQLITE_BUSY_TIMEOUT})
+                event.listen(new_engine.sync_engine, 'connect', set_sqlite_pragmas)
+                _async_engine = new_engine
+    return _async_engine
+
+
+class _LazySession(OrmSession):
+    """Session that uses get_engine() when it was not given another bind."""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.bind is None:
+            return get_engine()
+        return super().get_bind(mapper, clause, **kwargs)
+
+
+class _LazyAsyncSession(OrmSession):
+    """Session wrapped by the AsyncSession objects, which uses get_async_engine() when it was not given
+    another bind."""
 
-# Set echo=True to get the SQL queries made printed out on the standard output
-# engine = create_engine('sqlite:///gallery.db', echo=False)  # sqlalchemy engine that will interact with sqlite db
-# Absolute path to gallery database (since we call create_engine() function from two directories, need an absolute path)
-db_path = '/Users/yansteimle/Projects/gallery-assistant/gallery.db'  # change depending on file system
-engine = create_engine(f'sqlite:///{db_path}', echo=False)
-Session = sessionmaker(bind=engine)  # session factory bound to the engine
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.bind is None:
+            return get_async_engine().sync_engine
+        return super().get_bind(mapper, clause, **kwargs)
+
+
+# Thread-local session registry: every thread gets its own session from the factory.
+# Objects are not expired on commit so that they can still be read after the session is closed.
+Session = scoped_session(sessionmaker(class_=_LazySession, expire_on_commit=False))
+AsyncSessionFactory = sessionmaker(class_=AsyncSession, sync_session_class=_LazyAsyncSession, expire_on_commit=False)
 
 Base = declarative_base()  # base class for class definitions
 
@@ -28,8 +125,11 @@ class Bid(Base):
     """Association object class that provides an association table between the
     user and artwork tables with additional information (i.e. the value of the bid)."""
     __tablename__ = 'bid'
-    user_name = Column(Integer, ForeignKey('user.user_name'), primary_key=True)
-    artwork_id = Column(String, ForeignKey('artwork.artwork_id'), primary_key=True)
+    # The primary key index serves the lookups by user. The index on (artwork_id, value) serves the
+    # lookups by artwork (number of bids, highest bid, bidders ordered by value) without reading the table.
+    __table_args__ = (Index('ix_bid_artwork_id_value', 'artwork_id', 'value'),)
+    user_name = Column(String(20), ForeignKey('user.user_name'), primary_key=True)
+    artwork_id = Column(String(6), ForeignKey('artwork.artwork_id'), primary_key=True)
     value = Column(Integer)  # value of the bid
     user = relationship("User", back_populates="bids")
     artwork = relationship("Artwork", back_populates="bidders")
@@ -52,8 +152,138 @@ class Artwork(Base):
     __tablename__ = 'artwork'
     artwork_id = Column(String(6), primary_key=True)  # format: ABC123, must be unique
     title = Column(String(50))
-    artist_name = Column(String(30))
+    artist_name = Column(String(30), index=True)
     medium = Column(String(50))
-    category = Column(String(20))  # 'drawing', 'painting', 'sculpture', 'photography', 'other'
+    category = Column(String(20), index=True)  # 'drawing', 'painting', 'sculpture', 'photography', 'other'
     min_bid = Column(Integer)  # minimum bid amount
+    # Denormalized bid statistics, kept up to date by the triggers below whenever a bid is written,
+    # so that counting the bids on an artwork does not require loading all of them.
+    bid_count = Column(Integer, nullable=False, default=0, server_default='0')
+    highest_bid = Column(Integer)  # None when there are no bids
     bidders = relationship("Bid", back_populates='artwork')
+
+
+class AuctionResult(Base):
+    """Outcome of the auction for an artwork, written by auction_close.py when the bidding closes.
+    status is 'won' (winner_user_name placed the highest bid), 'tie' (several users placed the highest
+    bid, see AuctionTie) or 'no_bids'. The runner-up is the best bid lower than the winning bid."""
+    __tablename__ = 'auction_result'
+    artwork_id = Column(String(6), ForeignKey('artwork.artwork_id'), primary_key=True)
+    status = Column(String(10), nullable=False)
+    winner_user_name = Column(String(20), ForeignKey('user.user_name'))  # None unless status is 'won'
+    winning_bid = Column(Integer)
+    runner_up_user_name = Column(String(20), ForeignKey('user.user_name'))
+    runner_up_bid = Column(Integer)
+    bid_count = Column(Integer, nullable=False, default=0, server_default='0')
+    tied_count = Column(Integer, nullable=False, default=0, server_default='0')  # bidders at the winning bid
+
+
+class AuctionTie(Base):
+    """Users who tied for the winning bid of an artwork, invited to the private secondary auction."""
+    __tablename__ = 'auction_tie'
+    artwork_id = Column(String(6), ForeignKey('auction_result.artwork_id'), primary_key=True)
+    user_name = Column(String(20), ForeignKey('user.user_name'), primary_key=True)
+
+
+class BidJournalCheckpoint(Base):
+    """Sequence number of the last record of a bid journal (see bid_journal.py) written to the bid table.
+    It is updated in the same transaction as the bids, so a journal can be replayed without applying
+    a record twice. There is one row per journal file (i.e. per action server)."""
+    __tablename__ = 'bid_journal_checkpoint'
+    journal = Column(String(255), primary_key=True)  # absolute path of the journal file
+    last_sequence = Column(Integer, nullable=False)
+
+
+class ChangeCounter(Base):
+    """Number of changes of a kind of data ('catalog': the artworks, 'bids': the bids), increased by the
+    triggers below in the same transaction as the change, whatever process made it. The web application
+    uses it to tell whether the data it sent to a client changed since (ETag and Last-Modified)."""
+    __tablename__ = 'change_counter'
+    name = Column(String(20), primary_key=True)
+    version = Column(Integer, nullable=False, default=0, server_default='0')
+    changed_at = Column(Float, nullable=False)  # unix time of the last change (seconds)
+
+
+# Triggers that keep Artwork.bid_count and Artwork.highest_bid consistent with the bid table.
+# They run in the same transaction as the statement that writes the bid, whatever code wrote it.
+# The highest bid only has to be recomputed from all the bids when a bid is lowered or deleted.
+BID_STATISTICS_TRIGGERS = [
+    DDL("""CREATE TRIGGER IF NOT EXISTS bid_statistics_insert AFTER INSERT ON bid BEGIN
+    UPDATE artwork SET bid_count = bid_count + 1, highest_bid = max(coalesce(highest_bid, NEW.value), NEW.value)
+    WHERE artwork_id = NEW.artwork_id;
+END"""),
+    DDL("""CREATE TRIGGER IF NOT EXISTS bid_statistics_update AFTER UPDATE OF value ON bid BEGIN
+    UPDATE artwork SET highest_bid = CASE WHEN NEW.value >= OLD.value
+        THEN max(coalesce(highest_bid, NEW.value), NEW.value)
+        ELSE (SELECT max(value) FROM bid WHERE artwork_id = NEW.artwork_id) END
+    WHERE artwork_id = NEW.artwork_id;
+END"""),
+    DDL("""CREATE TRIGGER IF NOT EXISTS bid_statistics_delete AFTER DELETE ON bid BEGIN
+    UPDATE artwork SET bid_count = bid_count - 1,
+        highest_bid = (SELECT max(value) FROM bid WHERE artwork_id = OLD.artwork_id)
+    WHERE artwork_id = OLD.artwork_id;
+END"""),
+]
+for trigger in BID_STATISTICS_TRIGGERS:
+    event.listen(Bid.__table__, 'after_create', trigger)
+
+# Full-text search index over the descriptive columns of the artwork table (see artwork_search.py).
+# The FTS5 table keeps its own copy of the text (the catalog is small) together with the artwork id,
+# and the triggers keep it in sync with the artwork table. The update trigger only fires when one of
+# the indexed columns changes (and not when a bid updates the bid statistics).
+ARTWORK_SEARCH_DDL = [
+    DDL("""CREATE VIRTUAL TABLE IF NOT EXISTS artwork_fts USING fts5(
+    artwork_id UNINDEXED, title, artist_name, medium, category, tokenize = 'porter unicode61')"""),
+    DDL("""CREATE TRIGGER IF NOT EXISTS artwork_fts_insert AFTER INSERT ON artwork BEGIN
+    INSERT INTO artwork_fts (artwork_id, title, artist_name, medium, category)
+    VALUES (NEW.artwork_id, NEW.title, NEW.artist_name, NEW.medium, NEW.category);
+END"""),
+    DDL("""CREATE TRIGGER IF NOT EXISTS artwork_fts_update
+AFTER UPDATE OF artwork_id, title, artist_name, medium, category ON artwork BEGIN
+    DELETE FROM artwork_fts WHERE artwork_id = OLD.artwork_id;
+    INSERT INTO artwork_fts (artwork_id, title, artist_name, medium, category)
+    VALUES (NEW.artwork_id, NEW.title, NEW.artist_name, NEW.medium, NEW.category);
+END"""),
+    DDL("""CREATE TRIGGER IF NOT EXISTS artwork_fts_delete AFTER DELETE ON artwork BEGIN
+    DELETE FROM artwork_fts WHERE artwork_id = OLD.artwork_id;
+END"""),
+]
+for statement in ARTWORK_SEARCH_DDL:
+    event.listen(Artwork.__table__, 'after_create', statement)
+
+# Triggers that count the changes of the catalog and of the bids in the change_counter table. As for the
+# full-text index, only the changes of the catalog columns count (not the bid statistics).
+_NOW = "(julianday('now') - 2440587.5) * 86400.0"  # unix time with a fraction of second
+_COUNT_CHANGE = "UPDATE change_counter SET version = version + 1, changed_at = " + _NOW + " WHERE name = '{}';"
+CHANGE_COUNTER_ROWS = DDL(f"""INSERT OR IGNORE INTO change_counter (name, version, changed_at)
+VALUES ('catalog', 0, {_NOW}), ('bids', 0, {_NOW})""")
+CHANGE_COUNTER_BID_TRIGGERS = [
+    DDL(f"""CREATE TRIGGER IF NOT EXISTS change_counter_bid_insert AFTER INSERT ON bid BEGIN
+    {_COUNT_CHANGE.format('bids')}
+END"""),
+    DDL(f"""CREATE TRIGGER IF NOT EXISTS change_counter_bid_update AFTER UPDATE OF value ON bid BEGIN
+    {_COUNT_CHANGE.format('bids')}
+END"""),
+    DDL(f"""CREATE TRIGGER IF NOT EXISTS change_counter_bid_delete AFTER DELETE ON bid BEGIN
+    {_COUNT_CHANGE.format('bids')}
+END"""),
+]
+CHANGE_COUNTER_ARTWORK_TRIGGERS = [
+    DDL(f"""CREATE TRIGGER IF NOT EXISTS change_counter_artwork_insert AFTER INSERT ON artwork BEGIN
+    {_COUNT_CHANGE.format('catalog')}
+END"""),
+    DDL(f"""CREATE TRIGGER IF NOT EXISTS change_counter_artwork_update
+AFTER UPDATE OF artwork_id, title, artist_name, medium, category, min_bid ON artwork BEGIN
+    {_COUNT_CHANGE.format('catalog')}
+END"""),
+    DDL(f"""CREATE TRIGGER IF NOT EXISTS change_counter_artwork_delete AFTER DELETE ON artwork BEGIN
+    {_COUNT_CHANGE.format('catalog')}
+END"""),
+]
+CHANGE_COUNTER_DDL = [CHANGE_COUNTER_ROWS] + CHANGE_COUNTER_BID_TRIGGERS + CHANGE_COUNTER_ARTWORK_TRIGGERS
+# Like the triggers above, each trigger is created with the table it is on
+event.listen(ChangeCounter.__table__, 'after_create', CHANGE_COUNTER_ROWS)
+for trigger in CHANGE_COUNTER_BID_TRIGGERS:
+    event.listen(Bid.__table__, 'after_create', trigger)
+for trigger in CHANGE_COUNTER_ARTWORK_TRIGGERS:
+    event.listen(Artwork.__table__, 'after_create', trigger)
@@ -0,0 +1,224 @@
+# instrumentation.py
+# Measures where the time of the custom actions goes. Every action class decorated with @instrument
+# records, for each call of run(), its duration, the time spent in database queries and the number
+# of queries. The queries are timed by SQLAlchemy event hooks on every engine (sync and async), and are
+# attributed to the action being run through a context variable (so concurrent conversations on the
+# event loop do not mix up their queries). When an action runs the same SQL statement many times in a
+# single call, it is counted as an N+1 pattern (e.g. lazy loads of bid.artwork in a loop) and logged.
+# The metrics are served in the Prometheus text format by a small HTTP server running in a thread of
+# the action server (see start_metrics_server(), started by actions.py if GALLERY_METRICS_PORT is set).
+# Resources consulted:
+# https://docs.sqlalchemy.org/en/14/core/events.html#sqlalchemy.events.ConnectionEvents
+# https://docs.sqlalchemy.org/en/14/faq/performance.html#query-profiling
+# https://docs.python.org/3/library/contextvars.html
+# https://prometheus.io/docs/instrumenting/exposition_formats/#text-based-format
+# https://prometheus.io/docs/practices/histograms/
+# https://docs.python.org/3/library/http.server.html
+###################################
+import functools
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .db_handler import get_catalog_cache_stats, get_portfolio_cache_stats
+from .response_cache import get_response_cache_stats
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)  # seconds
+N_PLUS_ONE_THRESHOLD = 5  # executions of the same statement in one action call that count as N+1
+
+
+class Invocation:
+    """The queries made by one call of an action."""
+    __slots__ = ('action', 'start', 'queries', 'db_seconds', 'statements')
+
+    def __init__(self, action):
+        self.action = action
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = Counter()  # number of executions of each SQL statement
+
+
+# Invocation of the action being run in the current task (None outside of the actions)
+_current_invocation = ContextVar('current_invocation', default=None)
+
+
+class Metrics:
+    """Thread-safe registry of the counters (the queries of the synchronous engine can come from any thread)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.errors = Counter()
+        self.duration_sum = defaultdict(float)
+        self.duration_buckets = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+        self.db_seconds = defaultdict(float)
+        self.queries = Counter()
+        self.n_plus_one = Counter()  # (action, statement) -> number of calls with the pattern
+        self.engine_queries = Counter()
+        self.engine_seconds = defaultdict(float)
+
+    def record_query(self, engine_name, seconds):
+        with self._lock:
+            self.engine_queries[engine_name] += 1
+            self.engine_seconds[engine_name] += seconds
+
+    def record_invocation(self, invocation, seconds, failed):
+        action = invocation.action
+        repeated = [statement for statement, count in invocation.statements.items() if count >= N_PLUS_ONE_THRESHOLD]
+        with self._lock:
+            self.calls[action] += 1
+            if failed:
+                self.errors[action] += 1
+            self.duration_sum[action] += seconds
+            buckets = self.duration_buckets[action]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self.db_seconds[action] += invocation.db_seconds
+            self.queries[action] += invocation.queries
+            for statement in repeated:
+                self.n_plus_one[(action, statement)] += 1
+        for statement in repeated:
+            logger.warning("Possible N+1 queries in %s: %d executions of %s", action,
+                           invocation.statements[statement], statement)
+
+    def render(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def header(name, metric_type, description):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        def sample(name, value, **labels):
+            label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        with self._lock:
+            actions = sorted(self.calls)
+            header('gallery_action_calls_total', 'counter', 'Calls of the custom actions.')
+            for action in actions:
+                sample('gallery_action_calls_total', self.calls[action], action=action)
+            header('gallery_action_errors_total', 'counter', 'Calls of the custom actions that raised an exception.')
+            for action in actions:
+                sample('gallery_action_errors_total', self.errors[action], action=action)
+            header('gallery_action_duration_seconds', 'histogram', 'Duration of the custom actions.')
+            for action in actions:
+                for bound, count in zip(DURATION_BUCKETS, self.duration_buckets[action]):
+                    sample('gallery_action_duration_seconds_bucket', count, action=action, le=bound)
+                sample('gallery_action_duration_seconds_bucket', self.calls[action], action=action, le='+Inf')
+                sample('gallery_action_duration_seconds_sum', self.duration_sum[action], action=action)
+                sample('gallery_action_duration_seconds_count', self.calls[action], action=action)
+            header('gallery_action_db_seconds_total', 'counter', 'Time spent in database queries by the actions.')
+            for action in actions:
+                sample('gallery_action_db_seconds_total', self.db_seconds[action], action=action)
+            header('gallery_action_queries_total', 'counter', 'Database queries made by the actions.')
+            for action in actions:
+                sample('gallery_action_queries_total', self.queries[action], action=action)
+            header('gallery_action_n_plus_one_total', 'counter',
+                   f'Action calls that ran the same statement at least {N_PLUS_ONE_THRESHOLD} times.')
+            for (action, statement), count in sorted(self.n_plus_one.items()):
+                sample('gallery_action_n_plus_one_total', count, action=action, statement=statement)
+            header('gallery_db_queries_total', 'counter', 'Database queries, by engine.')
+            for name, count in sorted(self.engine_queries.items()):
+                sample('gallery_db_queries_total', count, engine=name)
+            header('gallery_db_query_seconds_total', 'counter', 'Time spent in database queries, by engine.')
+            for name, seconds in sorted(self.engine_seconds.items()):
+                sample('gallery_db_query_seconds_total', seconds, engine=name)
+        for name, cache, content in (('catalog', get_catalog_cache_stats(), 'Artworks'),
+                                     ('portfolio', get_portfolio_cache_stats(), 'User portfolios'),
+                                     ('response', get_response_cache_stats(), 'Rendered messages')):
+            for key in ('hits', 'misses', 'evictions'):
+                header(f'gallery_{name}_cache_{key}_total', 'counter', f'{name.capitalize()} cache {key}.')
+                sample(f'gallery_{name}_cache_{key}_total', cache[key])
+            header(f'gallery_{name}_cache_size', 'gauge', f'{content} in the {name} cache.')
+            sample(f'gallery_{name}_cache_size', cache['size'])
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _statement_label(statement):
+    """Short one-line version of an SQL statement, used as a label value. The list of selected columns
+    is left out, since the tables and the conditions are what tell which query is repeated."""
+    statement = " ".join(statement.split())
+    if statement.startswith("SELECT ") and " FROM " in statement:
+        statement = "SELECT ... " + statement[statement.index(" FROM ") + 1:]
+    return statement if len(statement) <= 120 else statement[:117] + "..."
+
+
+metrics = Metrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Times every query (of any engine, including the engines of db_models.py that are created on first
+    use) and attributes it to the current action."""
+    seconds = time.perf_counter() - conn.info['query_start_time'].pop()
+    metrics.record_query('async' if conn.dialect.is_async else 'sync', seconds)
+    invocation = _current_invocation.get()
+    if invocation is not None:
+        invocation.queries += 1
+        invocation.db_seconds += seconds
+        invocation.statements[_statement_label(statement)] += 1
+
+
+def instrument(action_class):
+    """Class decorator that records the duration and the queries of every call of the run() method
+    of an action (also works for a FormValidationAction, whose run() calls the slot validators)."""
+    run = action_class.run
+
+    @functools.wraps(run)
+    async def instrumented_run(self, dispatcher, tracker, domain):
+        invocation = Invocation(self.name())
+        token = _current_invocation.set(invocation)
+        failed = True
+        try:
+            events = await run(self, dispatcher, tracker, domain)
+            failed = False
+            return events
+        finally:
+            _current_invocation.reset(token)
+            metrics.record_invocation(invocation, time.perf_counter() - invocation.start, failed)
+
+    action_class.run = instrumented_run
+    return action_class
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # no line on stderr for every scrape
+        pass
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """Serves the metrics at http://host:port/metrics from a daemon thread and returns the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
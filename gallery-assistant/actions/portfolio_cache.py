@@ -0,0 +1,53 @@
+# portfolio_cache.py
+# Bids of the users (their portfolio), kept in memory for the duration of their conversation.
+# The bid list, the info card ("Your bid") and the prompts of the modify bid form look up the bids of the
+# logged-in user on almost every turn. The portfolio of a user is loaded from the database the first time
+# it is needed (a single query, see db_handler.get_portfolio()) and then updated in place whenever this
+# process writes a bid of the user, so these lookups are answered from memory. The portfolios are kept in a
+# CatalogCache: they expire after the same time-to-live as the catalog (bids written by another process
+# are seen once the portfolio is loaded again), and the least recently used ones are evicted.
+# Resources consulted:
+# see catalog_cache.py
+# https://docs.python.org/3/library/bisect.html
+###################################
+import threading
+from bisect import bisect_right, insort
+
+PORTFOLIO_CACHE_SIZE = 10000  # maximum number of users whose portfolio is kept in memory
+# Users with more bids than this (e.g. dealers) are not kept in memory: their bids are read page by page
+PORTFOLIO_MAX_BIDS = 1000
+
+
+class Portfolio:
+    """Bids of one user: artwork_id -> value. exists is False when there is no such user (e.g. a conversation
+    with an unknown sender id). complete is False when the user has more than PORTFOLIO_MAX_BIDS bids, in
+    which case the bids are not loaded and must be read from the database."""
+
+    def __init__(self, user_name: str, exists: bool, bids, complete: bool = True):
+        self.user_name = user_name
+        self.exists = exists
+        self.complete = complete
+        self._values = dict(bids) if complete else {}
+        self._artwork_ids = sorted(self._values)  # for the pages of bids, in artwork id order
+        self._lock = threading.Lock()  # the bids are also updated by the threads of the bid journal
+
+    def __len__(self):
+        return len(self._values)
+
+    def get_value(self, artwork_id: str):
+        """Returns the value of the bid of the user on an artwork, or None if the user did not bid on it."""
+        return self._values.get(artwork_id)
+
+    def set_value(self, artwork_id: str, value: int):
+        """Records a bid written for the user."""
+        with self._lock:
+            if artwork_id not in self._values:
+                insort(self._artwork_ids, artwork_id)
+            self._values[artwork_id] = value
+
+    def page(self, after_artwork_id: str = None, limit: int = None):
+        """Same result as db_handler.get_bids_for_user(): the pairs (artwork_id, value) ordered by artwork id."""
+        with self._lock:
+            start = 0 if after_artwork_id is None else bisect_right(self._artwork_ids, after_artwork_id)
+            end = len(self._artwork_ids) if limit is None else start + limit
+            return [(artwork_id, self._values[artwork_id]) for artwork_id in self._artwork_ids[start:end]]
@@ -0,0 +1,34 @@
+# response_cache.py
+# Cache of the messages rendered by the custom actions (text and buttons), so that showing again
+# the info card of a popular artwork, or the bid list of a user, does not query the database nor
+# rebuild the message. The messages are keyed on (action, artwork id, user, data version), where the
+# data version comes from db_handler.data_versions and is increased by every bid written: a new bid
+# gives a new key, so a message is never served after the data it shows has changed (the writes of
+# other processes are only seen once the entry expires, like for the catalog cache).
+# Resources consulted:
+# see catalog_cache.py
+# https://rasa.com/docs/action-server/sdk-dispatcher
+###################################
+from .catalog_cache import CatalogCache
+from .db_handler import CATALOG_CACHE_TTL
+
+RESPONSE_CACHE_SIZE = 4096  # maximum number of messages kept in memory
+response_cache = CatalogCache(max_size=RESPONSE_CACHE_SIZE, ttl=CATALOG_CACHE_TTL)
+
+
+async def cached_response(key, render):
+    """Returns the message cached for key, or awaits render() and caches the message it returns.
+    A message is a dictionary of the arguments of dispatcher.utter_message() (e.g. text and buttons),
+    which must not be modified since it is shared between conversations. When render() returns None
+    (e.g. the artwork does not exist), nothing is cached."""
+    response = response_cache.get(key)
+    if response is None:
+        response = await render()
+        if response is not None:
+            response_cache.put(key, response)
+    return response
+
+
+def get_response_cache_stats():
+    """Returns the hit/miss counters of the response cache (same keys as db_handler.get_catalog_cache_stats())."""
+    return response_cache.stats()
@@ -0,0 +1,121 @@
+# auction_close.py
+# Closes the auction: for every artwork, finds the winning bid, the runner-up and the ties, and writes
+# them to the auction_result and auction_tie tables (created by db_migrate.py). The users who tied for
+# the winning bid are the ones invited to the private secondary auction (see utter_faq_ask_about_tie).
+# Each artwork is resolved by a single set-based SQL statement using window functions, so no bid is
+# loaded in Python. The artworks are processed in chunks of consecutive artwork ids (each chunk in its
+# own transaction), so the memory used and the time the write lock is held do not grow with the catalog.
+# Closing the auction again recomputes the results, e.g. after late bids were imported.
+# Usage: python auction_close.py [--db PATH] [--chunk-size N] [--ties]
+# Resources consulted:
+# https://www.sqlite.org/windowfunctions.html
+# https://www.sqlite.org/lang_with.html
+# https://www.sqlite.org/lang_insert.html
+# https://use-the-index-luke.com/no-offset  <-- chunks delimited by artwork id instead of OFFSET
+######################################
+import argparse
+import sqlite3
+from collections import Counter
+
+from actions.db_models import db_path
+
+ARTWORK_CHUNK_SIZE = 5000  # artworks resolved per transaction
+
+# Last artwork id of the next chunk (the artworks with an id in (after, last] form the chunk)
+_CHUNK_END_SQL = "SELECT artwork_id FROM artwork WHERE artwork_id > :after ORDER BY artwork_id LIMIT 1 OFFSET :offset"
+_LAST_ARTWORK_SQL = "SELECT max(artwork_id) FROM artwork WHERE artwork_id > :after"
+
+# RANK() gives the same rank to the bids tied for the same value, so the bids ranked 1 are the winning
+# bid(s), and the runner-up is the best bid ranked after them (ties for second place go to the first
+# user name, so that the result does not depend on the query plan).
+_CLOSE_CHUNK_SQL = """WITH ranked AS (
+    SELECT artwork_id, user_name, value,
+        RANK() OVER (PARTITION BY artwork_id ORDER BY value DESC) AS value_rank,
+        ROW_NUMBER() OVER (PARTITION BY artwork_id ORDER BY value DESC, user_name) AS position,
+        COUNT(*) OVER (PARTITION BY artwork_id) AS bid_count
+    FROM bid WHERE artwork_id > :after AND artwork_id <= :last AND value IS NOT NULL
+), best AS (
+    SELECT artwork_id, value AS winning_bid, bid_count, count(*) AS tied_count, min(user_name) AS user_name
+    FROM ranked WHERE value_rank = 1 GROUP BY artwork_id
+), runner_up AS (
+    SELECT artwork_id, user_name, value, ROW_NUMBER() OVER (PARTITION BY artwork_id ORDER BY position) AS place
+    FROM ranked WHERE value_rank > 1
+)
+INSERT INTO auction_result (artwork_id, status, winner_user_name, winning_bid, runner_up_user_name,
+    runner_up_bid, bid_count, tied_count)
+SELECT artwork.artwork_id,
+    CASE WHEN best.artwork_id IS NULL THEN 'no_bids' WHEN best.tied_count > 1 THEN 'tie' ELSE 'won' END,
+    CASE WHEN best.tied_count = 1 THEN best.user_name END,
+    best.winning_bid, runner_up.user_name, runner_up.value,
+    coalesce(best.bid_count, 0), coalesce(best.tied_count, 0)
+FROM artwork
+LEFT JOIN best ON best.artwork_id = artwork.artwork_id
+LEFT JOIN runner_up ON runner_up.artwork_id = artwork.artwork_id AND runner_up.place = 1
+WHERE artwork.artwork_id > :after AND artwork.artwork_id <= :last"""
+
+# The tied bids are found through the (artwork_id, value) index of the bid table
+_CLOSE_TIES_SQL = """INSERT INTO auction_tie (artwork_id, user_name)
+SELECT bid.artwork_id, bid.user_name
+FROM auction_result JOIN bid ON bid.artwork_id = auction_result.artwork_id AND bid.value = auction_result.winning_bid
+WHERE auction_result.status = 'tie' AND auction_result.artwork_id > :after AND auction_result.artwork_id <= :last"""
+
+
+def artwork_chunks(connection, chunk_size=ARTWORK_CHUNK_SIZE):
+    """Yields the pairs (after, last) delimiting consecutive chunks of chunk_size artworks."""
+    after = ''
+    while True:
+        row = connection.execute(_CHUNK_END_SQL, {'after': after, 'offset': chunk_size - 1}).fetchone()
+        last = row[0] if row else connection.execute(_LAST_ARTWORK_SQL, {'after': after}).fetchone()[0]
+        if last is None:  # no artworks left
+            return
+        yield after, last
+        after = last
+
+
+def close_chunk(connection, after, last):
+    """Replaces the results of the artworks with an id in (after, last] in one transaction."""
+    bounds = {'after': after, 'last': last}
+    connection.execute("BEGIN IMMEDIATE")  # no bid can change while the chunk is resolved
+    try:
+        connection.execute("DELETE FROM auction_tie WHERE artwork_id > :after AND artwork_id <= :last", bounds)
+        connection.execute("DELETE FROM auction_result WHERE artwork_id > :after AND artwork_id <= :last", bounds)
+        connection.execute(_CLOSE_CHUNK_SQL, bounds)
+        connection.execute(_CLOSE_TIES_SQL, bounds)
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+
+
+def close_auction(connection, chunk_size=ARTWORK_CHUNK_SIZE):
+    """Resolves every artwork and returns a Counter of the result statuses.
+    The connection must have been opened with isolation_level=None (transactions are explicit)."""
+    for after, last in artwork_chunks(connection, chunk_size):
+        close_chunk(connection, after, last)
+    return Counter(dict(connection.execute("SELECT status, count(*) FROM auction_result GROUP BY status")))
+
+
+def get_ties(connection):
+    """Returns a dict {artwork_id: [user names]} of the artworks that go to a secondary auction."""
+    ties = {}
+    for artwork_id, user_name in connection.execute("SELECT artwork_id, user_name FROM auction_tie "
+                                                    "ORDER BY artwork_id, user_name"):
+        ties.setdefault(artwork_id, []).append(user_name)
+    return ties
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Close the auction and write the results.')
+    parser.add_argument('--db', default=db_path, help='path of the SQLite database file')
+    parser.add_argument('--chunk-size', type=int, default=ARTWORK_CHUNK_SIZE, help='artworks per transaction')
+    parser.add_argument('--ties', action='store_true', help='list the users invited to a secondary auction')
+    args = parser.parse_args()
+
+    db_connection = sqlite3.connect(args.db, isolation_level=None, timeout=30)
+    statuses = close_auction(db_connection, args.chunk_size)
+    print(f"{sum(statuses.values())} artworks: {statuses['won']} won, {statuses['tie']} tied, "
+          f"{statuses['no_bids']} without bids")
+    if args.ties:
+        for tied_artwork_id, user_names in get_ties(db_connection).items():
+            print(f"{tied_artwork_id}: " + ", ".join(user_names))
+    db_connection.close()
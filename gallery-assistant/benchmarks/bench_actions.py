@@ -0,0 +1,229 @@
+# bench_actions.py
+# Benchmark of the custom actions: each action of actions/actions.py (and each validator of
+# ValidateModifyBidForm) is run many times with a minimal Tracker and a CollectingDispatcher, like the
+# action server would, against databases of increasing size created by generate_dataset.py.
+# For every action, it reports the latency percentiles (p50/p95/p99), the number of SQL queries per
+# call and the memory allocated per call (measured with tracemalloc in a separate, shorter pass since
+# tracing slows everything down). The results are saved as JSON, and --compare checks them against
+# the results of a previous run (e.g. of the last release): the script exits with an error if an action
+# got slower (p95) by more than --tolerance or runs more queries than before (use the same --sizes,
+# --iterations and --seed as the baseline, so that the same artworks are requested in the same order).
+# Usage (from the gallery-assistant directory):
+#   python -m benchmarks.bench_actions [--sizes 1000x10000 10000x1000000] [--iterations 200] [--output FILE]
+#                                      [--compare BASELINE_FILE] [--tolerance 0.2]
+# Resources consulted:
+# https://rasa.com/docs/action-server/sdk-tracker
+# https://rasa.com/docs/action-server/sdk-dispatcher
+# https://docs.python.org/3/library/tracemalloc.html
+# https://docs.python.org/3/library/statistics.html#statistics.quantiles
+# https://docs.sqlalchemy.org/en/14/core/events.html#sqlalchemy.events.ConnectionEvents.before_cursor_execute
+# https://docs.sqlalchemy.org/en/14/orm/session_api.html#sqlalchemy.orm.sessionmaker.configure
+######################################
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from rasa_sdk import Tracker
+from rasa_sdk.executor import CollectingDispatcher
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from actions import actions, db_models
+from actions.db_handler import catalog_cache, portfolio_cache, suggestion_index_cache
+from actions.response_cache import response_cache
+from benchmarks.generate_dataset import generate_database
+
+ALLOCATION_ITERATIONS = 20  # calls traced by tracemalloc for each action
+QUERY_SLACK = 0.1  # queries per call that may be added by cache evictions before it counts as a regression
+SEARCH_QUERIES = ['blue', 'show me Eve Evans sculptures', 'oil on canvas', 'bronze sculpture', 'portraits',
+                  'photographs by Alice Allen', 'charcoal drawings', 'winter garden']
+
+
+def make_tracker(slots, text=''):
+    """Minimal tracker for the logged-in user, with the given slots and latest message."""
+    return Tracker('Foo', slots, {'text': text, 'intent': {}, 'entities': []}, [], False, None, {}, None)
+
+
+class Scenario:
+    """A call of an action (or of a slot validator) with the arguments drawn by make_arguments(rng)."""
+
+    def __init__(self, name, call, make_arguments):
+        self.name = name
+        self.call = call
+        self.make_arguments = make_arguments
+
+
+def run_action(action_class):
+    """Returns a coroutine function running the action with the given slots and message."""
+    action = action_class()
+
+    async def call(slots, text=''):
+        return await action.run(CollectingDispatcher(), make_tracker(slots, text), {})
+    return call
+
+
+def run_validator(method_name):
+    """Returns a coroutine function calling a validator of ValidateModifyBidForm."""
+    validator = getattr(actions.ValidateModifyBidForm(), method_name)
+
+    async def call(slot_value, slots):
+        return await validator(slot_value, CollectingDispatcher(), make_tracker(slots), {})
+    return call
+
+
+def make_scenarios(artworks):
+    """Scenarios for every action. artworks: list of (artwork_id, min_bid) of the database."""
+    def artwork_slots(rng):
+        return ({'artwork_id': rng.choice(artworks)[0]},)
+
+    def new_bid(rng):
+        artwork_id, min_bid = rng.choice(artworks)
+        return ({'artwork_id': artwork_id, 'bid_value': min_bid + 50 * rng.randrange(20), 'confirm_form': 'yes'},)
+
+    return [
+        Scenario('ActionAuctionSchedule', run_action(actions.ActionAuctionSchedule), lambda rng: ({},)),
+        Scenario('ActionUserBidList', run_action(actions.ActionUserBidList), lambda rng: ({},)),
+        Scenario('ActionNumberBidsOnArtwork', run_action(actions.ActionNumberBidsOnArtwork), artwork_slots),
+        Scenario('ActionArtworkInfoCard', run_action(actions.ActionArtworkInfoCard), artwork_slots),
+        Scenario('ActionMinimumBid', run_action(actions.ActionMinimumBid), artwork_slots),
+        Scenario('ActionSearchArtwork', run_action(actions.ActionSearchArtwork),
+                 lambda rng: ({}, rng.choice(SEARCH_QUERIES))),
+        Scenario('ActionAskModifyBidFormArtworkId', run_action(actions.ActionAskModifyBidFormArtworkId),
+                 lambda rng: ({},)),
+        Scenario('ActionAskModifyBidFormBidValue', run_action(actions.ActionAskModifyBidFormBidValue),
+                 artwork_slots),
+        Scenario('ActionAskModifyBidFormConfirmForm', run_action(actions.ActionAskModifyBidFormConfirmForm),
+                 new_bid),
+        Scenario('ValidateModifyBidForm.validate_artwork_id', run_validator('validate_artwork_id'),
+                 lambda rng: (rng.choice(artworks)[0].lower(), {})),
+        Scenario('ValidateModifyBidForm.validate_bid_value', run_validator('validate_bid_value'),
+                 lambda rng: ('5000', artwork_slots(rng)[0])),
+        Scenario('ActionSubmitModifyBid', run_action(actions.ActionSubmitModifyBid), new_bid),
+    ]
+
+
+class QueryCounter:
+    """Counts the SQL statements executed through an engine."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def use_database(path):
+    """Points the async sessions of the actions to another database file and returns the new engine."""
+    engine = create_async_engine(f'sqlite+aiosqlite:///{path}',
+                                 connect_args={'timeout': db_models.SQLITE_BUSY_TIMEOUT})
+    event.listen(engine.sync_engine, 'connect', db_models.set_sqlite_pragmas)
+    db_models.AsyncSessionFactory.configure(bind=engine)
+    catalog_cache.clear()
+    portfolio_cache.clear()
+    suggestion_index_cache.clear()
+    response_cache.clear()
+    return engine
+
+
+async def measure(scenario, queries, iterations, rng):
+    """Runs the scenario and returns its latency percentiles (ms), queries and allocations per call."""
+    latencies = []
+    start_queries = queries.count
+    for _ in range(iterations):
+        arguments = scenario.make_arguments(rng)
+        start = time.perf_counter()
+        await scenario.call(*arguments)
+        latencies.append((time.perf_counter() - start) * 1000)
+    queries_per_call = (queries.count - start_queries) / iterations
+
+    tracemalloc.start()
+    for _ in range(ALLOCATION_ITERATIONS):
+        await scenario.call(*scenario.make_arguments(rng))
+    allocated = sum(stat.size for stat in tracemalloc.take_snapshot().statistics('filename'))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {'iterations': iterations, 'p50_ms': round(percentiles[49], 3), 'p95_ms': round(percentiles[94], 3),
+            'p99_ms': round(percentiles[98], 3), 'max_ms': round(max(latencies), 3),
+            'queries_per_call': round(queries_per_call, 2),
+            'retained_kb_per_call': round(allocated / ALLOCATION_ITERATIONS / 1024, 2),
+            'peak_traced_kb': round(peak / 1024, 1)}
+
+
+async def bench_database(path, iterations, seed):
+    """Runs every scenario on the database and returns a dict {scenario name: measures}."""
+    with sqlite3.connect(path) as connection:
+        artworks = connection.execute("SELECT artwork_id, min_bid FROM artwork").fetchall()
+    engine = use_database(path)
+    queries = QueryCounter(engine.sync_engine)
+    rng = random.Random(seed)
+    results = {}
+    for scenario in make_scenarios(artworks):
+        for _ in range(min(iterations, 10)):  # warm up (connections, compiled statement cache)
+            await scenario.call(*scenario.make_arguments(rng))
+        measures = results[scenario.name] = await measure(scenario, queries, iterations, rng)
+        print(f"  {scenario.name:<45} p50 {measures['p50_ms']:>8.3f} ms  p99 {measures['p99_ms']:>8.3f} ms  "
+              f"{measures['queries_per_call']:>5} queries")
+    await engine.dispose()
+    return results
+
+
+def find_regressions(report, baseline, tolerance):
+    """Returns the descriptions of the actions that are slower or run more queries than in the baseline."""
+    regressions = []
+    for size, results in report['sizes'].items():
+        for name, measures in results.items():
+            before = baseline['sizes'].get(size, {}).get(name)
+            if before is None:
+                continue
+            if measures['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{size} {name}: p95 {before['p95_ms']} ms -> {measures['p95_ms']} ms")
+            if measures['queries_per_call'] > before['queries_per_call'] + QUERY_SLACK:
+                regressions.append(f"{size} {name}: {before['queries_per_call']} -> "
+                                   f"{measures['queries_per_call']} queries per call")
+    return regressions
+
+
+async def main(args):
+    report = {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'seed': args.seed,
+              'iterations': args.iterations, 'catalog_cache_size': catalog_cache.max_size, 'sizes': {}}
+    for size in args.sizes:
+        num_artworks, num_bids = (int(number) for number in size.lower().split('x'))
+        print(f"{num_artworks} artworks, {num_bids} bids:")
+        with tempfile.TemporaryDirectory() as directory:
+            db_file = os.path.join(directory, 'bench.db')
+            generate_database(db_file, num_artworks, num_artworks, num_bids, args.seed)
+            report['sizes'][size] = await bench_database(db_file, args.iterations, args.seed)
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results saved to {args.output}")
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = find_regressions(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return not regressions
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the custom actions.')
+    parser.add_argument('--sizes', nargs='+', default=['1000x10000', '10000x1000000'], help='sizes as ARTWORKSxBIDS')
+    parser.add_argument('--iterations', type=int, default=200, help='calls of each action per size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_actions.json', help='JSON file for the results')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare the results with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown (0.2 = 20%%)')
+    if not asyncio.run(main(parser.parse_args())):
+        sys.exit(1)
@@ -0,0 +1,85 @@
+# bench_auction_close.py
+# Measures how auction_close.py scales: for each size (artworks x bids), a database with random bids
+# (and as many users as artworks) is created in a temporary directory by generate_dataset.py, then the
+# auction is closed with each chunk size in a separate process, so that the peak memory (max RSS)
+# reported is the one of the closing alone.
+# Usage (from the gallery-assistant directory):
+#   python -m benchmarks.bench_auction_close [--sizes 1000x100000 10000x1000000] [--chunk-sizes 5000]
+#   python -m benchmarks.bench_auction_close --sizes 100000x10000000   <-- full scale, takes a while
+# Resources consulted:
+# https://docs.python.org/3/library/resource.html#resource.getrusage
+# https://man7.org/linux/man-pages/man5/proc.5.html  <-- VmHWM in /proc/[pid]/status
+# https://docs.python.org/3/library/subprocess.html
+######################################
+import argparse
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import auction_close
+from benchmarks.generate_dataset import generate_database
+
+
+def run_close(path, chunk_size):
+    """Closes the auction on the database and returns the measures (called in a child process)."""
+    connection = sqlite3.connect(path, isolation_level=None)
+    start = time.perf_counter()
+    statuses = auction_close.close_auction(connection, chunk_size)
+    seconds = time.perf_counter() - start
+    connection.close()
+    return {'seconds': round(seconds, 3), 'max_rss_mb': round(peak_rss_kb() / 1024, 1), 'statuses': dict(statuses)}
+
+
+def peak_rss_kb():
+    """Peak resident memory of this process in kilobytes. On Linux, getrusage() keeps the peak of the process
+    before it ran exec(), i.e. of the copy of the parent (which generated the database), so the peak of the
+    process image itself is read from /proc (VmHWM)."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:  # not Linux
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # kilobytes on Linux (bytes on macOS)
+    return max_rss // 1024 if sys.platform == 'darwin' else max_rss
+
+
+def parse_size(size):
+    num_artworks, num_bids = size.lower().split('x')
+    return int(num_artworks), int(num_bids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of auction_close.py at increasing sizes.')
+    parser.add_argument('--sizes', nargs='+', default=['1000x100000', '10000x1000000'],
+                        help='sizes as ARTWORKSxBIDS')
+    parser.add_argument('--chunk-sizes', nargs='+', type=int, default=[auction_close.ARTWORK_CHUNK_SIZE])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--close', nargs=2, metavar=('DB', 'CHUNK_SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.close:  # child process
+        print(json.dumps(run_close(args.close[0], int(args.close[1]))))
+        sys.exit()
+
+    print(f"{'artworks':>9} {'bids':>10} {'chunk':>7} {'load s':>8} {'close s':>8} {'bids/s':>10} {'max RSS MB':>10}")
+    for size in args.sizes:
+        artworks, bids = parse_size(size)
+        with tempfile.TemporaryDirectory() as directory:
+            db_file = os.path.join(directory, 'bench.db')
+            load_start = time.perf_counter()
+            generate_database(db_file, artworks, artworks, bids, args.seed)
+            load_seconds = time.perf_counter() - load_start
+            for chunk in args.chunk_sizes:
+                output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_auction_close',
+                                         '--close', db_file, str(chunk)],
+                                        check=True, capture_output=True, text=True).stdout
+                measures = json.loads(output)
+                print(f"{artworks:>9} {bids:>10} {chunk:>7} {load_seconds:>8.1f} {measures['seconds']:>8.2f} "
+                      f"{bids / measures['seconds']:>10.0f} {measures['max_rss_mb']:>10}")
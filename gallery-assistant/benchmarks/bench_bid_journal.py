@@ -0,0 +1,138 @@
+# bench_bid_journal.py
+# Measures the bid throughput of the action server during the spike of bids before the bidding closes:
+# many conversations submit bids at the same time (concurrent coroutines on one event loop, like the
+# action server), either written directly to the bid table (async_db_handler.submit_bid, one transaction
+# per bid) or appended to a BidJournal (group commit, then written to the bid table in batches).
+# For the journal, it also reports the number of fsyncs and the time until every bid is in the bid table,
+# then checks that every bid acknowledged is in the bid table ("ok"). Bids that fail (e.g. "database is
+# locked" when concurrent transactions try to write) are counted.
+# Usage (from the gallery-assistant directory):
+#   python -m benchmarks.bench_bid_journal [--bids 5000] [--concurrency 1 10 100] [--artworks 1000]
+# Resources consulted:
+# https://docs.python.org/3/library/asyncio-task.html#asyncio.gather
+# https://docs.python.org/3/library/asyncio-sync.html#asyncio.Semaphore
+######################################
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+
+from actions import async_db_handler, db_models
+from actions.bid_journal import BidJournal
+from benchmarks.bench_actions import use_database
+from benchmarks.generate_dataset import generate_database
+
+
+def make_bids(path, num_bids, seed):
+    """Returns num_bids random valid bids (user_name, artwork_id, value) on the artworks of the database,
+    at most one per user and artwork (so the content of the bid table does not depend on the order in which
+    concurrent bids are written)."""
+    with sqlite3.connect(path) as connection:
+        users = [row[0] for row in connection.execute("SELECT user_name FROM user")]
+        artworks = connection.execute("SELECT artwork_id, min_bid FROM artwork").fetchall()
+    rng = random.Random(seed)
+    bids = {}
+    while len(bids) < num_bids:
+        artwork_id, min_bid = rng.choice(artworks)
+        bids.setdefault((rng.choice(users), artwork_id), min_bid + 10 * rng.randrange(100))
+    return [(user_name, artwork_id, value) for (user_name, artwork_id), value in bids.items()]
+
+
+def use_sync_database(path):
+    """Points the synchronous sessions (used by the journal threads) to the database file."""
+    engine = create_engine(f'sqlite:///{path}', connect_args={'check_same_thread': False,
+                                                              'timeout': db_models.SQLITE_BUSY_TIMEOUT})
+    event.listen(engine, 'connect', db_models.set_sqlite_pragmas)
+    db_models.Session.configure(bind=engine)
+    return engine
+
+
+async def submit_all(submit, bids, concurrency):
+    """Submits the bids with at most concurrency bids in progress at once. Returns the elapsed seconds and
+    the bids that failed (e.g. with "database is locked")."""
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = []
+
+    async def submit_one(bid):
+        async with semaphore:
+            try:
+                result = await submit(*bid)
+            except OperationalError:
+                failed.append(bid)
+            else:
+                assert result.written, result.message
+
+    start = time.perf_counter()
+    await asyncio.gather(*(submit_one(bid) for bid in bids))
+    return time.perf_counter() - start, failed
+
+
+def bid_table(path):
+    with sqlite3.connect(path) as connection:
+        return connection.execute("SELECT user_name, artwork_id, value FROM bid ORDER BY 1, 2").fetchall()
+
+
+async def bench(directory, template, bids, concurrency):
+    """Runs the direct writes and the journal on copies of the template database, returns the measures."""
+    direct_db, journal_db = (os.path.join(directory, f'{name}-{concurrency}.db') for name in ('direct', 'journal'))
+    for path in (direct_db, journal_db):
+        with closing(sqlite3.connect(template)) as source, closing(sqlite3.connect(path)) as target:
+            source.backup(target)
+
+    engine = use_database(direct_db)
+    direct_seconds, direct_failed = await submit_all(async_db_handler.submit_bid, bids, concurrency)
+    await engine.dispose()
+
+    engine = use_database(journal_db)
+    sync_engine = use_sync_database(journal_db)
+    journal = BidJournal(os.path.join(directory, f'bids-{concurrency}.journal'))
+    journal.open()
+    journal_seconds, journal_failed = await submit_all(journal.submit_bid_async, bids, concurrency)
+    close_start = time.perf_counter()
+    journal.close()  # waits for the last bids to be written to the bid table
+    drain_seconds = time.perf_counter() - close_start
+    stats = journal.stats()
+    await engine.dispose()
+    sync_engine.dispose()
+    return {'direct_per_second': (len(bids) - len(direct_failed)) / direct_seconds,
+            'direct_failed': len(direct_failed),
+            'direct_written': bid_table(direct_db) == sorted(set(bids) - set(direct_failed)),
+            'journal_per_second': (len(bids) - len(journal_failed)) / journal_seconds,
+            'journal_failed': len(journal_failed),
+            'journal_written': bid_table(journal_db) == sorted(set(bids) - set(journal_failed)),
+            'drain_seconds': drain_seconds, 'fsyncs': stats['fsyncs'], 'batches': stats['batches']}
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        template = os.path.join(directory, 'template.db')
+        generate_database(template, args.users, args.artworks, 0, args.seed)
+        bids = make_bids(template, args.bids, args.seed)
+        print(f"{args.bids} bids on {args.artworks} artworks by {args.users} users")
+        print(f"{'':>11} {'direct':-^22} {'journal':-^48}")
+        print(f"{'concurrency':>11} {'bids/s':>7} {'failed':>7} {'ok':>6} {'bids/s':>7} {'failed':>7} {'ok':>6} "
+              f"{'fsyncs':>7} {'batches':>8} {'drain s':>8}")
+        for concurrency in args.concurrency:
+            measures = await bench(directory, template, bids, concurrency)
+            print(f"{concurrency:>11} {measures['direct_per_second']:>7.0f} {measures['direct_failed']:>7} "
+                  f"{str(measures['direct_written']):>6} {measures['journal_per_second']:>7.0f} "
+                  f"{measures['journal_failed']:>7} {str(measures['journal_written']):>6} {measures['fsyncs']:>7} "
+                  f"{measures['batches']:>8} {measures['drain_seconds']:>8.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bid throughput with and without the bid journal.')
+    parser.add_argument('--bids', type=int, default=5000, help='number of bids submitted')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 100],
+                        help='numbers of bids in progress at the same time')
+    parser.add_argument('--artworks', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,107 @@
+# bench_import.py
+# Measures the cold start of an action server replica: the time to import the actions package (which the
+# action server does at startup) and the time of the first database request after that. Each run is done
+# in a new Python process, so that nothing is already imported or cached. The script also checks that
+# importing the actions does not create a database engine (they are created on first use), prints the
+# modules that take the most time to import (python -X importtime), and exits with an error if the median
+# import time is over the budget.
+# Usage (from the gallery-assistant directory):
+#   python -m benchmarks.bench_import [--db PATH] [--runs 7] [--budget-ms 800]
+# Resources consulted:
+# https://docs.python.org/3/using/cmdline.html#cmdoption-X  <-- -X importtime
+# https://docs.python.org/3/library/subprocess.html
+# https://docs.python.org/3/library/tempfile.html
+######################################
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from actions.db_models import db_path
+
+IMPORT_BUDGET_MS = 800  # median time to import actions.actions (rasa_sdk and SQLAlchemy included)
+
+# Run in each new process: time the import, check that no engine exists yet, then time the first request
+_CHILD_CODE = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import actions.actions
+import_ms = (time.perf_counter() - start) * 1000
+from actions import async_db_handler, db_models
+engine_created = db_models._engine is not None or db_models._async_engine is not None
+start = time.perf_counter()
+artwork = asyncio.run(async_db_handler.get_artwork_info(sys.argv[1]))
+first_request_ms = (time.perf_counter() - start) * 1000
+asyncio.run(async_db_handler.dispose_engine())
+print(json.dumps({'import_ms': import_ms, 'first_request_ms': first_request_ms,
+                  'engine_created_at_import': engine_created, 'artwork_found': artwork is not None}))
+"""
+
+
+def run_child(artwork_id, environment):
+    output = subprocess.run([sys.executable, '-c', _CHILD_CODE, artwork_id], env=environment, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def slowest_imports(environment, count=10):
+    """Returns the (cumulative microseconds, module) of the slowest top-level imports of actions.actions."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import actions.actions'], env=environment,
+                            check=True, capture_output=True, text=True).stderr
+    imports = []
+    for line in stderr.splitlines()[1:]:  # "import time: self [us] | cumulative | <indentation>module"
+        _, cumulative, module = line.split('|')
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        if depth == 0:  # the modules are listed after the modules they import
+            if module.strip() == 'actions.actions':
+                break
+            imports = []
+        elif depth == 1:
+            imports.append((int(cumulative), module.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the import time of the actions package.')
+    parser.add_argument('--db', default=db_path, help='path of the SQLite database file')
+    parser.add_argument('--runs', type=int, default=7, help='number of new processes')
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS, help='maximum median import time')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Work on a copy, since the connections of the actions switch the database file to WAL mode
+        db_file = shutil.copy(args.db, os.path.join(directory, 'gallery.db'))
+        env = dict(os.environ, GALLERY_DB_PATH=db_file)
+        env.pop('GALLERY_PREWARM_CATALOG', None)
+        env.pop('GALLERY_METRICS_PORT', None)
+        env.pop('GALLERY_BID_JOURNAL', None)
+        with sqlite3.connect(db_file) as connection:
+            first_artwork_id = connection.execute("SELECT min(artwork_id) FROM artwork").fetchone()[0]
+        runs = [run_child(first_artwork_id, env) for _ in range(args.runs)]
+        imports = slowest_imports(env)
+
+    import_ms = statistics.median(run['import_ms'] for run in runs)
+    first_request_ms = statistics.median(run['first_request_ms'] for run in runs)
+    print(f"import actions.actions: median {import_ms:.0f} ms (budget {args.budget_ms:.0f} ms), "
+          f"min {min(run['import_ms'] for run in runs):.0f} ms")
+    print(f"first request (get_artwork_info): median {first_request_ms:.1f} ms")
+    print("slowest imports (cumulative):")
+    for microseconds, module in imports:
+        print(f"  {microseconds / 1000:>7.1f} ms  {module}")
+
+    ok = True
+    if any(run['engine_created_at_import'] for run in runs):
+        print("FAIL a database engine was created when importing the actions")
+        ok = False
+    if not all(run['artwork_found'] for run in runs):
+        print(f"FAIL the first request did not find artwork {first_artwork_id}")
+        ok = False
+    if import_ms > args.budget_ms:
+        print(f"FAIL the import takes longer than the budget of {args.budget_ms:.0f} ms")
+        ok = False
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,115 @@
+# bench_nlu.py
+# Measures the NLU time per message with and without the fast path of nlu/fast_path.py, for three kinds of
+# messages: the button payloads (those of domain.yml and of the actions, with the artworks of the database),
+# the artwork ID codes typed alone, and the other messages (the examples of data/nlu.yml). For each kind, it
+# reports the share of the messages taken by the fast path and the time of fast_path.parse().
+# With --model (a model trained with this config.yml, and Rasa installed), it also parses every message with
+# the whole NLU pipeline, with the fast path enabled and then disabled, and reports the latency per message
+# and the mean latency for a traffic where --fast-path-share of the messages are payloads or ID codes.
+# Note that Rasa itself already skips the NLU model for the messages starting with '/' that it receives
+# through a channel: for them, the fast path matters to the /model/parse endpoint and the NLU tests.
+# Usage (from the gallery-assistant directory):
+#   python -m benchmarks.bench_nlu [--model models/MODEL.tar.gz] [--fast-path-share 0.6] [--repeat 20]
+# Resources consulted:
+# https://rasa.com/docs/rasa/2.x/reference/rasa/nlu/model#interpreter-objects
+# https://docs.python.org/3/library/timeit.html
+######################################
+import argparse
+import os
+import re
+import sqlite3
+import statistics
+import time
+
+import yaml
+
+from actions import db_models
+from nlu import fast_path
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_ANNOTATION_PATTERN = re.compile(r'\[([^\]]+)\](\([^)]*\)|\{[^}]*\})')  # [text](entity) or [text]{...}
+
+
+def load_messages(db_file=db_models.db_path, max_artworks=200):
+    """Returns the messages {kind: list of texts} and the intents of the training data."""
+    with open(os.path.join(PROJECT_DIR, 'domain.yml')) as domain_file:
+        domain = yaml.safe_load(domain_file)
+    with open(os.path.join(PROJECT_DIR, 'data', 'nlu.yml')) as nlu_file:
+        nlu_items = yaml.safe_load(nlu_file)['nlu']
+    with sqlite3.connect(f'file:{db_file}?mode=ro', uri=True) as connection:
+        artwork_ids = [row[0] for row in connection.execute("SELECT artwork_id FROM artwork LIMIT ?", (max_artworks,))]
+    payloads = [button['payload'] for variations in (domain.get('responses') or {}).values()
+                for variation in variations for button in variation.get('buttons') or []]
+    for artwork_id in artwork_ids:  # the buttons of the actions (see actions.py)
+        payloads += [f'/{intent}{{"artwork_id": "{artwork_id}"}}'
+                     for intent in ('ask_artwork_info_card', 'ask_minimum_bid', 'inform')]
+    examples = [_ANNOTATION_PATTERN.sub(r'\1', line[2:].strip()) for item in nlu_items if 'intent' in item
+                for line in item['examples'].splitlines() if line.startswith('- ')]
+    intents = {item['intent'] for item in nlu_items if 'intent' in item}
+    return {'payload': payloads, 'artwork_id': artwork_ids, 'other': examples}, intents
+
+
+def time_per_message(parse, texts, repeat):
+    """Returns the median over repeat runs of the mean time of parse(text) per message, in microseconds."""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            parse(text)
+        runs.append((time.perf_counter() - start) / len(texts) * 1e6)
+    return statistics.median(runs)
+
+
+def load_interpreter(model_path):
+    """Loads the NLU part of a trained model (Rasa 2) and returns the interpreter and its FastPathClassifier."""
+    from rasa.model import get_model, get_model_subdirectories
+    from rasa.nlu.model import Interpreter
+    from nlu.components import FastPathClassifier
+    _, nlu_path = get_model_subdirectories(get_model(model_path))
+    interpreter = Interpreter.load(nlu_path)
+    fast_path_component = next((component for component in interpreter.pipeline
+                                if isinstance(component, FastPathClassifier)), None)
+    if fast_path_component is None:
+        raise ValueError(f"The model {model_path} was not trained with the FastPathClassifier (see config.yml)")
+    return interpreter, fast_path_component
+
+
+def main(args):
+    messages, intents = load_messages()
+    print(f"{'messages':<12} {'count':>6} {'fast path':>10} {'parse() us':>11}")
+    for kind, texts in messages.items():
+        taken = sum(fast_path.parse(text, intents) is not None for text in texts)
+        micros = time_per_message(lambda text: fast_path.parse(text, intents), texts, args.repeat)
+        print(f"{kind:<12} {len(texts):>6} {taken / len(texts):>10.0%} {micros:>11.1f}")
+
+    if not args.model:
+        print("Use --model with a trained model (and Rasa installed) to compare with the whole NLU pipeline.")
+        return
+    interpreter, component = load_interpreter(args.model)
+    print(f"\n{'messages':<12} {'without ms':>11} {'with ms':>8} {'speed-up':>9}")
+    latencies = {}
+    for kind, texts in messages.items():
+        component.component_config['enabled'] = False
+        without = time_per_message(interpreter.parse, texts, args.model_repeat) / 1000
+        component.component_config['enabled'] = True
+        with_fast_path = time_per_message(interpreter.parse, texts, args.model_repeat) / 1000
+        latencies[kind] = (without, with_fast_path)
+        print(f"{kind:<12} {without:>11.2f} {with_fast_path:>8.2f} {without / with_fast_path:>8.1f}x")
+    # traffic: the fast path share split between payloads and ID codes like the message sets
+    share = args.fast_path_share
+    fast_kinds = len(messages['payload']) + len(messages['artwork_id'])
+    weights = {'payload': share * len(messages['payload']) / fast_kinds,
+               'artwork_id': share * len(messages['artwork_id']) / fast_kinds, 'other': 1 - share}
+    mean_without, mean_with = (sum(weights[kind] * latencies[kind][index] for kind in weights) for index in (0, 1))
+    print(f"Mean NLU latency with {share:.0%} payloads and ID codes: {mean_without:.2f} ms -> {mean_with:.2f} ms "
+          f"({1 - mean_with / mean_without:.0%} less)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='NLU time per message with and without the fast path.')
+    parser.add_argument('--model', help='trained model (.tar.gz) to compare with the whole NLU pipeline')
+    parser.add_argument('--fast-path-share', type=float, default=0.6,
+                        help='share of payloads and ID codes in the traffic, for the mean latency')
+    parser.add_argument('--repeat', type=int, default=20, help='runs of fast_path.parse() over the messages')
+    parser.add_argument('--model-repeat', type=int, default=3, help='runs of the NLU pipeline over the messages')
+    main(parser.parse_args())
@@ -0,0 +1,221 @@
+# generate_dataset.py
+# Builds a gallery database of any size for load tests and benchmarks (the sample data of db_migrate.py
+# only has 3 users, 19 artworks and 13 bids). The data is random but reproducible (seeded) and
+# roughly realistic: a few artworks get most of the bids (Zipf popularity), a few users place most of
+# them, and the bids are clustered just above the minimum bid, with a longer tail on popular artworks.
+# The schema is created by db_migrate.py, then the rows are inserted with bulk Core inserts while the
+# journal and fsyncs are turned off. The triggers and the secondary index on bid are dropped during
+# the load and recreated afterwards, with the bid statistics and the search index computed in one pass.
+# On one CPU core, 1M bids take about 8 s and 10M bids about 80 s (half of it in the executemany calls).
+# The first user is Foo, the user logged in to the chatbot.
+# Usage (from the gallery-assistant directory):
+#   python -m benchmarks.generate_dataset bench.db --users 100000 --artworks 100000 --bids 10000000
+# Resources consulted:
+# https://docs.sqlalchemy.org/en/14/core/tutorial.html#executing-multiple-statements
+# https://www.sqlite.org/pragma.html#pragma_journal_mode
+# https://www.sqlite.org/pragma.html#pragma_synchronous
+# https://en.wikipedia.org/wiki/Zipf%27s_law
+# https://docs.python.org/3/library/random.html#random.choices
+######################################
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+from contextlib import closing, redirect_stdout
+from math import log
+
+from sqlalchemy import create_engine, event
+
+import db_migrate
+from actions.db_models import User, Artwork, Bid, BID_STATISTICS_TRIGGERS, ARTWORK_SEARCH_DDL, CHANGE_COUNTER_DDL
+
+INSERT_BATCH_SIZE = 50000  # rows per executemany
+BID_STEP = 50  # bids are multiples of 50 above the minimum bid
+MIN_BIDS = [100, 200, 300, 400, 500, 600, 800, 1000, 1500, 2000, 3000, 5000]
+MIN_BID_WEIGHTS = [2, 4, 6, 10, 12, 10, 8, 8, 5, 3, 2, 1]  # cheap artworks are more common
+CATEGORIES = {'painting': ['Oil on canvas', 'Acrylic on canvas', 'Watercolour on paper', 'Coloured ink on paper'],
+              'drawing': ['Ballpoint pen on paper', 'Coloured pencil on paper', 'Charcoal on paper'],
+              'photography': ['Photograph', 'Silver gelatin print'],
+              'sculpture': ['Sandstone', 'Bronze', 'Marble', 'Wood'],
+              'other': ['Mixed media', 'Textile', 'Ceramic']}
+CATEGORY_WEIGHTS = [40, 25, 15, 12, 8]
+FIRST_NAMES = ['Alice', 'Bob', 'Charlie', 'Dana', 'Eve', 'Frank', 'Grace', 'Hugo', 'Iris', 'Jules', 'Kim', 'Lea',
+               'Max', 'Nina', 'Omar', 'Paula', 'Quinn', 'Rosa', 'Sam', 'Tara', 'Ugo', 'Vera', 'Will', 'Yan', 'Zoe']
+LAST_NAMES = ['Allen', 'Robson', 'Charlton', 'Evans', 'Dubois', 'Garcia', 'Nguyen', 'Smith', 'Tremblay', 'Roy',
+              'Martin', 'Lee', 'Wong', 'Khan', 'Silva', 'Rossi', 'Novak', 'Berg', 'Kowalski', 'Moreau']
+TITLE_WORDS = ['Blue', 'Green', 'Orange', 'Rainbow', 'Cloud', 'River', 'Shells', 'Spirals', 'Squares', 'Stairs',
+               'Eye', 'Marmot', 'Flowers', 'Sailboat', 'Walls', 'Seashell', 'Morning', 'Winter', 'Harbour',
+               'Forest', 'Portrait', 'Garden', 'Light', 'Shadow', 'Study', 'Silence', 'City', 'Mountain']
+
+
+def artwork_id(index):
+    """Artwork id in the ABC123 format, in the same order as the index."""
+    letters = ''
+    number = index // 1000
+    for _ in range(3):
+        number, letter = divmod(number, 26)
+        letters = chr(ord('A') + letter) + letters
+    return f"{letters}{index % 1000:03d}"
+
+
+def user_name(index):
+    return 'Foo' if index == 0 else f"user{index}"
+
+
+def zipf_weights(count, exponent, rng):
+    """Weights 1/rank^exponent given to the items in random order (so popularity does not follow the ids)."""
+    weights = [1.0 / rank ** exponent for rank in range(1, count + 1)]
+    rng.shuffle(weights)
+    return weights
+
+
+def split_counts(total, capacity, weights):
+    """Splits total between the items in proportion to their weights, with at most capacity per item
+    (what an item cannot take goes to the others). Used to give each user a number of bids, since a
+    user bids at most once on each artwork."""
+    if total > capacity * len(weights):
+        raise ValueError(f"cannot split {total} between {len(weights)} items with at most {capacity} each")
+    counts = [0] * len(weights)
+    order = sorted(range(len(weights)), key=weights.__getitem__, reverse=True)
+    remaining, remaining_weight = total, sum(weights)
+    for position, i in enumerate(order):  # the heaviest items are capped first
+        if remaining * weights[i] < capacity * remaining_weight:
+            break
+        counts[i] = capacity
+        remaining -= capacity
+        remaining_weight -= weights[i]
+    else:
+        return counts
+    uncapped = order[position:]
+    for i in uncapped:
+        counts[i] = int(remaining * weights[i] / remaining_weight)
+    for i in uncapped[:remaining - sum(counts[i] for i in uncapped)]:  # what the rounding down left
+        counts[i] += 1
+    return counts
+
+
+def pick_distinct(rng, count, population, cum_weights):
+    """Returns count distinct indexes in range(population), drawn with the given (cumulative) weights when
+    few are needed, and uniformly otherwise (where drawing distinct items from a skewed distribution
+    would take too many draws)."""
+    if count * 8 > population:
+        return rng.sample(range(population), count)
+    chosen = set()
+    while len(chosen) < count:
+        chosen.update(rng.choices(range(population), cum_weights=cum_weights, k=count - len(chosen)))
+    return chosen
+
+
+def generate_artworks(rng, num_artworks):
+    """Yields the rows (artwork_id, title, artist_name, medium, category, min_bid, bid_count) of the
+    artwork table (the bid statistics are computed once the bids are inserted)."""
+    artists = [f"{first} {last}" for first, last in itertools.product(FIRST_NAMES, LAST_NAMES)]
+    categories = list(CATEGORIES)
+    for index in range(num_artworks):
+        category = rng.choices(categories, CATEGORY_WEIGHTS)[0]
+        yield (artwork_id(index), f"{rng.choice(TITLE_WORDS)} {rng.randrange(1, 100)}", rng.choice(artists),
+               rng.choice(CATEGORIES[category]), category, rng.choices(MIN_BIDS, MIN_BID_WEIGHTS)[0], 0)
+
+
+def generate_bids(rng, num_bids, min_bids, artwork_weights, user_names, user_weights):
+    """Yields the rows (user_name, artwork_id, value) of the bid table, in the order of the primary key
+    (user_name, artwork_id) so that the rows are appended to the table instead of inserted at random places."""
+    num_artworks = len(min_bids)
+    artwork_ids = [artwork_id(index) for index in range(num_artworks)]
+    artwork_cum_weights = list(itertools.accumulate(artwork_weights))
+    mean_weight = artwork_cum_weights[-1] / num_artworks
+    # the more popular an artwork is, the further above the minimum bid its bids go
+    mean_steps = [1.0 + 2.0 * weight / mean_weight for weight in artwork_weights]
+    bid_counts = split_counts(num_bids, num_artworks, user_weights)
+    uniform = rng.random
+    for user in sorted(range(len(user_names)), key=user_names.__getitem__):
+        artworks = sorted(pick_distinct(rng, bid_counts[user], num_artworks, artwork_cum_weights))
+        # the values above the minimum bid are exponentially distributed: most bids are close to it
+        values = [min_bids[artwork] + BID_STEP * int(-log(1.0 - uniform()) * mean_steps[artwork])
+                  for artwork in artworks]
+        yield from zip(itertools.repeat(user_names[user]), map(artwork_ids.__getitem__, artworks), values)
+
+
+def insert_all(connection, table, columns, rows):
+    """Inserts the rows (tuples of values of the columns) in batches of INSERT_BATCH_SIZE.
+    The INSERT statement is compiled once and the batches go straight to the executemany of the driver,
+    skipping the conversion of every row to a dictionary of parameters."""
+    statement = str(table.insert().compile(dialect=connection.dialect, column_keys=columns))
+    total = 0
+    while True:
+        batch = list(itertools.islice(rows, INSERT_BATCH_SIZE))
+        if not batch:
+            return total
+        connection.exec_driver_sql(statement, batch)
+        total += len(batch)
+
+
+def set_bulk_load_pragmas(dbapi_connection, connection_record):
+    """No rollback journal and no fsync: if the load fails, the file is simply generated again."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=OFF')
+    cursor.execute('PRAGMA synchronous=OFF')
+    cursor.close()
+
+
+def generate_database(path, num_users, num_artworks, num_bids, seed=0, artwork_exponent=1.0, user_exponent=0.8):
+    """Creates the database file (which must not exist yet) and fills it with random data."""
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    rng = random.Random(seed)
+    with redirect_stdout(sys.stderr), closing(sqlite3.connect(path, isolation_level=None)) as connection:
+        db_migrate.migrate(connection)
+
+    user_names = [user_name(index) for index in range(num_users)]
+    artworks = list(generate_artworks(rng, num_artworks))
+    min_bids = [artwork[5] for artwork in artworks]
+    artwork_weights = zipf_weights(num_artworks, artwork_exponent, rng)
+    user_weights = zipf_weights(num_users, user_exponent, rng)
+
+    engine = create_engine(f'sqlite:///{path}')
+    event.listen(engine, 'connect', set_bulk_load_pragmas)
+    with engine.begin() as connection:
+        # the triggers would update artwork, artwork_fts and change_counter once per row
+        for name in ['bid_statistics_insert', 'bid_statistics_update', 'bid_statistics_delete',
+                     'artwork_fts_insert', 'artwork_fts_update', 'artwork_fts_delete',
+                     'change_counter_bid_insert', 'change_counter_bid_update', 'change_counter_bid_delete',
+                     'change_counter_artwork_insert', 'change_counter_artwork_update', 'change_counter_artwork_delete']:
+            connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+        connection.exec_driver_sql("DROP INDEX IF EXISTS ix_bid_artwork_id_value")
+        insert_all(connection, User.__table__, ['user_name'], ((name,) for name in user_names))
+        insert_all(connection, Artwork.__table__, ['artwork_id', 'title', 'artist_name', 'medium', 'category',
+                                                   'min_bid', 'bid_count'], iter(artworks))
+        insert_all(connection, Bid.__table__, ['user_name', 'artwork_id', 'value'],
+                   generate_bids(rng, num_bids, min_bids, artwork_weights, user_names, user_weights))
+        connection.exec_driver_sql("CREATE INDEX ix_bid_artwork_id_value ON bid (artwork_id, value)")
+        connection.exec_driver_sql("""UPDATE artwork SET (bid_count, highest_bid) = (
+            SELECT count(*), max(value) FROM bid WHERE bid.artwork_id = artwork.artwork_id)""")
+        connection.exec_driver_sql("""INSERT INTO artwork_fts (artwork_id, title, artist_name, medium, category)
+            SELECT artwork_id, title, artist_name, medium, category FROM artwork""")
+        for statement in BID_STATISTICS_TRIGGERS + ARTWORK_SEARCH_DDL + CHANGE_COUNTER_DDL:
+            connection.exec_driver_sql(statement.statement)
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA journal_mode=DELETE")  # like the gallery.db file in the repository
+        connection.exec_driver_sql("ANALYZE")
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a gallery database with random data.')
+    parser.add_argument('db', help='path of the database file to create')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--artworks', type=int, default=1000)
+    parser.add_argument('--bids', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--artwork-exponent', type=float, default=1.0, help='Zipf exponent of the artwork popularity')
+    parser.add_argument('--user-exponent', type=float, default=0.8, help='Zipf exponent of the user activity')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    generate_database(args.db, args.users, args.artworks, args.bids, args.seed, args.artwork_exponent,
+                      args.user_exponent)
+    print(f"Created {args.db} with {args.users} users, {args.artworks} artworks and {args.bids} bids "
+          f"in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,373 @@
+# load_test.py
+# Load test of the action server, for capacity planning: replays conversations made from the rules and
+# stories of data/ (and the forms of domain.yml) as the webhook calls Rasa would send to the action server.
+# Every rule or story that runs a custom action becomes a flow of calls: a custom action is called once, and
+# a form is expanded into the calls of the actions the server registers for it (action_ask_<form>_<slot>
+# before each slot, then validate_<form> with the slot filled). Each conversation is one flow for a random
+# user of the database, with a random artwork and bid: its calls are sent one after the other, like the
+# turns of a real conversation, and new conversations start at a fixed rate so that the calls arrive at the
+# target rate whatever the response times (an open load: a slow server is not given time to catch up).
+# The calls are sent over HTTP to a running action server (rasa run actions), or run in-process by the
+# ActionExecutor of the Rasa SDK (the same code as the webhook, without the HTTP server) on a temporary copy
+# of the database. The report gives the throughput, the latency percentiles and histogram of every action
+# (measured from the time the call was due, so it includes the waiting when the server is saturated), and the
+# errors, the "database is locked" errors (lock contention between the writers) being counted apart.
+# Note that the bid submissions write bids: over HTTP, they are written to the database of the server.
+# Usage (from the gallery-assistant directory):
+#   python -m benchmarks.load_test [--url http://localhost:5055/webhook | --in-process] [--rps 100]
+#                                  [--duration 30] [--concurrency 100] [--db PATH] [--output FILE]
+# Resources consulted:
+# https://rasa.com/docs/rasa/action-server/http-api-spec
+# https://rasa.com/docs/action-server/sdk-tracker
+# https://rasa.com/docs/rasa/forms#custom-slot-mappings
+# https://docs.python.org/3/library/asyncio-stream.html
+# https://www.rfc-editor.org/rfc/rfc9112  <-- HTTP/1.1 messages (for the keep-alive client)
+# https://www.scylladb.com/2021/04/22/on-coordinated-omission/
+######################################
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import math
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+from collections import Counter, defaultdict, namedtuple
+from contextlib import closing
+from urllib.parse import urlsplit
+
+import rasa_sdk
+import yaml
+
+from actions import db_models
+from benchmarks.bench_actions import SEARCH_QUERIES
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_URL = 'http://localhost:5055/webhook'
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]  # upper bounds of the buckets
+LOCKED_ERROR = 'database is locked'
+
+# A webhook call of a flow: the action and the message of the user it answers (intent, and the slot that the
+# user filled for the validation of a form)
+Step = namedtuple('Step', ['action', 'intent', 'form', 'slot'])
+Flow = namedtuple('Flow', ['name', 'steps'])
+
+
+def load_domain(path=os.path.join(PROJECT_DIR, 'domain.yml')):
+    """Returns the domain as Rasa sends it to the action server: the forms have their list of required slots."""
+    with open(path) as domain_file:
+        domain = yaml.safe_load(domain_file)
+    for name, form in (domain.get('forms') or {}).items():
+        if 'required_slots' not in (form or {}):
+            domain['forms'][name] = {'required_slots': list(form or {})}
+    return domain
+
+
+def load_flows(domain, registered, data_dir=os.path.join(PROJECT_DIR, 'data')):
+    """Returns the flows of the rules and stories that call at least one of the registered actions."""
+    flows = []
+    for file_name, key in (('rules.yml', 'rules'), ('stories.yml', 'stories')):
+        with open(os.path.join(data_dir, file_name)) as data_file:
+            items = yaml.safe_load(data_file).get(key) or []
+        for item in items:
+            active_loop = next((condition['active_loop'] for condition in item.get('condition') or []
+                                if 'active_loop' in condition), None)
+            intent, steps = None, []
+            for step in item.get('steps') or []:
+                if 'intent' in step:
+                    intent = step['intent']
+                elif 'action' in step:
+                    action = step['action']
+                    if action in domain['forms'] and action != active_loop:  # a form being activated
+                        for slot in domain['forms'][action]['required_slots']:
+                            if f'action_ask_{action}_{slot}' in registered:
+                                steps.append(Step(f'action_ask_{action}_{slot}', intent, action, None))
+                            if f'validate_{action}' in registered:
+                                steps.append(Step(f'validate_{action}', 'inform', action, slot))
+                    elif action in registered:
+                        steps.append(Step(action, intent, active_loop, None))
+            if steps:
+                flows.append(Flow(item.get('rule') or item.get('story'), steps))
+    return flows
+
+
+class ConversationFactory:
+    """Makes the webhook payloads of conversations with the users and artworks of a database."""
+
+    def __init__(self, db_file, domain, seed=0):
+        with sqlite3.connect(f'file:{db_file}?mode=ro', uri=True) as connection:
+            self.users = [row[0] for row in connection.execute("SELECT user_name FROM user")]
+            self.artworks = connection.execute("SELECT artwork_id, min_bid FROM artwork").fetchall()
+        if not self.users or not self.artworks:
+            raise ValueError(f"The database {db_file} has no users or no artworks")
+        self.domain = domain
+        self.domain_digest = hashlib.sha256(json.dumps(domain, sort_keys=True).encode()).hexdigest()
+        self.rng = random.Random(seed)
+
+    def payload(self, step, user_name, slots, text):
+        """Returns the JSON body of the webhook call of a step."""
+        events = [{'event': 'action', 'name': 'action_listen'},
+                  {'event': 'user', 'text': text, 'parse_data': {'intent': {'name': step.intent}}}]
+        slots = dict(slots)
+        if step.slot is not None:  # the value extracted from the message, validated by the form
+            events.append({'event': 'slot', 'name': step.slot, 'value': slots[step.slot]})
+            slots['requested_slot'] = step.slot
+        tracker = {'sender_id': user_name, 'slots': slots, 'events': events, 'paused': False,
+                   'followup_action': None, 'latest_action_name': 'action_listen',
+                   'active_loop': {'name': step.form} if step.form else {},
+                   'latest_message': {'text': text, 'intent': {'name': step.intent, 'confidence': 1.0},
+                                      'entities': [], 'metadata': {}}}
+        return json.dumps({'next_action': step.action, 'sender_id': user_name, 'tracker': tracker,
+                           'domain_digest': self.domain_digest, 'version': rasa_sdk.__version__}).encode()
+
+    def conversation(self, flow):
+        """Returns the list of (action name, payload) of a conversation following the flow."""
+        user_name = self.rng.choice(self.users)
+        artwork_id, min_bid = self.rng.choice(self.artworks)
+        slots = {'artwork_id': artwork_id, 'bid_value': str(min_bid + 50 * self.rng.randrange(20)),
+                 'confirm_form': 'yes'}
+        text = self.rng.choice(SEARCH_QUERIES) if any(step.action == 'action_search_artwork' for step in flow.steps) \
+            else artwork_id
+        return [(step.action, self.payload(step, user_name, slots, text)) for step in flow.steps]
+
+
+def error_kind(message):
+    """Classifies an error: lock contention between the writers, or anything else."""
+    return LOCKED_ERROR if LOCKED_ERROR in str(message) else str(message)[:80]
+
+
+class HttpClient:
+    """Minimal HTTP/1.1 client over asyncio streams, keeping up to concurrency connections open (keep-alive),
+    so the load generator itself costs little and needs no other package."""
+
+    def __init__(self, url, concurrency):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.path = parts.path or '/'
+        self.base_path = self.path.rsplit('/', 1)[0]
+        self._connections = asyncio.LifoQueue()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(self, method, path, body=b''):
+        """Returns the status and the body of the response."""
+        async with self._semaphore:
+            reader, writer = self._connections.get_nowait() if not self._connections.empty() \
+                else await asyncio.open_connection(self.host, self.port)
+            try:
+                content_headers = f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n' if body else ''
+                writer.write(f'{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n{content_headers}\r\n'
+                             .encode() + body)
+                status = int((await reader.readline()).split()[1])
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                response_body = await reader.readexactly(int(headers.get('content-length', 0)))
+            except BaseException:
+                writer.close()
+                raise
+            if headers.get('connection', '').lower() == 'close':
+                writer.close()
+            else:
+                self._connections.put_nowait((reader, writer))
+            return status, response_body
+
+    async def registered_actions(self):
+        status, body = await self.request('GET', f'{self.base_path}/actions')
+        if status != 200:
+            raise RuntimeError(f"GET {self.base_path}/actions: HTTP {status}")
+        return {action['name'] for action in json.loads(body)}
+
+    async def call(self, payload, domain):
+        """Sends a webhook call, with the domain if the server asks for it (HTTP 449, like Rasa).
+        Returns None, or the error."""
+        status, body = await self.request('POST', self.path, payload)
+        if status == 449:
+            status, body = await self.request('POST', self.path, with_domain(payload, domain))
+        if status == 200:
+            return None
+        try:
+            return error_kind(json.loads(body).get('error'))
+        except ValueError:
+            return f'HTTP {status}'
+
+    async def close(self):
+        while not self._connections.empty():
+            self._connections.get_nowait()[1].close()
+
+
+def with_domain(payload, domain):
+    call = json.loads(payload)
+    call['domain'] = domain
+    return json.dumps(call).encode()
+
+
+class InProcessClient:
+    """Runs the webhook calls with the ActionExecutor of the Rasa SDK, in this process."""
+
+    def __init__(self, concurrency):
+        from rasa_sdk.executor import ActionExecutor
+        self.executor = ActionExecutor()
+        self.executor.register_package('actions')
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def registered_actions(self):
+        return set(self.executor.actions)
+
+    async def call(self, payload, domain):
+        async with self._semaphore:
+            action_call = json.loads(payload)  # parsed like the webhook does
+            if self.executor.domain is None:
+                action_call['domain'] = domain
+            try:
+                await self.executor.run(action_call)
+            except Exception as error:
+                return error_kind(error)
+            return None
+
+    async def close(self):
+        from actions import async_db_handler
+        await async_db_handler.dispose_engine()
+
+
+class Recorder:
+    """Latencies and errors of the calls, per action."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)  # action -> milliseconds
+        self.errors = defaultdict(Counter)  # action -> error -> count
+
+    def record(self, action, milliseconds, error):
+        self.latencies[action].append(milliseconds)
+        if error is not None:
+            self.errors[action][error] += 1
+
+    @staticmethod
+    def summary(latencies, errors):
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 \
+            else latencies * 99
+        histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        for latency in latencies:
+            histogram[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, latency)] += 1
+        return {'calls': len(latencies), 'errors': sum(errors.values()), 'locked': errors.get(LOCKED_ERROR, 0),
+                'p50_ms': round(percentiles[49], 2), 'p95_ms': round(percentiles[94], 2),
+                'p99_ms': round(percentiles[98], 2), 'max_ms': round(max(latencies), 2),
+                'histogram': dict(zip([f'<={bound}ms' for bound in HISTOGRAM_BOUNDS_MS] + ['>5000ms'], histogram)),
+                'error_kinds': dict(errors)}
+
+    def report(self):
+        all_latencies = [latency for latencies in self.latencies.values() for latency in latencies]
+        all_errors = sum(self.errors.values(), Counter())
+        return {'all': self.summary(all_latencies, all_errors),
+                'actions': {action: self.summary(latencies, self.errors[action])
+                            for action, latencies in sorted(self.latencies.items())}}
+
+
+async def run_load(client, conversations, domain, rps, recorder):
+    """Starts the conversations at the rate giving rps calls per second, each conversation sending its calls
+    one after the other. Returns the elapsed seconds."""
+    loop = asyncio.get_running_loop()
+    mean_calls = sum(len(conversation) for conversation in conversations) / len(conversations)
+    interval = mean_calls / rps  # seconds between the starts of two conversations
+
+    async def run_conversation(calls, due):
+        for action, payload in calls:
+            error = await client.call(payload, domain)
+            done = loop.time()
+            recorder.record(action, (done - due) * 1000, error)  # from the time the call was due
+            due = done  # the next call of the conversation is due once the previous one is answered
+
+    start = loop.time()
+    tasks = []
+    for index, calls in enumerate(conversations):
+        due = start + index * interval
+        if due > loop.time():
+            await asyncio.sleep(due - loop.time())
+        tasks.append(asyncio.create_task(run_conversation(calls, due)))
+    await asyncio.gather(*tasks)
+    return loop.time() - start
+
+
+def print_report(report, elapsed, rps):
+    overall = report['all']
+    print(f"{overall['calls']} calls in {elapsed:.1f} s: {overall['calls'] / elapsed:.1f} calls/s "
+          f"(target {rps}), {overall['errors']} errors including {overall['locked']} '{LOCKED_ERROR}'")
+    print(f"{'action':<42} {'calls':>6} {'errors':>6} {'locked':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8}")
+    for action, measures in list(report['actions'].items()) + [('all', overall)]:
+        print(f"{action:<42} {measures['calls']:>6} {measures['errors']:>6} {measures['locked']:>6} "
+              f"{measures['p50_ms']:>8.2f} {measures['p95_ms']:>8.2f} {measures['p99_ms']:>8.2f} "
+              f"{measures['max_ms']:>8.2f}")
+    print("Latency histogram (all calls):")
+    largest = max(overall['histogram'].values()) or 1
+    for bucket, count in overall['histogram'].items():
+        print(f"  {bucket:>8} {count:>7} {'#' * math.ceil(40 * count / largest)}")
+    for kind, count in overall['error_kinds'].items():
+        print(f"  error x{count}: {kind}")
+
+
+async def main(args):
+    domain = load_domain()
+    with tempfile.TemporaryDirectory() as directory:
+        if args.in_process:
+            db_file = os.path.join(directory, 'load.db')
+            with closing(sqlite3.connect(args.db)) as source, closing(sqlite3.connect(db_file)) as copy:
+                source.backup(copy)  # the bids are written to a copy
+            db_models.db_path = db_file
+            client = InProcessClient(args.concurrency)
+        else:
+            db_file = args.db  # only read, for the user names and artworks
+            client = HttpClient(args.url, args.concurrency)
+        try:
+            try:
+                registered = await client.registered_actions()
+            except OSError as error:
+                sys.exit(f"Cannot reach the action server at {args.url} ({error}), start it with "
+                         f"'rasa run actions' or use --in-process")
+            flows = load_flows(domain, registered)
+            factory = ConversationFactory(db_file, domain, args.seed)
+            rng = random.Random(args.seed)
+            conversations, calls = [], 0
+            while calls < args.rps * args.duration:
+                conversations.append(factory.conversation(rng.choice(flows)))
+                calls += len(conversations[-1])
+            print(f"{len(flows)} flows, {len(conversations)} conversations, {calls} calls "
+                  f"({'in-process' if args.in_process else args.url})")
+            recorder = Recorder()
+            elapsed = await run_load(client, conversations, domain, args.rps, recorder)
+        finally:
+            await client.close()
+    report = recorder.report()
+    report.update({'target_rps': args.rps, 'achieved_rps': round(report['all']['calls'] / elapsed, 1),
+                   'elapsed_s': round(elapsed, 2), 'concurrency': args.concurrency,
+                   'flows': [flow.name for flow in flows]})
+    print_report(report, elapsed, args.rps)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test of the action server with replayed conversations.')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', default=DEFAULT_URL, help='webhook of the action server')
+    target.add_argument('--in-process', action='store_true', help='run the actions in this process instead')
+    parser.add_argument('--rps', type=float, default=100, help='target number of webhook calls per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load')
+    parser.add_argument('--concurrency', type=int, default=100, help='maximum number of calls in progress')
+    parser.add_argument('--db', default=db_models.db_path,
+                        help='database with the users and artworks of the conversations (copied with --in-process)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file for the results')
+    main_args = parser.parse_args()
+    if main_args.rps <= 0 or main_args.duration <= 0:
+        sys.exit("--rps and --duration must be positive")
+    asyncio.run(main(main_args))
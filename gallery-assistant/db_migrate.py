@@ -0,0 +1,245 @@
+# db_migrate.py
+# This file creates the database or upgrades an existing one to the latest version of the schema
+# (it replaces the one-shot db_setup.py script). The version of the schema of a database file is
+# saved in the SQLite user_version pragma, and each migration below brings the schema from one
+# version to the next in its own transaction, so the script can safely be run on any gallery.db file.
+# Usage: python db_migrate.py [--db PATH] [--sample-data] [--check]
+#   --sample-data: insert the sample users, artworks and bids if the database has no artworks
+#   --check: verify with EXPLAIN QUERY PLAN that the frequent queries use the indexes
+# Resources consulted: see the resources already cited in db_models.py
+# https://www.sqlite.org/pragma.html#pragma_user_version
+# https://www.sqlite.org/lang_altertable.html#otheralter  <-- how to change the type of a column
+# https://www.sqlite.org/eqp.html  <-- EXPLAIN QUERY PLAN
+# https://www.sqlite.org/fts5.html
+# https://docs.python.org/3/library/sqlite3.html#transaction-control
+######################################
+import argparse
+import sqlite3
+import sys
+
+from actions.db_models import db_path, BID_STATISTICS_TRIGGERS, ARTWORK_SEARCH_DDL, CHANGE_COUNTER_DDL
+
+
+def create_initial_schema(connection):
+    """Version 1: the original tables (as created by db_setup.py)."""
+    connection.execute("""CREATE TABLE IF NOT EXISTS user (
+        user_name VARCHAR(20) NOT NULL,
+        PRIMARY KEY (user_name))""")
+    connection.execute("""CREATE TABLE IF NOT EXISTS artwork (
+        artwork_id VARCHAR(6) NOT NULL,
+        title VARCHAR(50),
+        artist_name VARCHAR(30),
+        medium VARCHAR(50),
+        category VARCHAR(20),
+        min_bid INTEGER,
+        PRIMARY KEY (artwork_id))""")
+    connection.execute("""CREATE TABLE IF NOT EXISTS bid (
+        user_name INTEGER NOT NULL,
+        artwork_id VARCHAR NOT NULL,
+        value INTEGER,
+        PRIMARY KEY (user_name, artwork_id),
+        FOREIGN KEY(user_name) REFERENCES user (user_name),
+        FOREIGN KEY(artwork_id) REFERENCES artwork (artwork_id))""")
+
+
+def add_bid_statistics(connection):
+    """Version 2: bid_count and highest_bid columns on artwork, maintained by triggers on bid."""
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(artwork)")}
+    if 'bid_count' not in columns:
+        connection.execute("ALTER TABLE artwork ADD COLUMN bid_count INTEGER DEFAULT '0' NOT NULL")
+    if 'highest_bid' not in columns:
+        connection.execute("ALTER TABLE artwork ADD COLUMN highest_bid INTEGER")
+    connection.execute("""UPDATE artwork SET
+        bid_count = (SELECT count(*) FROM bid WHERE bid.artwork_id = artwork.artwork_id),
+        highest_bid = (SELECT max(value) FROM bid WHERE bid.artwork_id = artwork.artwork_id)""")
+    for trigger in BID_STATISTICS_TRIGGERS:
+        connection.execute(trigger.statement)
+
+
+def add_indexes_and_fix_bid_types(connection):
+    """Version 3: bid.user_name was declared INTEGER although user.user_name is VARCHAR(20), so
+    the bid table is rebuilt with the right column types (SQLite cannot alter the type of a column).
+    Then the indexes for the lookups by artwork, category and artist are added."""
+    connection.execute("""CREATE TABLE bid_new (
+        user_name VARCHAR(20) NOT NULL,
+        artwork_id VARCHAR(6) NOT NULL,
+        value INTEGER,
+        PRIMARY KEY (user_name, artwork_id),
+        FOREIGN KEY(user_name) REFERENCES user (user_name),
+        FOREIGN KEY(artwork_id) REFERENCES artwork (artwork_id))""")
+    connection.execute("INSERT INTO bid_new (user_name, artwork_id, value) "
+                       "SELECT user_name, artwork_id, value FROM bid")
+    connection.execute("DROP TABLE bid")  # also drops the triggers on the table
+    connection.execute("ALTER TABLE bid_new RENAME TO bid")
+    for trigger in BID_STATISTICS_TRIGGERS:
+        connection.execute(trigger.statement)
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_bid_artwork_id_value ON bid (artwork_id, value)")
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_artwork_category ON artwork (category)")
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_artwork_artist_name ON artwork (artist_name)")
+
+
+def add_artwork_search_index(connection):
+    """Version 4: FTS5 full-text index over the artwork titles, artists, media and categories."""
+    for statement in ARTWORK_SEARCH_DDL:
+        connection.execute(statement.statement)
+    connection.execute("DELETE FROM artwork_fts")
+    connection.execute("""INSERT INTO artwork_fts (artwork_id, title, artist_name, medium, category)
+        SELECT artwork_id, title, artist_name, medium, category FROM artwork""")
+
+
+def add_auction_results(connection):
+    """Version 5: auction_result and auction_tie tables, filled by auction_close.py."""
+    connection.execute("""CREATE TABLE IF NOT EXISTS auction_result (
+        artwork_id VARCHAR(6) NOT NULL,
+        status VARCHAR(10) NOT NULL,
+        winner_user_name VARCHAR(20),
+        winning_bid INTEGER,
+        runner_up_user_name VARCHAR(20),
+        runner_up_bid INTEGER,
+        bid_count INTEGER DEFAULT '0' NOT NULL,
+        tied_count INTEGER DEFAULT '0' NOT NULL,
+        PRIMARY KEY (artwork_id),
+        FOREIGN KEY(artwork_id) REFERENCES artwork (artwork_id),
+        FOREIGN KEY(winner_user_name) REFERENCES user (user_name),
+        FOREIGN KEY(runner_up_user_name) REFERENCES user (user_name))""")
+    connection.execute("""CREATE TABLE IF NOT EXISTS auction_tie (
+        artwork_id VARCHAR(6) NOT NULL,
+        user_name VARCHAR(20) NOT NULL,
+        PRIMARY KEY (artwork_id, user_name),
+        FOREIGN KEY(artwork_id) REFERENCES auction_result (artwork_id),
+        FOREIGN KEY(user_name) REFERENCES user (user_name))""")
+
+
+def add_bid_journal_checkpoints(connection):
+    """Version 6: bid_journal_checkpoint table, updated by the bid journal of the action server."""
+    connection.execute("""CREATE TABLE IF NOT EXISTS bid_journal_checkpoint (
+        journal VARCHAR(255) NOT NULL,
+        last_sequence INTEGER NOT NULL,
+        PRIMARY KEY (journal))""")
+
+
+def add_change_counters(connection):
+    """Version 7: change_counter table, counting the changes of the catalog and of the bids (triggers)."""
+    connection.execute("""CREATE TABLE IF NOT EXISTS change_counter (
+        name VARCHAR(20) NOT NULL,
+        version INTEGER DEFAULT '0' NOT NULL,
+        changed_at FLOAT NOT NULL,
+        PRIMARY KEY (name))""")
+    for statement in CHANGE_COUNTER_DDL:
+        connection.execute(statement.statement)
+
+
+# The migrations in order: the migration at index i brings the schema to version i + 1.
+# Never modify a migration that was already released, add a new one at the end instead.
+MIGRATIONS = [create_initial_schema,
+              add_bid_statistics,
+              add_indexes_and_fix_bid_types,
+              add_artwork_search_index,
+              add_auction_results,
+              add_bid_journal_checkpoints,
+              add_change_counters]
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(connection):
+    """Applies the missing migrations, each one in its own transaction (with the new version number)."""
+    version = get_schema_version(connection)
+    for migration in MIGRATIONS[version:]:
+        version += 1
+        print(f"Migrating to version {version}: {migration.__name__}")
+        connection.execute("BEGIN")
+        try:
+            migration(connection)
+            connection.execute(f"PRAGMA user_version = {version}")
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+
+def insert_sample_data(connection):
+    """Inserts the sample users, artworks and bids (only if the database does not contain artworks yet)."""
+    if connection.execute("SELECT count(*) FROM artwork").fetchone()[0] > 0:
+        print("The database already contains artworks, the sample data was not inserted.")
+        return
+    # Foo is the logged-in user talking to chatbot
+    users = [('Foo',), ('Bar',), ('Baz',)]
+    artworks = [('ABC123', 'Cloud', 'Alice Allen', 'Coloured ink on paper', 'painting', 1000),
+                ('DEF871', 'River', 'Alice Allen', 'Coloured ink on paper', 'painting', 500),
+                ('LEG609', 'Shells', 'Alice Allen', 'Coloured ink on paper', 'painting', 400),
+                ('ARM544', 'Spirals', 'Alice Allen', 'Coloured ink on paper', 'painting', 600),
+                ('PAT110', 'Squares', 'Alice Allen', 'Coloured ink on paper', 'painting', 500),
+                ('JBD007', 'Stairs', 'Alice Allen', 'Coloured ink on paper', 'painting', 500),
+                ('WEB101', 'Eye 1', 'Bob Robson', 'Ballpoint pen on paper', 'drawing', 400),
+                ('PAW366', 'Eye 2', 'Bob Robson', 'Ballpoint pen on paper', 'drawing', 400),
+                ('HEL666', 'Eye 3', 'Bob Robson', 'Ballpoint pen on paper', 'drawing', 600),
+                ('RAT999', 'Eye 4', 'Bob Robson', 'Ballpoint pen on paper', 'drawing', 400),
+                ('GDP832', 'Blue', 'Charlie Charlton', 'Coloured pencil on paper', 'drawing', 1000),
+                ('MEG404', 'Green', 'Charlie Charlton', 'Coloured pencil on paper', 'drawing', 1000),
+                ('LAM734', 'Orange', 'Charlie Charlton', 'Coloured pencil on paper', 'drawing', 1000),
+                ('TED837', 'Rainbow', 'Charlie Charlton', 'Coloured pencil on paper', 'drawing', 1000),
+                ('PIG190', 'Marmot', 'Eve Evans', 'Photograph', 'photography', 500),
+                ('GAP000', 'Flowers', 'Eve Evans', 'Photograph', 'photography', 400),
+                ('NOT765', 'Sailboat', 'Eve Evans', 'Photograph', 'photography', 600),
+                ('MAN221', 'Walls', 'Eve Evans', 'Sandstone', 'sculpture', 800),
+                ('KIM876', 'Seashell', 'Eve Evans', 'Sandstone', 'sculpture', 1000)]
+    bids = [('Foo', 'ABC123', 1100), ('Foo', 'TED837', 1500), ('Foo', 'PAT110', 600), ('Foo', 'KIM876', 1200),
+            ('Foo', 'DEF871', 600), ('Foo', 'LEG609', 600), ('Bar', 'JBD007', 600), ('Bar', 'TED837', 1200),
+            ('Bar', 'PAT110', 650), ('Baz', 'ABC123', 1100), ('Baz', 'TED837', 1500), ('Baz', 'PAT110', 700),
+            ('Baz', 'KIM876', 1100)]
+    connection.execute("BEGIN")
+    connection.executemany("INSERT INTO user (user_name) VALUES (?)", users)
+    connection.executemany("INSERT INTO artwork (artwork_id, title, artist_name, medium, category, min_bid) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", artworks)
+    connection.executemany("INSERT INTO bid (user_name, artwork_id, value) VALUES (?, ?, ?)", bids)
+    connection.execute("COMMIT")
+    print(f"Inserted {len(users)} users, {len(artworks)} artworks and {len(bids)} bids.")
+
+
+# Frequent queries of the application and the part of their query plan showing that they use the right index.
+HOT_QUERIES = [
+    ("number of bids on an artwork", "SELECT count(*) FROM bid WHERE artwork_id = 'ABC123'",
+     'INDEX ix_bid_artwork_id_value'),
+    ("highest bid on an artwork", "SELECT max(value) FROM bid WHERE artwork_id = 'ABC123'",
+     'INDEX ix_bid_artwork_id_value'),
+    ("bidders of an artwork by value", "SELECT user_name, value FROM bid WHERE artwork_id = 'ABC123' "
+                                       "ORDER BY value DESC", 'INDEX ix_bid_artwork_id_value'),
+    ("bids of a user", "SELECT artwork_id, value FROM bid WHERE user_name = 'Foo'", 'INDEX sqlite_autoindex_bid_1'),
+    ("artworks in a category", "SELECT * FROM artwork WHERE category = 'painting'", 'INDEX ix_artwork_category'),
+    ("artworks by an artist", "SELECT * FROM artwork WHERE artist_name = 'Eve Evans'", 'INDEX ix_artwork_artist_name'),
+    ("full-text artwork search", "SELECT artwork_id FROM artwork_fts WHERE artwork_fts MATCH 'sculpture'",
+     'artwork_fts VIRTUAL TABLE INDEX 0:M'),  # M: the full-text index is used for the MATCH
+]
+
+
+def check_query_plans(connection):
+    """Runs EXPLAIN QUERY PLAN on each of the HOT_QUERIES and returns True if they all use their index."""
+    all_ok = True
+    for description, query, expected_plan in HOT_QUERIES:
+        plan = " / ".join(row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {query}"))
+        ok = expected_plan in plan
+        all_ok = all_ok and ok
+        print(f"{'OK  ' if ok else 'FAIL'} {description}: {plan}")
+    return all_ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create or upgrade the gallery database.')
+    parser.add_argument('--db', default=db_path, help='path of the SQLite database file')
+    parser.add_argument('--sample-data', action='store_true', help='insert the sample data in an empty database')
+    parser.add_argument('--check', action='store_true', help='check the query plans of the frequent queries')
+    args = parser.parse_args()
+
+    # isolation_level=None: the transactions are handled explicitly in migrate()
+    db_connection = sqlite3.connect(args.db, isolation_level=None)
+    migrate(db_connection)
+    print(f"Schema version: {get_schema_version(db_connection)} (latest: {LATEST_VERSION})")
+    if args.sample_data:
+        insert_sample_data(db_connection)
+    if args.check and not check_query_plans(db_connection):
+        sys.exit(1)
+    db_connection.close()
@@ -0,0 +1,83 @@
+# export_catalog.py
+# Exports the artwork catalog to a read-only snapshot file (see actions/catalog_snapshot.py): the catalog
+# columns of the artwork table (not the bid statistics, which change with every bid), their indexes and the
+# full-text index, read in a single transaction of the database. The snapshot is written to a temporary file
+# next to the output, synced to disk, and then renamed over the output file, so the readers see either the
+# previous snapshot or the new one, never a partly written file. Run it again after the catalog changed:
+# the action servers and the web application switch to the new snapshot within a second.
+# Usage: python export_catalog.py [--db PATH] [--output catalog.db]
+# Resources consulted:
+# https://www.sqlite.org/lang_attach.html
+# https://www.sqlite.org/fts5.html#the_optimize_command
+# https://docs.python.org/3/library/os.html#os.replace
+# https://docs.python.org/3/library/os.html#os.fsync
+######################################
+import argparse
+import os
+import sqlite3
+
+from actions.db_models import db_path, ARTWORK_SEARCH_DDL
+
+_CATALOG_SCHEMA = [
+    """CREATE TABLE artwork (artwork_id VARCHAR(6) NOT NULL PRIMARY KEY, title VARCHAR(50),
+    artist_name VARCHAR(30), medium VARCHAR(50), category VARCHAR(20), min_bid INTEGER)""",
+    "CREATE INDEX ix_artwork_artist_name ON artwork (artist_name)",
+    "CREATE INDEX ix_artwork_category ON artwork (category)",
+    str(ARTWORK_SEARCH_DDL[0].statement),  # the artwork_fts table
+]
+_COPY_CATALOG_SQL = """INSERT INTO artwork (artwork_id, title, artist_name, medium, category, min_bid)
+SELECT artwork_id, title, artist_name, medium, category, min_bid FROM source.artwork ORDER BY artwork_id"""
+_INDEX_CATALOG_SQL = """INSERT INTO artwork_fts (artwork_id, title, artist_name, medium, category)
+SELECT artwork_id, title, artist_name, medium, category FROM artwork ORDER BY artwork_id"""
+
+
+def write_snapshot(source_path, path):
+    """Writes the snapshot of the catalog of the database source_path to a new file path and returns the
+    number of artworks."""
+    connection = sqlite3.connect(path, isolation_level=None)
+    try:
+        connection.execute("PRAGMA journal_mode=OFF")  # a new file: nothing to roll back to if it fails
+        connection.execute("ATTACH DATABASE ? AS source", (f'file:{os.path.abspath(source_path)}?mode=ro',))
+        connection.execute("BEGIN")  # the catalog is read in one transaction of the database
+        for statement in _CATALOG_SCHEMA:
+            connection.execute(statement)
+        connection.execute(_COPY_CATALOG_SQL)
+        connection.execute(_INDEX_CATALOG_SQL)
+        connection.execute("INSERT INTO artwork_fts (artwork_fts) VALUES ('optimize')")  # a single b-tree
+        connection.execute("COMMIT")
+        connection.execute("DETACH DATABASE source")
+        connection.execute("ANALYZE")
+        return connection.execute("SELECT count(*) FROM artwork").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def export_catalog(source_path, output_path):
+    """Publishes a new snapshot of the catalog at output_path and returns the number of artworks."""
+    output_path = os.path.abspath(output_path)
+    temporary_path = f'{output_path}.{os.getpid()}.tmp'
+    try:
+        artwork_count = write_snapshot(source_path, temporary_path)
+        with open(temporary_path, 'rb') as snapshot_file:
+            os.fsync(snapshot_file.fileno())
+        os.replace(temporary_path, output_path)  # atomic: the readers see the old or the new snapshot
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    directory = os.open(os.path.dirname(output_path), os.O_RDONLY)
+    try:
+        os.fsync(directory)  # makes the rename durable
+    finally:
+        os.close(directory)
+    return artwork_count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a read-only snapshot of the artwork catalog.')
+    parser.add_argument('--db', default=db_path, help='path of the SQLite database file')
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog.db'),
+                        help='path of the snapshot file')
+    args = parser.parse_args()
+
+    count = export_catalog(args.db, args.output)
+    print(f"Exported {count} artworks to {args.output}")
@@ -0,0 +1,35 @@
+# import_bids.py
+# Imports a batch of bids (e.g. the absentee and phone bids collected for an auction) from a CSV file
+# with the columns user_name, artwork_id, value (and a header row), then prints a report.
+# Usage: python import_bids.py bids.csv [--update-only]
+# Resources consulted:
+# https://docs.python.org/3/library/csv.html
+# https://docs.python.org/3/library/argparse.html
+######################################
+import argparse
+import csv
+from collections import Counter
+
+from actions import db_handler
+
+
+def read_bids(csv_path):
+    """Yields the triples (user_name, artwork_id, value) found in the CSV file. The missing columns of a short
+    row are read as empty strings, so the bid is reported as invalid instead of stopping the import."""
+    with open(csv_path, newline='') as csv_file:
+        for row in csv.DictReader(csv_file, restval=''):
+            yield row['user_name'].strip(), row['artwork_id'].strip().upper(), row['value'].strip()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import bids from a CSV file.')
+    parser.add_argument('csv_path', help='CSV file with the columns user_name, artwork_id, value')
+    parser.add_argument('--update-only', action='store_true', help='do not create bids that do not exist yet')
+    args = parser.parse_args()
+
+    results = db_handler.apply_bids(read_bids(args.csv_path), create_if_not_exists=not args.update_only)
+    for line_number, result in enumerate(results, start=2):  # line 1 is the header
+        if not result.written:
+            print(f"Line {line_number}: {result.message}")
+    counts = Counter(result.status for result in results)
+    print(f"{len(results)} bids read: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
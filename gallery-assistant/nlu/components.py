@@ -0,0 +1,88 @@
+# components.py
+# Custom components of the NLU pipeline (config.yml) for the fast path of fast_path.py.
+# FastPathClassifier comes first in the pipeline: when a message is a button payload or an artwork ID code
+# typed alone, it sets the intent (confidence 1) and the entities read from the text, and marks the message.
+# A Rasa pipeline always runs every component, so the featurizers and classifiers that follow are used through
+# the subclasses below, which skip the marked messages: the message is then not tokenized into features nor
+# run through the DIET and response selector models. They are trained and saved like the original components.
+# Set enabled: false in the configuration of FastPathClassifier to interpret every message with the model.
+# Resources consulted:
+# https://rasa.com/docs/rasa/2.x/components#custom-components
+# https://rasa.com/docs/rasa/2.x/custom-components
+# https://github.com/RasaHQ/rasa/blob/2.8.x/rasa/nlu/components.py
+###################################
+from typing import Any, Dict, Optional, Text
+
+from rasa.nlu.classifiers.classifier import IntentClassifier
+from rasa.nlu.classifiers.diet_classifier import DIETClassifier
+from rasa.nlu.featurizers.sparse_featurizer.count_vectors_featurizer import CountVectorsFeaturizer
+from rasa.nlu.featurizers.sparse_featurizer.lexical_syntactic_featurizer import LexicalSyntacticFeaturizer
+from rasa.nlu.featurizers.sparse_featurizer.regex_featurizer import RegexFeaturizer
+from rasa.nlu.selectors.response_selector import ResponseSelector
+from rasa.shared.nlu.constants import ENTITIES, INTENT, TEXT
+from rasa.shared.nlu.training_data.message import Message
+
+from . import fast_path
+
+FAST_PATH = 'fast_path'  # attribute of the messages interpreted by FastPathClassifier
+
+
+class FastPathClassifier(IntentClassifier):
+    """Sets the intent and entities of the button payloads and artwork ID codes typed alone (see fast_path.py).
+    The intents of the training data are saved with the model, so a payload of an unknown intent is left
+    to the other classifiers."""
+
+    defaults = {'enabled': True}
+
+    def __init__(self, component_config: Optional[Dict[Text, Any]] = None, intents=None):
+        super().__init__(component_config)
+        self.intents = set(intents or [])
+
+    def train(self, training_data, config=None, **kwargs: Any) -> None:
+        self.intents = set(training_data.intents)
+
+    def process(self, message: Message, **kwargs: Any) -> None:
+        if not self.component_config['enabled']:
+            return
+        result = fast_path.parse(message.get(TEXT) or '', self.intents)
+        if result is None:
+            return
+        message.set(INTENT, {'name': result.intent, 'confidence': 1.0}, add_to_output=True)
+        message.set(ENTITIES, [dict(entity, extractor=self.name) for entity in result.entities], add_to_output=True)
+        message.set(FAST_PATH, True)
+
+    def persist(self, file_name: Text, model_dir: Text) -> Optional[Dict[Text, Any]]:
+        return {'intents': sorted(self.intents)}
+
+    @classmethod
+    def load(cls, meta: Dict[Text, Any], model_dir: Text, model_metadata=None, cached_component=None,
+             **kwargs: Any) -> 'FastPathClassifier':
+        return cls(meta, meta.get('intents'))
+
+
+class SkipFastPath:
+    """Mixin of the components that do nothing for the messages interpreted by FastPathClassifier."""
+
+    def process(self, message: Message, **kwargs: Any) -> None:
+        if not message.get(FAST_PATH):
+            super().process(message, **kwargs)
+
+
+class FastPathRegexFeaturizer(SkipFastPath, RegexFeaturizer):
+    pass
+
+
+class FastPathLexicalSyntacticFeaturizer(SkipFastPath, LexicalSyntacticFeaturizer):
+    pass
+
+
+class FastPathCountVectorsFeaturizer(SkipFastPath, CountVectorsFeaturizer):
+    pass
+
+
+class FastPathDIETClassifier(SkipFastPath, DIETClassifier):
+    pass
+
+
+class FastPathResponseSelector(SkipFastPath, ResponseSelector):
+    pass
@@ -0,0 +1,59 @@
+# fast_path.py
+# Messages that the NLU model does not need to interpret. Most turns are either a button of the chatbot
+# (a payload such as /ask_artwork_info_card{"artwork_id": "ABC123"}, /inform{...} or /agree) or an artwork ID
+# code typed alone (e.g. ABC123 when the modify bid form asks for it), and their intent and entities can be
+# read from the text itself, with the same artwork ID code rule as the actions (is_valid_artwork_id()).
+# parse() recognizes these messages, and the pipeline components of components.py use it to skip the
+# featurizers and classifiers for them.
+# Resources consulted:
+# https://rasa.com/docs/rasa/responses#buttons  <-- format of the payloads
+# https://docs.python.org/3/library/re.html
+###################################
+import json
+import re
+from collections import namedtuple
+
+from actions.artwork_suggestions import ARTWORK_ID_PATTERN
+
+INFORM_INTENT = 'inform'  # intent of an artwork ID code typed alone (filled in the forms from this intent)
+ARTWORK_ID_ENTITY = 'artwork_id'
+
+FastPathParse = namedtuple('FastPathParse', ['intent', 'entities'])
+# /intent, optionally followed by @confidence and by a JSON object of the entities (like the Rasa payloads)
+_PAYLOAD_PATTERN = re.compile(r'^/([^{@\s]+)(@[0-9.]+)?(\{.*\})?$', re.DOTALL)
+
+
+def _payload_entities(match, offset):
+    """Returns the entities of the JSON object of a payload, or None if it is not a valid JSON object."""
+    if match.group(3) is None:
+        return []
+    try:
+        values = json.loads(match.group(3))
+    except ValueError:
+        return None
+    if not isinstance(values, dict):
+        return None
+    start, end = (position + offset for position in match.span(3))
+    entities = []
+    for name, value in values.items():
+        for entity_value in value if isinstance(value, list) else [value]:
+            entities.append({'entity': name, 'value': entity_value, 'start': start, 'end': end})
+    return entities
+
+
+def parse(text: str, intents=None):
+    """Returns the FastPathParse (intent name, list of entities) of a button payload or of an artwork ID code
+    typed alone, or None if the message must be interpreted by the NLU model. intents is the set of the
+    intents of the model: a payload of another intent is left to the model (None: any intent)."""
+    offset = len(text) - len(text.lstrip())  # the entity positions are in the text as received
+    text = text.strip()
+    if text.startswith('/'):
+        match = _PAYLOAD_PATTERN.match(text)
+        if match is None or (intents is not None and match.group(1) not in intents):
+            return None
+        entities = _payload_entities(match, offset)
+        return None if entities is None else FastPathParse(match.group(1), entities)
+    if ARTWORK_ID_PATTERN.match(text):
+        return FastPathParse(INFORM_INTENT, [{'entity': ARTWORK_ID_ENTITY, 'value': text, 'start': offset,
+                                              'end': offset + len(text)}])
+    return None
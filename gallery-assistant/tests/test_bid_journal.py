@@ -0,0 +1,64 @@
+# test_bid_journal.py
+# Replay of the bid journal (actions/bid_journal.py) after the journal file was emptied: the bids flushed
+# before must be durably in the database file, and the bids journaled after must be written by the replay.
+# Usage (from the gallery-assistant directory):
+#   python -m pytest tests
+# Resources consulted:
+# https://docs.pytest.org/en/stable/how-to/tmp_path.html
+# https://docs.pytest.org/en/stable/how-to/monkeypatch.html
+###################################
+import shutil
+import sqlite3
+
+from actions import bid_journal
+from actions.bid_journal import BidJournal, read_journal
+from benchmarks.bench_bid_journal import bid_table, make_bids, use_sync_database
+from benchmarks.generate_dataset import generate_database
+
+
+def stop_threads(journal):
+    """Stops the threads of a journal without flushing it, like a crash of the action server."""
+    with journal._condition:
+        journal._closing = True
+        journal._condition.notify_all()
+    for thread in journal._threads:
+        thread.join()
+
+
+def test_replay_after_truncation(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'gallery.db')
+    journal_path = str(tmp_path / 'bids.journal')
+    generate_database(db_path, 50, 50, 0)
+    engine = use_sync_database(db_path)
+    # Another connection reading in WAL mode stays open, like those of the action server: the sessions closing
+    # their connections do not checkpoint the write-ahead log then (SQLite does it when the last one is closed)
+    other_connection = sqlite3.connect(db_path)
+    other_connection.execute('PRAGMA journal_mode=WAL')
+    assert other_connection.execute("SELECT count(*) FROM bid").fetchone() == (0,)
+    monkeypatch.setattr(bid_journal, 'JOURNAL_MAX_BYTES', 1)  # emptied at the first group once all is flushed
+
+    bids = make_bids(db_path, 30, 0)
+    flushed_bids, journaled_bids = bids[:20], bids[20:]
+
+    journal = BidJournal(journal_path, flush_interval=3600)
+    assert journal.open() == 0
+    for bid in flushed_bids:
+        assert journal.submit_bid(*bid).written
+    assert journal.flush() == len(flushed_bids)
+    for bid in journaled_bids:  # the first group empties the journal file, the bids are not flushed
+        assert journal.submit_bid(*bid).written
+    stop_threads(journal)
+    assert [record[0] for record in read_journal(journal_path)] == list(range(21, 31))
+
+    # The database file alone, without its write-ahead log, has the bids flushed before the truncation
+    shutil.copyfile(db_path, tmp_path / 'copy.db')
+    with sqlite3.connect(tmp_path / 'copy.db') as connection:
+        assert connection.execute("SELECT count(*) FROM bid").fetchone()[0] == len(flushed_bids)
+
+    reopened = BidJournal(journal_path, flush_interval=3600)
+    assert reopened.open() == len(journaled_bids)
+    reopened.close()
+    assert bid_table(db_path) == sorted(flushed_bids + journaled_bids)
+    journal._file.close()
+    other_connection.close()
+    engine.dispose()
@@ -9,11 +9,179 @@
 # https://realpython.com/flask-by-example-part-1-project-setup/
 # https://blog.miguelgrinberg.com/post/the-flask-mega-tutorial-part-i-hello-world
 # https://www.tutorialspoint.com/flask/flask_templates.htm
+# https://flask.palletsprojects.com/en/2.0.x/api/#flask.json.jsonify
+# https://flask.palletsprojects.com/en/2.0.x/api/#flask.send_from_directory
+# https://flask.palletsprojects.com/en/2.0.x/api/#flask.Flask.template_global
+# https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control#immutable
+# https://developer.mozilla.org/en-US/docs/Web/HTTP/Conditional_requests
+# https://werkzeug.palletsprojects.com/en/3.0.x/wrappers/#werkzeug.wrappers.Request.if_none_match
+# https://www.rfc-editor.org/rfc/rfc9110#name-conditional-requests
+# https://html.spec.whatwg.org/multipage/server-sent-events.html
+# https://flask.palletsprojects.com/en/3.0.x/patterns/streaming/
+# https://flask.palletsprojects.com/en/3.0.x/quickstart/#sessions
 ############################################
-from flask import Flask, render_template, redirect
+import functools
+import gzip
+import json
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+
+from flask import Flask, Response, render_template, redirect, request, session, jsonify, send_from_directory, url_for, \
+    abort
+
+import image_pipeline
+
+# The web application uses the same database (and query functions) as the chatbot's action server
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gallery-assistant'))
+from actions import db_handler  # noqa: E402
+from actions.catalog_cache import CatalogCache  # noqa: E402
+from actions.bid_events import artwork_stats, bid_state  # noqa: E402
+from actions.bid_event_relay import BidEventRelay  # noqa: E402
 
 # create application object
 app = Flask(__name__)
+# Key signing the session cookie, which holds the name of the user signed in (see signed_in_user_only())
+app.secret_key = os.environ.get('GALLERY_SECRET_KEY')
+SESSION_USER_KEY = 'user_name'
+
+# Thumbnails and web-sized versions of the images (see image_pipeline.py). Their file names contain a hash
+# of their content, so the browsers may keep them forever.
+image_manifest = image_pipeline.ImageManifest()
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # seconds
+_image_build_lock = threading.Lock()  # an image added after the build is resized by one request only
+
+
+# The JSON read API (/api/artworks, /api/users/<user_name>/bids) is polled by the bidding portal. Every
+# response carries an ETag and a Last-Modified date made from the change counters of the database (see
+# ChangeCounter in db_models.py), which the triggers increase on every change of the catalog or of the bids,
+# whatever process made it. A client sending back the ETag (If-None-Match) or the date (If-Modified-Since)
+# gets an empty 304 response, after a single primary key read, as long as the data did not change. The
+# bodies sent are kept for the current versions of the counters, gzipped once.
+API_CACHE_SIZE = 512  # number of API responses kept in memory
+api_response_cache = CatalogCache(max_size=API_CACHE_SIZE, ttl=db_handler.CATALOG_CACHE_TTL)
+GZIP_MIN_SIZE = 512  # bytes: smaller bodies are sent uncompressed
+MAX_PAGE_SIZE = 500  # largest limit accepted by the paginated endpoints
+# The auctions are sealed-bid: anyone may know the number of bids on an artwork, but not their values
+# (see utter_faq_privacy in domain.yml), so the highest bid is never sent
+PRIVATE_ARTWORK_FIELDS = {'highest_bid'}
+
+
+def _json_bytes(data):
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def versioned_json(*counters):
+    """Decorator for the API views that return data depending only on the given change counters ('catalog',
+    'bids'): the view returns the data to send as JSON, or None for a 404 response. It is only called when the
+    client does not have the current version and the response is not in api_response_cache."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            change_counts = db_handler.get_change_counters()
+            versions = tuple(change_counts[name].version for name in counters)
+            etag = '-'.join(f'{name}{version}' for name, version in zip(counters, versions))
+            # HTTP dates have no fraction of second: rounded up, so that a change made in the second
+            # following a response is not hidden (it is then sent again once)
+            changed_at = max(change_counts[name].changed_at for name in counters)
+            last_modified = datetime.fromtimestamp(int(changed_at) + 1, timezone.utc)
+            if request.if_none_match:  # has precedence over If-Modified-Since
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+            if not_modified:
+                response = Response(status=304)
+            else:
+                key = (request.full_path, versions)
+                bodies = api_response_cache.get(key)
+                if bodies is None:
+                    data = view(**kwargs)
+                    if data is None:
+                        return jsonify(error='not found'), 404
+                    body = _json_bytes(data)
+                    bodies = (body, gzip.compress(body, 6) if len(body) >= GZIP_MIN_SIZE else None)
+                    api_response_cache.put(key, bodies)
+                body, gzipped_body = bodies
+                response = Response(body, mimetype='application/json')
+                if gzipped_body is not None and 'gzip' in request.accept_encodings:
+                    response.set_data(gzipped_body)
+                    response.content_encoding = 'gzip'
+            # weak: the gzipped and plain bodies of a version have the same ETag
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True  # the clients may keep the response but must revalidate it
+            response.vary.add('Accept-Encoding')
+            return response
+        return wrapper
+    return decorator
+
+
+def _public_artwork(artwork):
+    """Fields of an ArtworkInfo that the API may send."""
+    return {field: value for field, value in artwork._asdict().items() if field not in PRIVATE_ARTWORK_FIELDS}
+
+
+def signed_in_user_only(view):
+    """Decorator for the views of /api/users/<user_name>/... (the bids of a user and their stream): the bids of a
+    user are private, so they are only sent to the user signed in (session[SESSION_USER_KEY]), and the other
+    clients get a 403 response. It comes before versioned_json(), so that neither a 304 response nor a cached
+    body is sent to another client, and the responses may only be kept by the browser of the user. The web
+    application has no login page yet: until one sets the session user, these endpoints answer 403 to everyone."""
+    @functools.wraps(view)
+    def wrapper(user_name, **kwargs):
+        if session.get(SESSION_USER_KEY) != user_name:
+            return jsonify(error='forbidden'), 403
+        response = app.make_response(view(user_name=user_name, **kwargs))
+        response.cache_control.private = True
+        response.vary.add('Cookie')
+        return response
+    return wrapper
+
+
+def _page_arguments():
+    """Returns the arguments (after, limit) of a paginated endpoint, or aborts with 400 if limit is invalid."""
+    try:
+        limit = int(request.args.get('limit', db_handler.ARTWORK_PAGE_SIZE))
+    except ValueError:
+        abort(400)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        abort(400)
+    return request.args.get('after'), limit
+
+
+# Live bid updates streamed with Server-Sent Events (/api/artworks/<artwork_id>/events and
+# /api/users/<user_name>/events): every stream subscribes to the channels of the hub of actions/bid_events.py,
+# which the relay thread feeds with the changes of the database, so the watchers cost no query of their own.
+bid_event_hub = db_handler.bid_event_hub
+bid_event_relay = BidEventRelay(bid_event_hub)
+SSE_HEARTBEAT_INTERVAL = 15  # seconds without events before a comment is sent, so the proxies keep the stream open
+SSE_RETRY = 3000  # milliseconds before the browser reconnects after the stream was cut
+
+
+def _sse(event, data):
+    """Formats a Server-Sent Event."""
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+def _event_stream_response(events):
+    """Streams the generator of Server-Sent Events."""
+    response = Response(events, mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx must not buffer the stream
+    return response
+
+
+@app.template_global()
+def image_url(name, variant='thumb'):
+    """URL of a variant ('thumb' or 'web') of the image static/images/name, used in the templates:
+    the derivative listed in the manifest, or the URL that builds it if the image is new."""
+    derivative = image_manifest.get(name, variant)
+    if derivative is not None:
+        return url_for('derived_image', file_name=derivative['file'])
+    if not os.path.exists(os.path.join(image_pipeline.SOURCE_DIR, name)):
+        return url_for('static', filename=f'images/{name}')
+    return url_for('image_variant', variant=variant, name=name)
 
 
 # with the @ decorator, we link a specific url to the function that follows
@@ -27,6 +195,177 @@ def artwork_search():
     return render_template("artwork-search.html")
 
 
+@app.route('/api/search')
+def api_search():
+    """Full-text search over the artwork catalog, e.g. /api/search?q=Eve+Evans+sculptures&page=1&per_page=10"""
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 10))
+    except ValueError:
+        return jsonify(error='page and per_page must be integers'), 400
+    search_page = db_handler.search_artworks(request.args.get('q', ''), page, per_page)
+    return jsonify(query=search_page.query, page=search_page.page, per_page=search_page.per_page,
+                   total=search_page.total, results=[result._asdict() for result in search_page.results])
+
+
+@app.route('/api/artworks')
+@versioned_json('catalog', 'bids')
+def api_artworks():
+    """Page of the catalog with the bid statistics, e.g. /api/artworks?limit=20&after=BAR002 (the last
+    artwork_id of the previous page); next is the value of after for the next page (null on the last page)."""
+    after, limit = _page_arguments()
+    artworks = db_handler.get_artworks(after, limit)
+    return {'artworks': [_public_artwork(artwork) for artwork in artworks],
+            'next': artworks[-1].artwork_id if len(artworks) == limit else None}
+
+
+@app.route('/api/artworks/<artwork_id>')
+@versioned_json('catalog', 'bids')
+def api_artwork(artwork_id):
+    """Catalog information and bid statistics of an artwork."""
+    artwork = db_handler.get_artwork_info(artwork_id, cached=False)
+    return None if artwork is None else _public_artwork(artwork)
+
+
+@app.route('/api/artworks/<artwork_id>/stats')
+@versioned_json('catalog', 'bids')
+def api_artwork_stats(artwork_id):
+    """Bid statistics of an artwork: minimum bid and number of bids."""
+    artwork = db_handler.get_artwork_info(artwork_id, cached=False)
+    return None if artwork is None else artwork_stats(artwork)  # the data of the 'stats' events
+
+
+@app.route('/api/users/<user_name>/bids')
+@signed_in_user_only
+@versioned_json('bids')
+def api_user_bids(user_name):
+    """Page of the bids of the user signed in, in artwork id order, e.g. /api/users/Foo/bids?limit=20&after=BAR002."""
+    after, limit = _page_arguments()
+    bids = db_handler.get_bids_for_user(user_name, after, limit)
+    return {'user_name': user_name, 'bids': [{'artwork_id': artwork_id, 'value': value} for artwork_id, value in bids],
+            'next': bids[-1][0] if len(bids) == limit else None}
+
+
+@app.route('/api/artworks/<artwork_id>/events')
+def artwork_events(artwork_id):
+    """Stream of the bid statistics of an artwork: a 'stats' event (same data as /api/artworks/<id>/stats)
+    when the stream starts and whenever they change."""
+    subscription = bid_event_hub.subscribe([('artwork', artwork_id)])
+    artwork = db_handler.get_artwork_info(artwork_id, cached=False)  # read after subscribing: no change is missed
+    if artwork is None:
+        bid_event_hub.unsubscribe(subscription)
+        return jsonify(error='not found'), 404
+    bid_event_hub.seed(('artwork', artwork_id), {artwork_id: artwork_stats(artwork)})
+    bid_event_relay.start()
+
+    def events():
+        try:
+            yield f'retry: {SSE_RETRY}\n\n'
+            yield _sse('stats', artwork_stats(artwork))
+            while True:
+                event = subscription.get(SSE_HEARTBEAT_INTERVAL)
+                yield ': keep-alive\n\n' if event is None else _sse('stats', event[2])
+        finally:  # the client left
+            bid_event_hub.unsubscribe(subscription)
+    return _event_stream_response(events())
+
+
+@app.route('/api/users/<user_name>/events')
+@signed_in_user_only
+def user_events(user_name):
+    """Stream of the bids of the user signed in: a 'bid' event for every bid of the user when the stream starts and
+    whenever one is placed or changed (value null if the bid was deleted), and a 'stats' event with the bid
+    statistics of the artworks the user bid on, with outbid true when someone else placed a higher bid (the
+    highest bid itself is only compared here, never sent)."""
+    subscription = bid_event_hub.subscribe([('user', user_name)])
+    values = {bid.artwork_id: bid.value for bid in db_handler.get_bids_for_users([user_name])}
+    bid_event_hub.seed(('user', user_name),
+                       {artwork_id: bid_state(artwork_id, value) for artwork_id, value in values.items()})
+    bid_event_relay.start()
+    stats = {}  # artwork_id -> artwork_stats() of the artworks the user bid on
+    highest_bids = {}  # artwork_id -> highest bid
+    sent = {}  # artwork_id -> data of the last 'stats' event sent
+
+    def watch_artworks(artwork_ids):
+        """Subscribes to the statistics and highest bids of artworks and returns their 'stats' events."""
+        for artwork_id in artwork_ids:
+            bid_event_hub.add_channel(subscription, ('artwork', artwork_id))
+            bid_event_hub.add_channel(subscription, ('highest_bid', artwork_id))
+        artworks = db_handler.get_artworks_by_id(artwork_ids)
+        for artwork in artworks:
+            stats[artwork.artwork_id] = artwork_stats(artwork)
+            highest_bids[artwork.artwork_id] = artwork.highest_bid
+            bid_event_hub.seed(('artwork', artwork.artwork_id), {artwork.artwork_id: stats[artwork.artwork_id]})
+            bid_event_hub.seed(('highest_bid', artwork.artwork_id), {artwork.artwork_id: artwork.highest_bid})
+        return [event for event in map(stats_event, (artwork.artwork_id for artwork in artworks)) if event]
+
+    def stats_event(artwork_id):
+        """Returns the 'stats' event of an artwork, or None if it is the same as the last one sent (e.g. a higher
+        bid of someone else on an artwork that the user was already outbid on is not even announced)."""
+        if artwork_id not in stats:
+            return None
+        value, highest_bid = values.get(artwork_id), highest_bids.get(artwork_id)
+        outbid = value is not None and highest_bid is not None and highest_bid > value
+        data = dict(stats[artwork_id], your_bid=value, outbid=outbid)
+        if sent.get(artwork_id) == data:
+            return None
+        sent[artwork_id] = data
+        return _sse('stats', data)
+
+    def events():
+        try:
+            yield f'retry: {SSE_RETRY}\n\n'
+            for artwork_id, value in values.items():
+                yield _sse('bid', bid_state(artwork_id, value))
+            yield from watch_artworks(list(values))
+            while True:
+                event = subscription.get(SSE_HEARTBEAT_INTERVAL)
+                if event is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                (kind, _), artwork_id, state = event
+                if kind == 'user':
+                    new_artwork = artwork_id not in values
+                    values[artwork_id] = state['value']
+                    yield _sse('bid', state)
+                    if new_artwork:
+                        yield from watch_artworks([artwork_id])
+                        continue
+                elif kind == 'artwork':
+                    stats[artwork_id] = state
+                else:  # 'highest_bid'
+                    highest_bids[artwork_id] = state
+                changed_stats = stats_event(artwork_id)  # outbid may have changed with the bid of the user too
+                if changed_stats is not None:
+                    yield changed_stats
+        finally:  # the client left
+            bid_event_hub.unsubscribe(subscription)
+    return _event_stream_response(events())
+
+
+@app.route('/images/<variant>/<name>')
+def image_variant(variant, name):
+    """Builds the derivatives of an image that was added after the last run of image_pipeline.py,
+    then redirects to the content-hashed file."""
+    if variant not in image_pipeline.VARIANTS or name not in image_pipeline.source_images():
+        abort(404)
+    with _image_build_lock:
+        derivative = image_manifest.get(name, variant)
+        if derivative is None:
+            image_manifest.update({name: image_pipeline.build_image(name)})
+            derivative = image_manifest.get(name, variant)
+    return redirect(url_for('derived_image', file_name=derivative['file']))
+
+
+@app.route('/derived/<file_name>')
+def derived_image(file_name):
+    """Serves a derivative, which never changes (a new version gets another name)."""
+    response = send_from_directory(image_pipeline.DERIVED_DIR, file_name, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route('/bidding-portal')
 def bidding_portal():
     return render_template("bidding-portal.html")
@@ -0,0 +1,184 @@
+# image_pipeline.py
+# Resized versions (derivatives) of the images of static/images, which are photos of several megabytes
+# shown 200 to 250 pixels high in the pages. For every image, a thumbnail (for the gallery and search pages)
+# and a web-sized version are saved as JPEG files in the derived directory, under names containing a hash
+# of their content (e.g. 1_artwork_1.thumb.3f2a9c1b7d4e.jpg), so a file name never changes content and
+# the browsers can cache the files forever. The manifest (derived/manifest.json) gives the file of every
+# image and variant, and is used by the templates (see image_url() in app.py).
+# The derivatives are built ahead of time with this script, using a pool of worker processes; the images
+# added afterwards get their derivatives when they are first requested (see app.py).
+# Usage: python image_pipeline.py [--workers N] [--force]
+# Resources consulted:
+# https://pillow.readthedocs.io/en/stable/reference/Image.html#PIL.Image.Image.thumbnail
+# https://pillow.readthedocs.io/en/stable/reference/ImageOps.html#PIL.ImageOps.exif_transpose
+# https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html#jpeg-saving
+# https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor
+# https://web.dev/articles/love-your-cache  <-- content-hashed names and immutable caching
+############################################
+import argparse
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(BASE_DIR, 'static', 'images')
+DERIVED_DIR = os.environ.get('GALLERY_DERIVED_DIR', os.path.join(BASE_DIR, 'derived'))
+MANIFEST_PATH = os.path.join(DERIVED_DIR, 'manifest.json')
+
+# Largest width and height of each variant, in pixels. The thumbnails are shown 250 pixels high, so they
+# have enough pixels for screens with a device pixel ratio of 2.
+VARIANTS = {'thumb': 640, 'web': 1600}
+JPEG_QUALITY = 82
+HASH_LENGTH = 12  # hexadecimal digits of the content hash in the file names
+MANIFEST_CHECK_INTERVAL = 1.0  # seconds between two checks for a new manifest file
+
+
+def file_hash(path):
+    """Returns the SHA-256 of the content of a file (hexadecimal)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as image_file:
+        for block in iter(lambda: image_file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomically(path, data):
+    """Writes data to a temporary file next to path, then renames it to path."""
+    temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporary_path, 'wb') as output_file:
+        output_file.write(data)
+    os.replace(temporary_path, path)
+
+
+def resize(image, size):
+    """Returns the JPEG data of the image reduced to fit in size x size pixels (never enlarged)."""
+    image = ImageOps.exif_transpose(image)  # the photos may be stored rotated, with the orientation in EXIF
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.thumbnail((size, size), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)  # without the metadata
+    return output.getvalue(), image.size
+
+
+def build_image(name):
+    """Saves the derivatives of the image static/images/name and returns its manifest entry:
+    {'source': hash of the image, 'variants': {variant: {'file', 'width', 'height', 'bytes'}}}."""
+    source_path = os.path.join(SOURCE_DIR, name)
+    os.makedirs(DERIVED_DIR, exist_ok=True)
+    entry = {'source': file_hash(source_path), 'variants': {}}
+    stem = os.path.splitext(name)[0]
+    with Image.open(source_path) as image:
+        image.draft('RGB', (max(VARIANTS.values()),) * 2)  # lets the JPEG decoder skip the detail not needed
+        for variant, size in VARIANTS.items():
+            data, (width, height) = resize(image, size)
+            file_name = f'{stem}.{variant}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}.jpg'
+            if not os.path.exists(os.path.join(DERIVED_DIR, file_name)):
+                _write_atomically(os.path.join(DERIVED_DIR, file_name), data)
+            entry['variants'][variant] = {'file': file_name, 'width': width, 'height': height, 'bytes': len(data)}
+    return entry
+
+
+def source_images():
+    """Returns the names of the images of static/images."""
+    return sorted(name for name in os.listdir(SOURCE_DIR)
+                  if os.path.splitext(name)[1].lower() in ('.jpg', '.jpeg', '.png'))
+
+
+class ImageManifest:
+    """Manifest of the derivatives, shared by the processes of the web application: it is read again
+    when another process (or the build script) saved a new version."""
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self._entries = {}
+        self._mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            with open(self.path) as manifest_file:
+                self._entries = json.load(manifest_file)
+            self._mtime = mtime
+
+    def entries(self):
+        """Returns the dictionary {image name: entry} (see build_image())."""
+        now = time.monotonic()
+        if now >= self._next_check:
+            with self._lock:
+                self._reload()
+                self._next_check = now + MANIFEST_CHECK_INTERVAL
+        return self._entries
+
+    def get(self, name, variant):
+        """Returns the derivative {'file', 'width', 'height', 'bytes'} of an image, or None if not built yet."""
+        entry = self.entries().get(name)
+        return None if entry is None else entry['variants'].get(variant)
+
+    def _save(self, entries):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        _write_atomically(self.path, json.dumps(entries, indent=1, sort_keys=True).encode())
+        self._entries = entries
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def update(self, new_entries):
+        """Adds (or replaces) the entries of some images and saves the manifest."""
+        with self._lock:
+            self._reload()  # keeps the entries saved by the other processes
+            self._save(dict(self._entries, **new_entries))
+
+    def replace(self, entries):
+        """Saves a manifest with only the given entries."""
+        with self._lock:
+            self._save(entries)
+
+
+def build_all(workers=None, force=False):
+    """Builds the derivatives of the images that are new or changed since the last build (of every image
+    with force=True) with a pool of worker processes, deletes the derivatives that are not used anymore,
+    and saves the manifest. Returns the list of the images built."""
+    os.makedirs(DERIVED_DIR, exist_ok=True)
+    manifest = ImageManifest()
+    entries = manifest.entries()
+    names = [name for name in source_images()
+             if force or name not in entries or entries[name]['source'] != file_hash(os.path.join(SOURCE_DIR, name))
+             or not all(os.path.exists(os.path.join(DERIVED_DIR, derivative['file']))
+                        for derivative in entries[name]['variants'].values())]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        built = dict(zip(names, pool.map(build_image, names)))
+    sources = set(source_images())
+    entries = {name: entry for name, entry in dict(entries, **built).items() if name in sources}
+    manifest.replace(entries)
+    used = {derivative['file'] for entry in entries.values() for derivative in entry['variants'].values()}
+    for file_name in os.listdir(DERIVED_DIR):
+        if file_name.endswith('.jpg') and file_name not in used:
+            os.remove(os.path.join(DERIVED_DIR, file_name))
+    return list(built)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the thumbnails and web-sized versions of the images.')
+    parser.add_argument('--workers', type=int, help='number of worker processes (by default, one per CPU)')
+    parser.add_argument('--force', action='store_true', help='build the derivatives of every image again')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    built_images = build_all(args.workers, args.force)
+    entries_built = ImageManifest().entries()
+    source_bytes = sum(os.path.getsize(os.path.join(SOURCE_DIR, name)) for name in entries_built)
+    print(f"Built the derivatives of {len(built_images)} images in {time.perf_counter() - start:.1f} s")
+    for variant in VARIANTS:
+        variant_bytes = sum(entry['variants'][variant]['bytes'] for entry in entries_built.values())
+        print(f"{variant}: {variant_bytes / 1024:.0f} KB for {len(entries_built)} images "
+              f"({variant_bytes / max(source_bytes, 1):.1%} of the original images)")